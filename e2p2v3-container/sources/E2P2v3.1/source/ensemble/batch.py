@@ -0,0 +1,109 @@
+"""
+Name:         batch
+Description:  The batch module collects the input files of a multi-file run: files, directories
+              of FASTA files, glob patterns and manifest files listing one input per line. Inputs
+              are ordered by residue count, largest first, so that the longest searches start
+              first and short ones fill the CPUs left at the end.
+
+"""
+
+import glob
+import os
+
+import fasta
+
+# Suffixes of the FASTA files taken from a directory, before any compression suffix.
+fasta_suffixes = (".fa", ".faa", ".fas", ".fasta", ".fsa", ".pep", ".aa", ".prot")
+
+
+class InputError(Exception):
+    """
+    Raised when an input names no file.
+    """
+
+
+def is_pattern(spec):
+    return any(c in spec for c in "*?[")
+
+
+def base_name(path):
+    # The file name of an input without its compression suffix.
+    name, suffix = os.path.splitext(os.path.basename(path))
+    if suffix in fasta.compressed_suffixes:
+        return name
+    return name + suffix
+
+
+def is_fasta_name(name):
+    return base_name(name).lower().endswith(fasta_suffixes)
+
+
+def read_manifest(path):
+    """
+    Returns the inputs listed in a manifest file, one per line, skipping blank lines and lines
+    starting with "#". Relative paths are relative to the manifest.
+    """
+    specs = []
+    with open(path) as fp:
+        for line in fp:
+            line = line.strip()
+            if line and not line.startswith("#"):
+                specs.append(os.path.join(os.path.dirname(os.path.abspath(path)), line))
+    return specs
+
+
+def expand_inputs(specs):
+    """
+    Returns the absolute paths of the files named by specs, in order and without repeats: files
+    as they are, the FASTA files of directories and the files matching glob patterns other than
+    input indexes, sorted.
+    Raises InputError when a spec names no file.
+    """
+    paths = []
+    for spec in specs:
+        if os.path.isdir(spec):
+            found = sorted(os.path.join(spec, name) for name in os.listdir(spec)
+                           if is_fasta_name(name) and os.path.isfile(os.path.join(spec, name)))
+        elif is_pattern(spec):
+            # The cached indexes of the inputs sit next to them.
+            found = sorted(path for path in glob.glob(spec) if os.path.isfile(path) and not path.endswith(fasta.index_suffix))
+        elif os.path.isfile(spec):
+            found = [spec]
+        else:
+            found = []
+        if not found:
+            raise InputError("no input file found for %s" % (spec))
+        paths.extend(os.path.abspath(path) for path in found)
+    seen = set()
+    return [path for path in paths if not (path in seen or seen.add(path))]
+
+
+def measure(path):
+    """
+    Returns the number of sequences and residues of a FASTA file. The index of the file is read,
+    or built and cached next to it, so the run of the file reuses it.
+    """
+    file_signature = fasta.signature(path)
+    index = fasta.read_index(path, file_signature)
+    if index is None:
+        input = fasta.InputFile(path)
+        try:
+            index = list(fasta.index_records(input))
+        finally:
+            input.close()
+        fasta.write_index(path, file_signature, index)
+    return len(index), sum(residues for id, offset, length, residues in index)
+
+
+def output_names(output_dir, paths):
+    """
+    Returns the output file of each input in output_dir: its name without compression suffix,
+    followed by .E2P2v3.out. Raises InputError when two inputs would share an output.
+    """
+    outputs = [os.path.join(output_dir, base_name(path) + ".E2P2v3.out") for path in paths]
+    seen = {}
+    for path, output in zip(paths, outputs):
+        if output in seen:
+            raise InputError("%s and %s would both be written to %s" % (seen[output], path, output))
+        seen[output] = path
+    return outputs
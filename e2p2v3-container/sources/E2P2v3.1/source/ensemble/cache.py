@@ -0,0 +1,124 @@
+"""
+Name:         cache
+Description:  The cache module keeps the level-0 classifier results (BLAST best hit, PRIAM EF
+              classes) of protein sequences in an on-disk SQLite database, so that sequences already
+              annotated by an earlier run are not searched again. Entries are keyed by a hash of the
+              normalized sequence and of the reference data version, and the least recently used
+              entries are evicted once the cache holds more than a set number of sequences.
+
+"""
+
+import hashlib
+import sqlite3
+import time
+
+# Number of keys looked up per query, below the SQLite limit on query parameters.
+lookup_batch = 500
+
+
+def data_version(name, paths):
+    """
+    Returns a version string for the reference data: its name followed by a checksum of the
+    given files.
+    """
+    checksum = hashlib.md5()
+    for path in paths:
+        with open(path, 'rb') as fp:
+            for block in iter(lambda: fp.read(1 << 20), b''):
+                checksum.update(block)
+    return "%s:%s" % (name, checksum.hexdigest())
+
+
+def sequence_key(sequence, version):
+    """
+    Returns the cache key of a protein sequence: whitespace, case and a trailing stop codon do
+    not change the key.
+    """
+    normalized = "".join(sequence.split()).upper().rstrip("*")
+    return hashlib.sha1((version + "\n" + normalized).encode('ascii')).hexdigest()
+
+
+def encode_blast(hit):
+    if hit is None:
+        return None
+    evalue, efs = hit
+    return "%r\t%s" % (evalue, "|".join(efs))
+
+
+def decode_blast(value):
+    if value is None:
+        return None
+    evalue, efs = value.split("\t")
+    return float(evalue), [ef for ef in efs.split("|") if ef]
+
+
+def encode_priam(hits):
+    if hits is None:
+        return None
+    return "|".join(hits)
+
+
+def decode_priam(value):
+    if value is None:
+        return None
+    return [ef for ef in value.split("|") if ef]
+
+
+class Cache(object):
+    """
+    Per-sequence cache of level-0 results. A BLAST result is the (e-value, EF classes) of the
+    sequence's best hit before any e-value cutoff, and a PRIAM result is its list of EF classes;
+    either is None when the classifier reported nothing for the sequence.
+    """
+    def __init__(self, path, max_entries):
+        self.max_entries = max_entries
+        self.hits = 0
+        self.misses = 0
+        self.stored = 0
+        self.evicted = 0
+        # Concurrent runs sharing the cache wait for each other's writes.
+        self.db = sqlite3.connect(path, timeout=600)
+        self.db.execute("CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, blast TEXT, priam TEXT, used REAL)")
+        self.db.execute("CREATE INDEX IF NOT EXISTS entries_used ON entries (used)")
+        self.db.commit()
+
+    def lookup(self, keys):
+        """
+        Returns a dictionary mapping the cached keys among keys to their (BLAST, PRIAM) results,
+        and marks them as recently used.
+        """
+        keys = list(set(keys))
+        found = {}
+        for i in range(0, len(keys), lookup_batch):
+            batch = keys[i:i + lookup_batch]
+            query = "SELECT key, blast, priam FROM entries WHERE key IN (%s)" % ",".join("?" * len(batch))
+            for key, blast, priam in self.db.execute(query, batch):
+                found[key] = (decode_blast(blast), decode_priam(priam))
+        now = time.time()
+        self.db.executemany("UPDATE entries SET used = ? WHERE key = ?", [(now, key) for key in found])
+        self.db.commit()
+        self.hits += len(found)
+        self.misses += len(keys) - len(found)
+        return found
+
+    def store(self, entries):
+        """
+        Stores an iterable of (key, BLAST result, PRIAM result) and evicts the least recently
+        used entries beyond the size limit.
+        """
+        now = time.time()
+        rows = [(key, encode_blast(blast), encode_priam(priam), now) for key, blast, priam in entries]
+        self.db.executemany("INSERT OR REPLACE INTO entries (key, blast, priam, used) VALUES (?, ?, ?, ?)", rows)
+        self.stored += len(rows)
+        count = self.db.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        if self.max_entries and count > self.max_entries:
+            excess = count - self.max_entries
+            self.db.execute("DELETE FROM entries WHERE key IN (SELECT key FROM entries ORDER BY used LIMIT ?)", (excess,))
+            self.evicted += excess
+        self.db.commit()
+
+    def close(self):
+        self.db.close()
+
+    def report(self):
+        return "%d hits, %d misses, %d stored, %d evicted" % (self.hits, self.misses, self.stored, self.evicted)
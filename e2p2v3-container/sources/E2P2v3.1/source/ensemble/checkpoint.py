@@ -0,0 +1,149 @@
+"""
+Name:         checkpoint
+Description:  The checkpoint module records the progress of a run in its run directory, so that an
+              interrupted run can be resumed there: the run settings in checkpoint.json, and for
+              each level-0 job a marker when it starts and when it completes, holding the
+              checksum of its input and the sizes of its outputs. A job whose completion marker
+              still matches its input and outputs does not need to run again. The level-0 outputs
+              of a run directory can also be listed, so that their predictions can be computed
+              again without running the searches.
+
+"""
+
+import glob
+import hashlib
+import json
+import os
+
+state_name = "checkpoint.json"
+marker_dir = "checkpoints"
+
+
+def checksum(path):
+    """
+    Returns the MD5 checksum of a file.
+    """
+    digest = hashlib.md5()
+    fp = open(path, 'rb')
+    try:
+        while True:
+            data = fp.read(1 << 20)
+            if not data:
+                break
+            digest.update(data)
+    finally:
+        fp.close()
+    return digest.hexdigest()
+
+
+def write_json(path, data):
+    # Written under a temporary name and renamed, so that a marker is never seen half written.
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp_path, 'w') as fp:
+        json.dump(data, fp, indent=1, separators=(',', ': '), sort_keys=True)
+        fp.write("\n")
+    os.rename(temp_path, path)
+
+
+def read_json(path):
+    try:
+        with open(path, 'r') as fp:
+            return json.load(fp)
+    except (IOError, ValueError):
+        return None
+
+
+def load_state(run_folder):
+    """
+    Returns the settings of the run in run_folder, or None when it has no checkpoint.
+    """
+    return read_json(os.path.join(run_folder, state_name))
+
+
+def level0_outputs(run_folder):
+    """
+    Returns (shard suffix, BLAST output, PRIAM output) for each shard searched in a run directory,
+    and the names of the searches that did not complete. Runs made before completion markers
+    were written are taken as complete when both outputs exist.
+    """
+    run_checkpoint = Checkpoint(run_folder)
+    marked = os.path.isdir(run_checkpoint.directory)
+    outputs, incomplete = [], []
+    for output_priam in sorted(glob.glob(os.path.join(run_folder, "PRIAM_*", "ANNOTATION", "sequenceECs.txt"))):
+        # PRIAM_<time stamp><suffix>, next to blast.<time stamp><suffix>.
+        name = os.path.basename(os.path.dirname(os.path.dirname(output_priam)))[len("PRIAM_"):]
+        shard = name.partition("_")[2]
+        suffix = "_" + shard if shard else ""
+        output_blast = os.path.join(run_folder, "blast." + name)
+        for job, output in [("PRIAM" + suffix, output_priam), ("BLAST" + suffix, output_blast)]:
+            if not os.path.isfile(output) or (marked and not run_checkpoint.completed(job)):
+                incomplete.append(job)
+        outputs.append((suffix, output_blast, output_priam))
+    return outputs, incomplete
+
+
+class Checkpoint(object):
+    """
+    Markers of the level-0 jobs of the run in run_folder. Input checksums are computed once per
+    file.
+    """
+    def __init__(self, run_folder):
+        self.run_folder = run_folder
+        self.directory = os.path.join(run_folder, marker_dir)
+        self.checksums = {}
+
+    def save_state(self, state):
+        if not os.path.isdir(self.directory):
+            os.makedirs(self.directory)
+        write_json(os.path.join(self.run_folder, state_name), state)
+
+    def input_checksum(self, path):
+        if path not in self.checksums:
+            self.checksums[path] = checksum(path)
+        return self.checksums[path]
+
+    def marker_path(self, name, kind):
+        return os.path.join(self.directory, "%s.%s" % (name, kind))
+
+    def started(self, name, input_path):
+        """
+        Marks a job as started on an input file.
+        """
+        write_json(self.marker_path(name, "started"), {"input": input_path, "input_md5": self.input_checksum(input_path)})
+
+    def done(self, name, input_path, outputs):
+        """
+        Marks a job as completed on an input file, with the sizes of its output files.
+        """
+        sizes = dict((os.path.relpath(path, self.run_folder), os.path.getsize(path)) for path in outputs)
+        write_json(self.marker_path(name, "done"), {"input": input_path, "input_md5": self.input_checksum(input_path), "outputs": sizes})
+
+    def was_started(self, name, input_path):
+        """
+        Returns True when the job was started on the same input, in an earlier attempt.
+        """
+        marker = read_json(self.marker_path(name, "started"))
+        return marker is not None and marker.get("input_md5") == self.input_checksum(input_path)
+
+    def completed(self, name):
+        """
+        Returns True when the job completed and its outputs are unchanged, whatever its input.
+        """
+        marker = read_json(self.marker_path(name, "done"))
+        return marker is not None and self.outputs_unchanged(marker)
+
+    def outputs_unchanged(self, marker):
+        for path, size in marker.get("outputs", {}).items():
+            path = os.path.join(self.run_folder, path)
+            if not os.path.isfile(path) or os.path.getsize(path) != size:
+                return False
+        return True
+
+    def is_done(self, name, input_path):
+        """
+        Returns True when the job completed on the same input and its outputs are unchanged.
+        """
+        marker = read_json(self.marker_path(name, "done"))
+        if marker is None or marker.get("input_md5") != self.input_checksum(input_path):
+            return False
+        return self.outputs_unchanged(marker)
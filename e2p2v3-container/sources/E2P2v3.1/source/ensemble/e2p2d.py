@@ -0,0 +1,427 @@
+#!/usr/bin/python
+
+"""
+Name:         e2p2d
+Description:  Runs E2P2 as a long-running local service, for streams of small submissions whose
+              cost is otherwise dominated by starting the pipeline. The classifier weights, the
+              functional class map and the MetaCyc tables are loaded once. FASTA jobs are accepted
+              over HTTP, on a Unix socket or a localhost port, into a bounded queue. Queued jobs
+              are searched together: their sequences are written to one batch file for a single
+              blastp and PRIAM run, and the ensemble predictions are split back into the .out,
+              .long, .pf and .orxn.pf files of each job.
+
+Usage:        python e2p2d.py [--socket <path> | --port <port>] [--work <directory>] [-t <threads>]
+                              [-e <evalue cutoff>] [--ensemble <schemes>] [--queue-size 64]
+                              [--batch-size 5000] [--batch-wait 1.0]
+
+              POST /jobs                  FASTA sequences in the body; returns the job ID (503 when
+                                          the queue is full)
+              GET /jobs/<job>[?wait=<s>]  state of the job, waiting up to <s> seconds for it to end
+              GET /jobs/<job>/<file>      a results file: out, long, pf, orxn.pf or a listed name
+              DELETE /jobs/<job>          removes an ended job and its files
+              GET /status                 queue length, job counts and batches run
+
+              e.g. curl --unix-socket /tmp/e2p2.sock --data-binary @proteins.fa http://e2p2/jobs
+
+"""
+
+import collections
+import datetime
+import json
+import os
+import shutil
+import signal
+import sys
+import threading
+import time
+import uuid
+import Queue as queue
+from argparse import ArgumentParser
+from BaseHTTPServer import BaseHTTPRequestHandler, HTTPServer
+from SocketServer import ThreadingMixIn, UnixStreamServer
+from urlparse import urlparse, parse_qs
+
+# The E2P2 tree holding this file as source/ensemble/e2p2d.py.
+e2p2_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(e2p2_path, 'source', 'ensemble'))
+import fasta
+import jobs
+import level0
+import orxn
+import results
+import searches
+import tally
+import weights
+
+# Base name of the results files of a job, and the short names they can be fetched by.
+results_name = "result.out"
+results_aliases = {"out": "", "long": ".long", "pf": ".pf", "orxn.pf": ".orxn.pf"}
+
+# Largest FASTA body accepted, in bytes.
+max_body = 64 << 20
+
+
+class Classifier(object):
+    def __init__(self, id, weights):
+        self.id = id
+        self.predictions = {}
+        self.weights = weights
+
+
+class Submission(object):
+    """
+    A FASTA job: its sequences in submission order, as (sequence ID, sequence), and its state,
+    one of queued, running, done or failed.
+    """
+    def __init__(self, id, directory, records):
+        self.id = id
+        self.directory = directory
+        self.records = records
+        self.state = "queued"
+        self.error = None
+        self.files = []
+        self.submitted = time.time()
+        self.ended = None
+        self.batch = None
+        self.finished = threading.Event()
+
+    def end(self, state, error=None):
+        self.state = state
+        self.error = error
+        self.ended = time.time()
+        # The sequences are no longer needed once the job has ended.
+        self.records = None
+        self.finished.set()
+
+    def describe(self):
+        return {"job": self.id, "state": self.state, "error": self.error, "files": self.files, "batch": self.batch,
+                "submitted": self.submitted, "ended": self.ended}
+
+
+class Service(object):
+    """
+    Holds the reference tables, the job queue and the jobs, and runs the batches of queued jobs in
+    a worker thread.
+    """
+    def __init__(self, work_dir, threads=1, cpus=None, evaluecutoff="1e-5", ensemble_schemes=None, queue_size=64,
+                 batch_size=5000, batch_wait=1.0, keep_batches=False):
+        self.work_dir = work_dir
+        self.threads = threads
+        self.cpus = cpus
+        self.evaluecutoff = float(evaluecutoff)
+        self.ensemble_schemes = ensemble_schemes or [("max_weight_absolute_threshold", "0.5")]
+        self.scheme_thresholds = [(scheme, float(threshold_text or "0.5")) for scheme, threshold_text in self.ensemble_schemes]
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.keep_batches = keep_batches
+        self.queue = queue.Queue(queue_size)
+        self.jobs = {}
+        self.lock = threading.Lock()
+        self.batches = 0
+        self.sequences = 0
+        self.stopping = False
+        self.started = time.time()
+        for directory in ["jobs", "batches"]:
+            if not os.path.isdir(os.path.join(work_dir, directory)):
+                os.makedirs(os.path.join(work_dir, directory))
+        self.classifier_weights, self.fc_map = weights.load(os.path.join(e2p2_path, "source", "ensemble", "data"))
+        self.translator = orxn.Translator(os.path.join(e2p2_path, "tools", "data"))
+        self.worker = threading.Thread(target=self.run)
+        self.worker.daemon = True
+        self.worker.start()
+
+    def submit(self, data):
+        """
+        Queues the FASTA sequences in data as a new job. Returns the job, or None when the queue is
+        full. Raises ValueError when data holds no sequence.
+        """
+        records = [(id, sequence) for id, sequence in fasta.read_records(data.splitlines(True)) if sequence]
+        if not records:
+            raise ValueError("no FASTA sequence found")
+        id = uuid.uuid4().hex[:16]
+        submission = Submission(id, os.path.join(self.work_dir, "jobs", id), records)
+        with self.lock:
+            try:
+                self.queue.put_nowait(submission)
+            except queue.Full:
+                return None
+            self.jobs[id] = submission
+        return submission
+
+    def job(self, id):
+        with self.lock:
+            return self.jobs.get(id)
+
+    def remove(self, submission):
+        with self.lock:
+            del self.jobs[submission.id]
+        shutil.rmtree(submission.directory, ignore_errors=True)
+
+    def status(self):
+        with self.lock:
+            states = collections.Counter(submission.state for submission in self.jobs.values())
+        return {"queued": self.queue.qsize(), "jobs": dict(states), "batches": self.batches, "sequences": self.sequences,
+                "uptime_s": round(time.time() - self.started, 1), "stopping": self.stopping}
+
+    def stop(self):
+        """
+        Lets the batch being searched end, then fails the jobs still queued.
+        """
+        self.stopping = True
+        self.queue.put(None)
+        self.worker.join()
+        while True:
+            try:
+                submission = self.queue.get_nowait()
+            except queue.Empty:
+                break
+            if submission is not None:
+                submission.end("failed", "the service stopped")
+
+    def run(self):
+        # Takes the first queued job, then the jobs queued within batch_wait seconds until the
+        # batch holds batch_size sequences.
+        while not self.stopping:
+            submission = self.queue.get()
+            if submission is None:
+                return
+            batch = [submission]
+            count = len(submission.records)
+            deadline = time.time() + self.batch_wait
+            while count < self.batch_size:
+                try:
+                    submission = self.queue.get(True, max(0.0, deadline - time.time()))
+                except queue.Empty:
+                    break
+                if submission is None:
+                    self.stopping = True
+                    break
+                batch.append(submission)
+                count += len(submission.records)
+            try:
+                self.search(batch)
+            except Exception as e:
+                for submission in batch:
+                    if not submission.finished.is_set():
+                        submission.end("failed", str(e))
+
+    def search(self, batch):
+        """
+        Runs blastp and PRIAM once on the sequences of the jobs in batch and writes the results
+        files of each job.
+        """
+        self.batches += 1
+        batch_dir = os.path.join(self.work_dir, "batches", "%06d" % (self.batches))
+        if not os.path.isdir(batch_dir):
+            os.makedirs(batch_dir)
+        # Sequences are renamed in the batch, as IDs can repeat across jobs.
+        batch_input = os.path.join(batch_dir, "batch.fa")
+        names = []
+        output = open(batch_input, 'w', results.output_buffer)
+        for submission in batch:
+            submission.state = "running"
+            submission.batch = self.batches
+            for i, (id, sequence) in enumerate(submission.records):
+                name = "J%d_%d" % (len(names), i)
+                output.write(">%s\n%s\n" % (name, sequence))
+                names.append((name, submission, id))
+        output.close()
+        self.sequences += len(names)
+
+        output_blast = os.path.join(batch_dir, "blast")
+        output_priam = searches.priam_output(batch_dir, "batch")
+        runner = jobs.Runner(self.cpus)
+        runner.start(jobs.Job("PRIAM", searches.priam_command(e2p2_path, "batch", batch_input, batch_dir, self.threads),
+                              stderr_path=os.path.join(batch_dir, "priam.stderr"), cpus=self.threads))
+        runner.start(jobs.Job("BLAST", searches.blast_command(e2p2_path, batch_input, self.threads) + ['-out', output_blast],
+                              stderr_path=os.path.join(batch_dir, "blast.stderr"), cpus=self.threads))
+        runner.wait()
+
+        classifiers = {}
+        for cname in ["BLAST", "Priam"]:
+            classifiers[cname] = Classifier(cname, self.classifier_weights.get(cname, {}))
+        input = open(output_blast, 'r')
+        for qid, evalue, efs in level0.read_blast(input, self.evaluecutoff):
+            classifiers["BLAST"].predictions[qid] = level0.blast_prediction(evalue, efs)
+        input.close()
+        input = open(output_priam, 'r')
+        for qid, hits in level0.read_priam(input):
+            classifiers["Priam"].predictions[qid] = hits
+        input.close()
+        scheme_predictions = tally.perform_schemes(self.scheme_thresholds, [name for name, submission, id in names], classifiers)
+
+        # The predictions of each job are written under their submitted IDs, in submission order;
+        # the first sequence of a repeated ID is kept.
+        run_date = datetime.datetime.now()
+        # The files are listed once written, as the handlers read them while the job runs.
+        job_files = dict((submission.id, []) for submission in batch)
+        for submission in batch:
+            if not os.path.isdir(submission.directory):
+                os.makedirs(submission.directory)
+        for k, (scheme, threshold_text) in enumerate(self.ensemble_schemes):
+            job_predictions = collections.defaultdict(collections.OrderedDict)
+            for name, submission, id in names:
+                if id not in job_predictions[submission.id]:
+                    job_predictions[submission.id][id] = scheme_predictions[k][name]
+            method = tally.scheme_names[scheme]
+            if threshold_text:
+                method += " (%s)" % (threshold_text)
+            filename = results_name
+            if k > 0:
+                filename = "%s.%s.%s" % (results_name, scheme, threshold_text) if threshold_text else "%s.%s" % (results_name, scheme)
+            for submission in batch:
+                results.write_results(os.path.join(submission.directory, filename), job_predictions[submission.id], method,
+                                      run_date, self.fc_map, self.translator)
+                job_files[submission.id].extend(filename + extension for extension in ["", ".long", ".pf", ".orxn.pf"])
+        for submission in batch:
+            submission.files = job_files[submission.id]
+            submission.end("done")
+        if not self.keep_batches:
+            shutil.rmtree(batch_dir, ignore_errors=True)
+
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    Serves the requests of the service of its server.
+    """
+    def address_string(self):
+        # Clients of a Unix socket have no address.
+        if isinstance(self.client_address, tuple):
+            return self.client_address[0]
+        return "local"
+
+    def log_message(self, format, *args):
+        sys.stderr.write("%s - [%s] %s\n" % (self.address_string(), self.log_date_time_string(), format % args))
+
+    def send(self, code, data, content_type="application/json"):
+        if content_type == "application/json":
+            data = json.dumps(data, sort_keys=True) + "\n"
+        self.send_response(code)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def error(self, code, message):
+        self.send(code, {"error": message})
+
+    def route(self):
+        # Returns the job named in the path, or None after answering with an error, and the rest
+        # of the path.
+        parts = urlparse(self.path).path.strip("/").split("/")
+        if len(parts) < 2 or parts[0] != "jobs":
+            self.error(404, "unknown path %s" % (self.path))
+            return None, None
+        submission = self.server.service.job(parts[1])
+        if submission is None:
+            self.error(404, "unknown job %s" % (parts[1]))
+        return submission, "/".join(parts[2:])
+
+    def do_POST(self):
+        if urlparse(self.path).path.strip("/") != "jobs":
+            return self.error(404, "unknown path %s" % (self.path))
+        length = int(self.headers.get("Content-Length") or 0)
+        if length > max_body:
+            return self.error(413, "the FASTA body is larger than %d bytes" % (max_body))
+        data = self.rfile.read(length)
+        if self.server.service.stopping:
+            return self.error(503, "the service is stopping")
+        try:
+            submission = self.server.service.submit(data)
+        except ValueError as e:
+            return self.error(400, str(e))
+        if submission is None:
+            return self.error(503, "the job queue is full")
+        self.send(202, submission.describe())
+
+    def do_GET(self):
+        if urlparse(self.path).path.strip("/") == "status":
+            return self.send(200, self.server.service.status())
+        submission, name = self.route()
+        if submission is None:
+            return
+        if not name:
+            wait = parse_qs(urlparse(self.path).query).get("wait")
+            if wait:
+                try:
+                    seconds = float(wait[0])
+                except ValueError:
+                    return self.error(400, "wait must be a number of seconds, not %s" % (wait[0]))
+                submission.finished.wait(seconds)
+            return self.send(200, submission.describe())
+        if name in results_aliases:
+            name = results_name + results_aliases[name]
+        if name not in submission.files:
+            return self.error(404, "job %s has no file %s (%s)" % (submission.id, name, submission.state))
+        with open(os.path.join(submission.directory, name), 'rb') as fp:
+            self.send(200, fp.read(), "text/plain")
+
+    def do_DELETE(self):
+        submission, name = self.route()
+        if submission is None:
+            return
+        if not submission.finished.is_set():
+            return self.error(409, "job %s has not ended" % (submission.id))
+        self.server.service.remove(submission)
+        self.send(200, submission.describe())
+
+
+class LocalHTTPServer(ThreadingMixIn, HTTPServer):
+    daemon_threads = True
+
+
+class UnixHTTPServer(ThreadingMixIn, UnixStreamServer):
+    daemon_threads = True
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Runs E2P2 as a local service with a job queue.')
+    parser.add_argument('--socket', help='Unix socket to listen on')
+    parser.add_argument('--port', type=int, default=8642, help='localhost port to listen on, without --socket [8642]')
+    parser.add_argument('--work', default='/tmp/e2p2d', help='directory of the jobs and batches [/tmp/e2p2d]')
+    parser.add_argument('-t', '--threads', type=int, default=1, help='threads of each blastp and PRIAM search [1]')
+    parser.add_argument('--cpus', type=int, help='CPUs shared by the blastp and PRIAM searches of a batch [unlimited]')
+    parser.add_argument('-e', '--evalue', default='1e-5', help='BLAST e-value cutoff [1e-5]')
+    parser.add_argument('--ensemble', default='max_weight_absolute_threshold:0.5', help='comma-separated ensemble schemes, as for runE2P2.v3.1.py')
+    parser.add_argument('--queue-size', type=int, default=64, help='jobs held in the queue before submissions are refused [64]')
+    parser.add_argument('--batch-size', type=int, default=5000, help='sequences after which no more jobs are added to a batch [5000]')
+    parser.add_argument('--batch-wait', type=float, default=1.0, help='seconds to wait for more jobs once one is queued [1.0]')
+    parser.add_argument('--keep-batches', action='store_true', help='keep the search outputs of each batch in the work directory')
+    args = parser.parse_args()
+
+    try:
+        ensemble_schemes = tally.parse_schemes(args.ensemble)
+        float(args.evalue)
+    except ValueError as e:
+        parser.error(str(e))
+    try:
+        service = Service(os.path.abspath(args.work), args.threads, args.cpus, args.evalue, ensemble_schemes, args.queue_size,
+                          args.batch_size, args.batch_wait, args.keep_batches)
+    except (IOError, OSError) as e:
+        print "Can't load the reference tables: %s" % (e)
+        sys.exit(1)
+    if args.socket:
+        if os.path.exists(args.socket):
+            os.remove(args.socket)
+        server = UnixHTTPServer(args.socket, Handler)
+        address = args.socket
+    else:
+        server = LocalHTTPServer(("127.0.0.1", args.port), Handler)
+        address = "http://127.0.0.1:%d" % (args.port)
+    server.service = service
+
+    def shutdown(signum, frame):
+        # serve_forever() returns once shutdown() is called from another thread.
+        threading.Thread(target=server.shutdown).start()
+    signal.signal(signal.SIGTERM, shutdown)
+    signal.signal(signal.SIGINT, shutdown)
+    print "E2P2 service listening on %s, work directory %s." % (address, service.work_dir)
+    sys.stdout.flush()
+    try:
+        server.serve_forever()
+    finally:
+        server.server_close()
+        service.stop()
+        if args.socket and os.path.exists(args.socket):
+            os.remove(args.socket)
+    print "E2P2 service stopped."
@@ -174,16 +174,13 @@ def perform_max_weight(sequence_id, classifiers, threshold):
             temp = []
             # Record classifier's predictions and weights for that ID for voting and for output.
             for ef_class in c.predictions[sequence_id]:
-                try:
-                    ef_weight = c.weights[ef_class]
-                except:
-                    ef_weight = "0.000"
+                ef_weight = c.weights.get(ef_class, 0.0)
                 # Record vote as tuple, as this will allow one EF class to have more than one weight, depending
                 # on if more than one classifier called it.
-                vote = (cname, ef_class, float(ef_weight))
+                vote = (cname, ef_class, ef_weight)
                 votes.append(vote)
                 # The classifiers attribute will be used in outputting the full results. 
-                entry = "%s (%s)" % (ef_class, ef_weight)
+                entry = "%s (%.3f)" % (ef_class, ef_weight)
                 temp.append(entry)
             fpred.classifiers[cname] = temp
  
@@ -244,16 +241,13 @@ def perform_max_weight_percent_threshold(sequence_id, classifiers, threshold):
             temp = []
             # Record classifier's predictions and weights for that ID for voting and for output.
             for ef_class in c.predictions[sequence_id]:
-                try:
-                    ef_weight = c.weights[ef_class]
-                except:
-                    ef_weight = "0.000"
+                ef_weight = c.weights.get(ef_class, 0.0)
                 # Record vote as tuple, as this will allow one EF class to have more than one weight, depending
                 # on if more than one classifier called it.
-                vote = (cname, ef_class, float(ef_weight))
+                vote = (cname, ef_class, ef_weight)
                 votes.append(vote)
                 # The classifiers attribute will be used in outputting the full results. 
-                entry = "%s (%s)" % (ef_class, ef_weight)
+                entry = "%s (%.3f)" % (ef_class, ef_weight)
                 temp.append(entry)
             fpred.classifiers[cname] = temp
  
@@ -314,16 +308,13 @@ def perform_max_weight_absolute_threshold(sequence_id, classifiers, threshold):
             temp = []
             # Record classifier's predictions and weights for that ID for voting and for output.
             for ef_class in c.predictions[sequence_id]:
-                try:
-                    ef_weight = c.weights[ef_class]
-                except:
-                    ef_weight = "0.000"
+                ef_weight = c.weights.get(ef_class, 0.0)
                 # Record vote as tuple, as this will allow one EF class to have more than one weight, depending
                 # on if more than one classifier called it.
-                vote = (cname, ef_class, float(ef_weight))
+                vote = (cname, ef_class, ef_weight)
                 votes.append(vote)
                 # The classifiers attribute will be used in outputting the full results. 
-                entry = "%s (%s)" % (ef_class, ef_weight)
+                entry = "%s (%.3f)" % (ef_class, ef_weight)
                 temp.append(entry)
             fpred.classifiers[cname] = temp
  
@@ -387,18 +378,15 @@ def perform_avg_weight(sequence_id, classifiers, threshold):
             temp = []
             # Record classifier's predictions and weights for that ID for voting and for output.
             for ef_class in c.predictions[sequence_id]:
-                try:
-                    ef_weight = c.weights[ef_class]
-                except:
-                    ef_weight = "0.000"
+                ef_weight = c.weights.get(ef_class, 0.0)
                 # For each vote, add its weight. Keep track of all votes cast.
                 total_votes += 1
                 if votes.has_key(ef_class):
-                    votes[ef_class] += float(ef_weight)
+                    votes[ef_class] += ef_weight
                 else:
-                    votes[ef_class] = float(ef_weight)
+                    votes[ef_class] = ef_weight
                 # The classifiers attribute will be used in outputting the full results. 
-                entry = "%s (%s)" % (ef_class, ef_weight)
+                entry = "%s (%.3f)" % (ef_class, ef_weight)
                 temp.append(entry)
             fpred.classifiers[cname] = temp
 
@@ -457,18 +445,15 @@ def perform_avg_weight_percent_threshold(sequence_id, classifiers, threshold):
             temp = []
             # Record classifier's predictions and weights for that ID for voting and for output.
             for ef_class in c.predictions[sequence_id]:
-                try:
-                    ef_weight = c.weights[ef_class]
-                except:
-                    ef_weight = "0.000"
+                ef_weight = c.weights.get(ef_class, 0.0)
                 # For each vote, add its weight. Keep track of all votes cast.
                 total_votes += 1
                 if votes.has_key(ef_class):
-                    votes[ef_class] += float(ef_weight)
+                    votes[ef_class] += ef_weight
                 else:
-                    votes[ef_class] = float(ef_weight)
+                    votes[ef_class] = ef_weight
                 # The classifiers attribute will be used in outputting the full results. 
-                entry = "%s (%s)" % (ef_class, ef_weight)
+                entry = "%s (%.3f)" % (ef_class, ef_weight)
                 temp.append(entry)
             fpred.classifiers[cname] = temp
 
@@ -527,18 +512,15 @@ def perform_avg_weight_absolute_threshold(sequence_id, classifiers, threshold):
             temp = []
             # Record classifier's predictions and weights for that ID for voting and for output.
             for ef_class in c.predictions[sequence_id]:
-                try:
-                    ef_weight = c.weights[ef_class]
-                except:
-                    ef_weight = "0.000"
+                ef_weight = c.weights.get(ef_class, 0.0)
                 # For each vote, add its weight. Keep track of all votes cast.
                 total_votes += 1
                 if votes.has_key(ef_class):
-                    votes[ef_class] += float(ef_weight)
+                    votes[ef_class] += ef_weight
                 else:
-                    votes[ef_class] = float(ef_weight)
+                    votes[ef_class] = ef_weight
                 # The classifiers attribute will be used in outputting the full results. 
-                entry = "%s (%s)" % (ef_class, ef_weight)
+                entry = "%s (%.3f)" % (ef_class, ef_weight)
                 temp.append(entry)
             fpred.classifiers[cname] = temp
 
@@ -599,21 +581,18 @@ def perform_fixed_avg_weight_absolute_threshold(sequence_id, classifiers, thresh
             temp = []
             # Record classifier's predictions and weights for that ID for voting and for output.
             for ef_class in c.predictions[sequence_id]:
-                try:
-                    ef_weight = c.weights[ef_class]
-                except:
-                    ef_weight = "0.000"
+                ef_weight = c.weights.get(ef_class, 0.0)
                 # For each vote, add its weight. Keep track of all votes cast.
                 if total_votes.has_key(ef_class):
                     total_votes[ef_class] += 1
                 else:
                     total_votes[ef_class] = 1
                 if votes.has_key(ef_class):
-                    votes[ef_class] += float(ef_weight)
+                    votes[ef_class] += ef_weight
                 else:
-                    votes[ef_class] = float(ef_weight)
+                    votes[ef_class] = ef_weight
                 # The classifiers attribute will be used in outputting the full results. 
-                entry = "%s (%s)" % (ef_class, ef_weight)
+                entry = "%s (%.3f)" % (ef_class, ef_weight)
                 temp.append(entry)
             fpred.classifiers[cname] = temp
 
@@ -675,47 +654,43 @@ def perform_binary_avg_weight_absolute_threshold(sequence_id, classifiers, thres
             temp = []
             # Record classifier's predictions and weights for that ID for voting and for output.
             for ef_class in c.predictions[sequence_id]:
-                try:
-                    ef_weight = c.weights[ef_class]
-                except:
-                    ef_weight = "0.000"
+                ef_weight = c.weights.get(ef_class, 0.0)
                 # For each vote, add its weight. Keep track of all votes cast.
                 total_votes += 1
                 all_ef[ef_class] = 1
                 if votes.has_key(ef_class):
-                    votes[ef_class] += float(ef_weight)
+                    votes[ef_class] += ef_weight
                 else:
-                    votes[ef_class] = float(ef_weight)
+                    votes[ef_class] = ef_weight
                 # The classifiers attribute will be used in outputting the full results. 
-                entry = "%s (%s)" % (ef_class, ef_weight)
+                entry = "%s (%.3f)" % (ef_class, ef_weight)
                 temp.append(entry)
             fpred.classifiers[cname] = temp
     
-    for ef in all_ef:
+    # For each classifier, the set of EF classes it predicted (None if it has no entry for the
+    # sequence) and the EF class and weight charged when it did not predict an EF class. The
+    # charged EF class is not the missing one: it is the last EF class predicted by this
+    # classifier, or by the closest classifier before it that predicted any, as the scheme
+    # has always scored.
+    missing_votes = []
+    if all_ef:
         for cname in classifiers:
             c = classifiers[cname]
+            predicted = None
             if sequence_id in c.predictions:
-                seqpred = {}
-                for ef_class in c.predictions[sequence_id]:
-                    seqpred[ef_class] = 1
-                if not seqpred.has_key(ef):
-                    try:
-                        ef_weight = c.weights[ef_class]
-                    except:
-                        ef_weight = "0.000"
-                    if votes.has_key(ef_class):
-                        votes[ef_class] -= float(ef_weight)
-                    else:
-                        votes[ef_class] = -float(ef_weight)
-            else:
-                try:
-                    ef_weight = c.weights[ef_class]
-                except:
-                    ef_weight = "0.000"
+                predicted = set(c.predictions[sequence_id])
+                if c.predictions[sequence_id]:
+                    ef_class = c.predictions[sequence_id][-1]
+            missing_votes.append((predicted, ef_class, c.weights.get(ef_class, 0.0)))
+
+    # Subtract the weight of each classifier that did not predict an EF class.
+    for ef in all_ef:
+        for predicted, ef_class, ef_weight in missing_votes:
+            if predicted is None or ef not in predicted:
                 if votes.has_key(ef_class):
-                    votes[ef_class] -= float(ef_weight)
+                    votes[ef_class] -= ef_weight
                 else:
-                    votes[ef_class] = 0-float(ef_weight)
+                    votes[ef_class] = -ef_weight
     
 
     # Add routines to find no-vote and single-vote events.
@@ -774,21 +749,18 @@ def perform_fixed_avg_weight_percent_threshold(sequence_id, classifiers, thresho
             temp = []
             # Record classifier's predictions and weights for that ID for voting and for output.
             for ef_class in c.predictions[sequence_id]:
-                try:
-                    ef_weight = c.weights[ef_class]
-                except:
-                    ef_weight = "0.000"
+                ef_weight = c.weights.get(ef_class, 0.0)
                 # For each vote, add its weight. Keep track of all votes cast.
                 if total_votes.has_key(ef_class):
                     total_votes[ef_class] += 1
                 else:
                     total_votes[ef_class] = 1
                 if votes.has_key(ef_class):
-                    votes[ef_class] += float(ef_weight)
+                    votes[ef_class] += ef_weight
                 else:
-                    votes[ef_class] = float(ef_weight)
+                    votes[ef_class] = ef_weight
                 # The classifiers attribute will be used in outputting the full results. 
-                entry = "%s (%s)" % (ef_class, ef_weight)
+                entry = "%s (%.3f)" % (ef_class, ef_weight)
                 temp.append(entry)
             fpred.classifiers[cname] = temp
 
@@ -850,47 +822,43 @@ def perform_binary_avg_weight_percent_threshold(sequence_id, classifiers, thresh
             temp = []
             # Record classifier's predictions and weights for that ID for voting and for output.
             for ef_class in c.predictions[sequence_id]:
-                try:
-                    ef_weight = c.weights[ef_class]
-                except:
-                    ef_weight = "0.000"
+                ef_weight = c.weights.get(ef_class, 0.0)
                 # For each vote, add its weight. Keep track of all votes cast.
                 total_votes += 1
                 all_ef[ef_class] = 1
                 if votes.has_key(ef_class):
-                    votes[ef_class] += float(ef_weight)
+                    votes[ef_class] += ef_weight
                 else:
-                    votes[ef_class] = float(ef_weight)
+                    votes[ef_class] = ef_weight
                 # The classifiers attribute will be used in outputting the full results. 
-                entry = "%s (%s)" % (ef_class, ef_weight)
+                entry = "%s (%.3f)" % (ef_class, ef_weight)
                 temp.append(entry)
             fpred.classifiers[cname] = temp
     
-    for ef in all_ef:
+    # For each classifier, the set of EF classes it predicted (None if it has no entry for the
+    # sequence) and the EF class and weight charged when it did not predict an EF class. The
+    # charged EF class is not the missing one: it is the last EF class predicted by this
+    # classifier, or by the closest classifier before it that predicted any, as the scheme
+    # has always scored.
+    missing_votes = []
+    if all_ef:
         for cname in classifiers:
             c = classifiers[cname]
+            predicted = None
             if sequence_id in c.predictions:
-                seqpred = {}
-                for ef_class in c.predictions[sequence_id]:
-                    seqpred[ef_class] = 1
-                if not seqpred.has_key(ef):
-                    try:
-                        ef_weight = c.weights[ef_class]
-                    except:
-                        ef_weight = "0.000"
-                    if votes.has_key(ef_class):
-                        votes[ef_class] -= float(ef_weight)
-                    else:
-                        votes[ef_class] = -float(ef_weight)
-            else:
-                try:
-                    ef_weight = c.weights[ef_class]
-                except:
-                    ef_weight = "0.000"
+                predicted = set(c.predictions[sequence_id])
+                if c.predictions[sequence_id]:
+                    ef_class = c.predictions[sequence_id][-1]
+            missing_votes.append((predicted, ef_class, c.weights.get(ef_class, 0.0)))
+
+    # Subtract the weight of each classifier that did not predict an EF class.
+    for ef in all_ef:
+        for predicted, ef_class, ef_weight in missing_votes:
+            if predicted is None or ef not in predicted:
                 if votes.has_key(ef_class):
-                    votes[ef_class] -= float(ef_weight)
+                    votes[ef_class] -= ef_weight
                 else:
-                    votes[ef_class] = -float(ef_weight)
+                    votes[ef_class] = -ef_weight
     
 
     # Add routines to find no-vote and single-vote events.
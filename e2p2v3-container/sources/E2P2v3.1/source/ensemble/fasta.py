@@ -0,0 +1,279 @@
+"""
+Name:         fasta
+Description:  The fasta module reads the input protein sequences of E2P2 without loading them in
+              memory, and splits them into shards of similar residue counts so that the level-0
+              classifiers can be run on the shards in parallel. Input compressed with gzip, bzip2 or
+              xz is decompressed on the fly. The index of a FASTA file (the ID, byte offset, byte
+              length and residue count of each record) is cached next to it, so that records can
+              be listed and copied again without parsing the file.
+
+"""
+
+import heapq
+import os
+import re
+import subprocess
+
+id_split = re.compile(r"\s+")
+
+# Leading bytes of each compressed format, and the command writing its decompressed content to stdout.
+magic_numbers = [("gzip", "\x1f\x8b"), ("bzip2", "BZh"), ("xz", "\xfd7zXZ\x00")]
+decompressors = {"gzip": ["gzip", "-dc"], "bzip2": ["bzip2", "-dc"], "xz": ["xz", "-dc"]}
+compressed_suffixes = [".gz", ".bz2", ".xz"]
+
+# Suffix of the index file cached next to a FASTA file.
+index_suffix = ".e2p2.idx"
+
+
+class DecompressionError(Exception):
+    pass
+
+
+def compression(path):
+    """
+    Returns the compression format of a file, from its first bytes, or None for a plain file.
+    """
+    fp = open(path, 'rb')
+    head = fp.read(6)
+    fp.close()
+    for name, magic in magic_numbers:
+        if head.startswith(magic):
+            return name
+    return None
+
+
+def plain_name(path):
+    """
+    Returns the file name of the decompressed copy of a compressed input file.
+    """
+    name, suffix = os.path.splitext(os.path.basename(path))
+    if suffix in compressed_suffixes:
+        return name
+    return name + suffix + ".decompressed"
+
+
+class InputFile(object):
+    """
+    Iterates over the lines of a FASTA file, plain or compressed. Compressed files are read
+    through the gzip, bzip2 or xz command in a single stream. Counts the bytes read from the file
+    and the bytes of text it holds.
+    """
+    def __init__(self, path):
+        self.path = path
+        self.compression = compression(path)
+        self.bytes_read = 0
+        self.text_bytes = 0
+        self.process = None
+        if self.compression is None:
+            self.fp = open(path, 'r')
+        else:
+            try:
+                self.process = subprocess.Popen(decompressors[self.compression] + [path], stdout=subprocess.PIPE, bufsize=1 << 20)
+            except OSError as e:
+                raise DecompressionError("%s: %s" % (decompressors[self.compression][0], e.strerror))
+            self.fp = self.process.stdout
+
+    def __iter__(self):
+        for line in self.fp:
+            self.text_bytes += len(line)
+            yield line
+
+    def copy(self, output):
+        """
+        Writes the whole content of the file to the file object output, in large blocks.
+        """
+        while True:
+            data = self.fp.read(1 << 20)
+            if not data:
+                break
+            self.text_bytes += len(data)
+            output.write(data)
+
+    def close(self):
+        """
+        Closes the file, raising DecompressionError if the decompression failed.
+        """
+        self.fp.close()
+        if self.process is None:
+            self.bytes_read = self.text_bytes
+            return
+        status = self.process.wait()
+        if status != 0:
+            raise DecompressionError("%s exited with status %d" % (" ".join(decompressors[self.compression]), status))
+        self.bytes_read = os.path.getsize(self.path)
+
+    def report(self):
+        if self.process is None:
+            return "%d bytes read" % (self.bytes_read)
+        return "%d bytes read (%s), %d bytes decompressed" % (self.bytes_read, self.compression, self.text_bytes)
+
+
+def sequence_id(header):
+    """
+    Returns the sequence ID of a FASTA header line: the text after ">" up to the first "|" or
+    whitespace.
+    """
+    header = header.rstrip().lstrip(">").split("|")[0]
+    return id_split.split(header)[0]
+
+
+def index_records(fp):
+    """
+    Yields (sequence ID, offset, length, residue count) for each record of a FASTA file, in file
+    order. The offset and length are those in bytes of the record, from its header line to the
+    next header.
+    """
+    id, start, residues = None, 0, 0
+    offset = 0
+    for line in fp:
+        if line.startswith(">"):
+            if id is not None:
+                yield id, start, offset - start, residues
+            id, start, residues = sequence_id(line), offset, 0
+        elif id is not None:
+            residues += len(line.strip())
+        offset += len(line)
+    if id is not None:
+        yield id, start, offset - start, residues
+
+
+def signature(path):
+    """
+    Returns the size and modification time of a file, which an index is valid for.
+    """
+    st = os.stat(path)
+    return "%d\t%r" % (st.st_size, st.st_mtime)
+
+
+def read_index(path, file_signature):
+    """
+    Returns the cached index of a FASTA file as a list of (sequence ID, offset, length, residue
+    count), or None when there is no index or it was built for another signature of the file.
+    """
+    try:
+        fp = open(path + index_suffix, 'r')
+    except IOError:
+        return None
+    try:
+        if fp.readline() != "#%s\n" % (file_signature):
+            return None
+        index = []
+        for line in fp:
+            id, offset, length, residues = line.rstrip("\n").split("\t")
+            index.append((id, int(offset), int(length), int(residues)))
+        return index
+    finally:
+        fp.close()
+
+
+def write_index(path, file_signature, index):
+    """
+    Caches the index of a FASTA file next to it, under a temporary name renamed once complete.
+    Returns False when the index could not be written, for instance in a read-only directory.
+    """
+    temp_path = "%s%s.%d.tmp" % (path, index_suffix, os.getpid())
+    try:
+        fp = open(temp_path, 'w', 1 << 20)
+        fp.write("#%s\n" % (file_signature))
+        for entry in index:
+            fp.write("%s\t%d\t%d\t%d\n" % entry)
+        fp.close()
+        os.rename(temp_path, path + index_suffix)
+    except (IOError, OSError):
+        if os.path.exists(temp_path):
+            os.remove(temp_path)
+        return False
+    return True
+
+
+def read_records(fp):
+    """
+    Yields (sequence ID, sequence) for each record of a FASTA file. Only one sequence is held in
+    memory at a time.
+    """
+    id, lines = None, []
+    for line in fp:
+        if line.startswith(">"):
+            if id is not None:
+                yield id, "".join(lines)
+            id, lines = sequence_id(line), []
+        elif id is not None:
+            lines.append(line.strip())
+    if id is not None:
+        yield id, "".join(lines)
+
+
+def plan_shards(lengths, count):
+    """
+    Assigns sequences to at most count shards so that the shards hold similar numbers of
+    residues, as the cost of BLAST and PRIAM grows with sequence length. lengths is a list of
+    (sequence ID, residue count) pairs. Records sharing an ID are kept in the same shard.
+    Returns a dictionary mapping each sequence ID to its shard number, and the number of shards.
+    """
+    totals = {}
+    order = []
+    for id, residues in lengths:
+        if id not in totals:
+            totals[id] = 0
+            order.append(id)
+        totals[id] += residues
+    count = max(1, min(int(count), len(order)))
+
+    # Longest sequences first, each given to the shard holding the fewest residues so far.
+    rank = dict((id, i) for i, id in enumerate(order))
+    loads = [(0, shard) for shard in range(count)]
+    assignment = {}
+    for id in sorted(order, key=lambda id: (-totals[id], rank[id])):
+        load, shard = heapq.heappop(loads)
+        assignment[id] = shard
+        heapq.heappush(loads, (load + totals[id], shard))
+    return assignment, count
+
+
+def copy_records(path, index, assignment, shard_paths):
+    """
+    Copies each record of a FASTA file to the shard file assigned to its sequence ID, keeping
+    the input order within each shard, reading the records by their byte range in the index of
+    the file. Records whose ID has no shard are left out.
+    """
+    outputs = [open(shard_path, 'w') for shard_path in shard_paths]
+    fp = open(path, 'rb')
+    try:
+        for id, offset, length, residues in index:
+            shard = assignment.get(id)
+            if shard is None:
+                continue
+            if fp.tell() != offset:
+                fp.seek(offset)
+            outputs[shard].write(fp.read(length))
+    finally:
+        fp.close()
+        for output in outputs:
+            output.close()
+
+
+def copy_tail(path, id, tail_path):
+    """
+    Copies the records of a FASTA file from the first one with the given sequence ID to the end
+    of the file. Returns False, without writing, when no record has that ID.
+    """
+    fp = open(path, 'rb')
+    try:
+        for record_id, offset, length, residues in index_records(fp):
+            if record_id == id:
+                break
+        else:
+            return False
+        fp.seek(offset)
+        output = open(tail_path, 'wb')
+        try:
+            while True:
+                data = fp.read(1 << 20)
+                if not data:
+                    break
+                output.write(data)
+        finally:
+            output.close()
+    finally:
+        fp.close()
+    return True
@@ -0,0 +1,478 @@
+"""
+Name:         jobs
+Description:  The jobs module runs the external programs used by E2P2 (BLAST, PRIAM and the Perl
+              tools) as child processes. Jobs are waited on directly rather than polled, their exit
+              codes, standard error and resource usage are kept, and a failed job cancels the jobs
+              running beside it. The CPUs and memory used by the jobs of several processes can be
+              shared through a budget of tokens.
+
+"""
+
+import errno
+import json
+import os
+import signal
+import subprocess
+import tempfile
+import threading
+import time
+try:
+    import Queue as queue
+except ImportError:
+    import queue
+
+# Number of bytes of a failed job's standard error kept in its error message.
+stderr_tail = 2048
+
+# MiB of memory per token of a shared budget.
+memory_unit = 64
+
+# Seconds between attempts to take tokens for a job waiting on a shared budget.
+budget_poll = 0.25
+
+
+def parse_memory(text):
+    """
+    Converts a memory size such as "64G", "512M" or "2048" (MiB) to MiB. Raises ValueError when
+    the size cannot be read.
+    """
+    text = text.strip().upper().rstrip("B")
+    factors = {"K": 1.0 / 1024, "M": 1, "G": 1024, "T": 1024 * 1024}
+    factor = 1
+    if text and text[-1] in factors:
+        factor = factors[text[-1]]
+        text = text[:-1]
+    size = int(float(text) * factor)
+    if size <= 0:
+        raise ValueError("invalid memory size")
+    return size
+
+
+class JobError(Exception):
+    """
+    Raised when a job exits with a non-zero status, times out or its output consumer fails,
+    once its retries are exhausted.
+    """
+    def __init__(self, job):
+        Exception.__init__(self, job.describe_failure())
+        self.job = job
+
+
+class Job(object):
+    """
+    A command run as a child process.
+
+    stdout is the path of a file receiving the standard output, None to discard it, or
+    subprocess.PIPE together with a consumer, a function called with the pipe in a worker thread
+    while the job runs. Standard error goes to stderr_path, or to a temporary file when no path is
+    given. A job running longer than timeout seconds is killed, and a failed job is started again
+    up to retries times. cpus is the number of CPUs the command uses and memory the MiB of memory
+    it may reach. finisher, when given, is called with the job once it has succeeded, before the
+    runner starts waiting for other jobs.
+    """
+    def __init__(self, name, cmd, stdout=None, consumer=None, stderr_path=None, timeout=None, retries=0, cpus=1, finisher=None,
+                 memory=0):
+        self.name = name
+        self.cmd = cmd
+        self.cpus = cpus
+        self.memory = memory
+        self.tokens = None
+        self.stdout = stdout
+        self.consumer = consumer
+        self.finisher = finisher
+        self.stderr_path = stderr_path
+        self.timeout = timeout
+        self.retries = retries
+        self.attempts = 0
+        self.process = None
+        self.returncode = None
+        self.timed_out = False
+        self.error = None
+        self.deadline = None
+        self.stderr = None
+        self.started = None
+        self.ended = None
+        self.rusage = None
+
+    def start(self, events):
+        """
+        Launches the command and a thread that puts the job on the events queue once it exits.
+        """
+        self.attempts += 1
+        self.returncode = None
+        self.timed_out = False
+        self.error = None
+        self.started = time.time()
+        self.ended = None
+        self.rusage = None
+        if self.stdout is None:
+            out = open(os.devnull, 'w')
+        elif self.stdout == subprocess.PIPE:
+            out = subprocess.PIPE
+        else:
+            out = open(self.stdout, 'w')
+        if self.stderr is not None:
+            self.stderr.close()
+        if self.stderr_path:
+            self.stderr = open(self.stderr_path, 'w+')
+        else:
+            self.stderr = tempfile.TemporaryFile()
+        # Each job runs in its own process group so that cancelling it also stops the programs it
+        # launches, such as the blastall processes started by PRIAM.
+        self.process = subprocess.Popen(self.cmd, stdout=out, stderr=self.stderr, close_fds=True,
+                                        preexec_fn=os.setpgrp)
+        if out is not subprocess.PIPE:
+            out.close()
+        if self.timeout:
+            self.deadline = time.time() + float(self.timeout)
+        else:
+            self.deadline = None
+        watcher = threading.Thread(target=self._watch, args=(events,))
+        watcher.daemon = True
+        watcher.start()
+
+    def _watch(self, events):
+        try:
+            if self.consumer is not None:
+                try:
+                    self.consumer(self.process.stdout)
+                except Exception as e:
+                    self.error = e
+                    self.kill()
+                finally:
+                    self.process.stdout.close()
+            self.returncode = self.wait()
+        finally:
+            self.ended = time.time()
+            events.put(self)
+
+    def wait(self):
+        """
+        Waits for the process to exit and returns its exit code, keeping its resource usage, which
+        includes that of the programs it waited for.
+        """
+        while True:
+            try:
+                pid, status, self.rusage = os.wait4(self.process.pid, 0)
+                break
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+        if os.WIFSIGNALED(status):
+            self.process.returncode = -os.WTERMSIG(status)
+        else:
+            self.process.returncode = os.WEXITSTATUS(status)
+        return self.process.returncode
+
+    def kill(self):
+        """
+        Kills the job and every process it started.
+        """
+        try:
+            os.killpg(self.process.pid, signal.SIGKILL)
+        except OSError:
+            pass
+
+    def failed(self):
+        return self.returncode != 0 or self.timed_out or self.error is not None
+
+    def read_stderr(self):
+        """
+        Returns the end of the job's standard error.
+        """
+        self.stderr.flush()
+        self.stderr.seek(0, os.SEEK_END)
+        size = self.stderr.tell()
+        self.stderr.seek(max(0, size - stderr_tail))
+        return self.stderr.read().strip()
+
+    def describe_failure(self):
+        if self.timed_out:
+            message = "%s timed out after %s seconds" % (self.name, self.timeout)
+        elif self.error is not None:
+            message = "%s output could not be read: %s" % (self.name, self.error)
+        else:
+            message = "%s exited with status %s" % (self.name, self.returncode)
+        if self.attempts > 1:
+            message += " (attempt %d)" % self.attempts
+        tail = self.read_stderr()
+        if tail:
+            message += "\n" + tail
+        return message
+
+
+class SharedBudget(object):
+    """
+    CPUs and memory shared by the jobs of several processes, in the manner of the make jobserver:
+    each is a named pipe holding one token per CPU or per memory_unit MiB. A job takes its tokens
+    before it starts and puts them back when it ends. The process creating the budget keeps the
+    pipes open; the processes it starts find the budget in their environment. These list the
+    tokens held by their running jobs in a file next to the pipes, so that the tokens of a process
+    that ends without putting them back can be reclaimed.
+    """
+    env_name = "E2P2_BUDGET"
+
+    def __init__(self, pools):
+        # (kind, path, tokens) of each pool, and its open pipe.
+        self.pools = pools
+        self.fds = [os.open(path, os.O_RDWR | os.O_NONBLOCK) for kind, path, tokens in pools]
+        self.owner = False
+        # Tokens of each running job of this process, by process ID.
+        self.holders = {}
+
+    @classmethod
+    def create(cls, directory, cpus, memory=None):
+        """
+        Creates the pipes of a budget of cpus CPUs and, when given, memory MiB in directory, and
+        fills them.
+        """
+        pools = [("cpus", os.path.join(directory, "cpus.budget"), cpus)]
+        if memory:
+            pools.append(("memory", os.path.join(directory, "memory.budget"), max(1, memory // memory_unit)))
+        for kind, path, tokens in pools:
+            if os.path.exists(path):
+                os.remove(path)
+            os.mkfifo(path)
+        budget = cls(pools)
+        budget.owner = True
+        for fd, (kind, path, tokens) in zip(budget.fds, pools):
+            os.write(fd, b"+" * tokens)
+        return budget
+
+    @classmethod
+    def from_env(cls):
+        """
+        Returns the budget shared by the process that started this one, or None.
+        """
+        value = os.environ.get(cls.env_name)
+        if not value:
+            return None
+        return cls([(kind, path, int(tokens)) for kind, path, tokens in [pool.split(":") for pool in value.split(";")]])
+
+    def memory(self):
+        """
+        Returns the MiB of memory of the budget, or None when it has no memory pool.
+        """
+        for kind, path, tokens in self.pools:
+            if kind == "memory":
+                return tokens * memory_unit
+        return None
+
+    def environ(self):
+        return ";".join("%s:%s:%d" % pool for pool in self.pools)
+
+    def needs(self, job):
+        # Tokens of each pool needed by a job; a job larger than a pool takes all of it.
+        needs = []
+        for kind, path, tokens in self.pools:
+            if kind == "cpus":
+                needs.append(min(job.cpus, tokens))
+            else:
+                needs.append(min(-(-job.memory // memory_unit), tokens))
+        return needs
+
+    def take(self, job):
+        """
+        Takes the tokens of a job from every pool, or none of them. Returns True when they were
+        taken.
+        """
+        taken = []
+        for fd, need in zip(self.fds, self.needs(job)):
+            data = b""
+            while len(data) < need:
+                try:
+                    chunk = os.read(fd, need - len(data))
+                except OSError as e:
+                    if e.errno not in (errno.EAGAIN, errno.EWOULDBLOCK):
+                        raise
+                    break
+                data += chunk
+            taken.append(len(data))
+            if len(data) < need:
+                self.give(taken)
+                return False
+        job.tokens = taken
+        return True
+
+    def give(self, taken):
+        for fd, count in zip(self.fds, taken):
+            if count:
+                os.write(fd, b"+" * count)
+
+    def ledger_path(self, pid):
+        # File listing the tokens held by the jobs of the process pid.
+        return os.path.join(os.path.dirname(self.pools[0][1]), "held.%d" % (pid))
+
+    def hold(self, job):
+        """
+        Records the tokens of a started job.
+        """
+        self.holders[job.process.pid] = job.tokens
+        self.write_ledger()
+
+    def release(self, job):
+        """
+        Puts back the tokens of a job that ended.
+        """
+        self.holders.pop(job.process.pid, None)
+        self.give(job.tokens)
+        self.write_ledger()
+
+    def write_ledger(self):
+        # The process creating the budget outlives the others and has nothing to record.
+        if self.owner:
+            return
+        path = self.ledger_path(os.getpid())
+        if not self.holders:
+            if os.path.exists(path):
+                os.remove(path)
+            return
+        temp_path = "%s.tmp" % (path)
+        with open(temp_path, 'w') as fp:
+            json.dump(dict((str(pid), tokens) for pid, tokens in self.holders.items()), fp)
+        os.rename(temp_path, path)
+
+    def reclaim(self, pid):
+        """
+        Puts back the tokens held by the jobs of the process pid, which has ended, after killing
+        those jobs. Returns the number of tokens put back in each pool.
+        """
+        path = self.ledger_path(pid)
+        try:
+            with open(path) as fp:
+                holders = json.load(fp)
+        except (IOError, ValueError):
+            return [0] * len(self.pools)
+        reclaimed = [0] * len(self.pools)
+        for job_pid, tokens in holders.items():
+            # Each job runs in its own process group.
+            try:
+                os.killpg(int(job_pid), signal.SIGKILL)
+            except OSError:
+                pass
+            self.give(tokens)
+            reclaimed = [total + count for total, count in zip(reclaimed, tokens)]
+        os.remove(path)
+        return reclaimed
+
+    def close(self):
+        """
+        Closes the pipes of the budget, and removes them in the process that created it.
+        """
+        for fd in self.fds:
+            os.close(fd)
+        if self.owner:
+            for kind, path, tokens in self.pools:
+                os.remove(path)
+
+
+class Runner(object):
+    """
+    Runs jobs concurrently and waits for their exits. When a CPU budget is given, jobs are started
+    in the order they were submitted, as long as the CPUs of the running jobs fit in the budget.
+    A SharedBudget further holds each job until its tokens are free. With keep_going, a failed job
+    is set aside in failed instead of cancelling the others. on_exit is called with each job as it
+    exits, before it is retried or set aside.
+    """
+    def __init__(self, cpus=None, budget=None, keep_going=False, on_exit=None):
+        self.cpus = cpus
+        self.budget = budget
+        self.keep_going = keep_going
+        self.on_exit = on_exit
+        self.events = queue.Queue()
+        self.pending = []
+        self.running = []
+        self.finished = []
+        self.failed = []
+
+    def start(self, job):
+        self.pending.append(job)
+        self._start_pending()
+
+    def _start_pending(self):
+        while self.pending:
+            job = self.pending[0]
+            used = sum(j.cpus for j in self.running)
+            # A job larger than the whole budget still runs, alone.
+            if self.cpus and self.running and used + job.cpus > self.cpus:
+                break
+            if self.budget is not None and not self.budget.take(job):
+                break
+            self.pending.pop(0)
+            job.start(self.events)
+            self.running.append(job)
+            if self.budget is not None:
+                self.budget.hold(job)
+
+    def _release(self, job):
+        if self.budget is not None and job.tokens is not None:
+            self.budget.release(job)
+            job.tokens = None
+
+    def wait(self):
+        """
+        Blocks until every started job has finished. A failed job is retried while it has retries
+        left; otherwise the remaining jobs are cancelled and JobError is raised.
+        """
+        try:
+            while self.running or self.pending:
+                job = self._next_exit()
+                if job is None:
+                    self._start_pending()
+                    continue
+                self.running.remove(job)
+                self._release(job)
+                if self.on_exit is not None:
+                    self.on_exit(job)
+                if job.failed():
+                    if job.attempts <= job.retries:
+                        self.start(job)
+                        continue
+                    if self.keep_going:
+                        self.failed.append(job)
+                        self._start_pending()
+                        continue
+                    self.cancel()
+                    raise JobError(job)
+                self.finished.append(job)
+                if job.finisher is not None:
+                    job.finisher(job)
+                self._start_pending()
+        except KeyboardInterrupt:
+            self.cancel()
+            raise
+
+    def _next_exit(self):
+        # Wake up when a job exits or when the earliest deadline passes. Returns None when jobs
+        # waiting for tokens of a shared budget should try again.
+        while True:
+            deadlines = [j.deadline for j in self.running if j.deadline and not j.timed_out]
+            if deadlines:
+                timeout = max(0.0, min(deadlines) - time.time())
+            else:
+                # A bounded wait keeps the main thread responsive to KeyboardInterrupt.
+                timeout = 3600.0
+            if self.pending and self.budget is not None:
+                timeout = min(timeout, budget_poll)
+            try:
+                return self.events.get(True, timeout)
+            except queue.Empty:
+                now = time.time()
+                for j in self.running:
+                    if j.deadline and not j.timed_out and now >= j.deadline:
+                        j.timed_out = True
+                        j.kill()
+                if self.pending and self.budget is not None:
+                    return None
+
+    def cancel(self):
+        """
+        Kills all running jobs, drops the pending ones and waits for the running jobs to exit.
+        """
+        self.pending = []
+        for job in self.running:
+            job.kill()
+        while self.running:
+            job = self.events.get()
+            self.running.remove(job)
+            self._release(job)
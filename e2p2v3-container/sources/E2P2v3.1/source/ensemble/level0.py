@@ -0,0 +1,142 @@
+"""
+Name:         level0
+Description:  The level0 module reads the raw output of the level-0 classifiers (BLAST, PRIAM)
+              used by E2P2 and turns it into the per-sequence EF class predictions consumed
+              by the ensemble module.
+
+"""
+
+import os
+import re
+
+# Splits an hit ID such as "RPSD00001|EF00010|EF00011" into its fields.
+hit_split = re.compile(r"[|\s]+")
+
+
+def parse_evalue(value):
+    """
+    Converts a BLAST e-value column to a float. Some BLAST versions write values such as
+    "e-100" without the leading mantissa.
+    """
+    if value.startswith('e'):
+        value = "1" + value
+    return float(value)
+
+
+def read_blast(fp, evaluecutoff=None):
+    """
+    Streams a BLAST tabular (-outfmt 6) file and yields (query ID, e-value, EF classes) for the
+    first hit of each query passing the e-value cutoff, or for its first hit when no cutoff is
+    given. BLAST writes the hits of a query as one block sorted by e-value, so a query is yielded
+    as soon as its block ends and the remaining lines of the block are skipped without being
+    split. Only the hits of the current query are held in memory.
+
+    A query seen again after its block has ended is ignored, as the first hit always wins.
+    """
+    if evaluecutoff is not None:
+        evaluecutoff = float(evaluecutoff)
+    seen = set()
+    block, hit = None, None
+    for line in fp:
+        field = line.split("\t", 1)[0]
+        if field == block:
+            if hit is not None:
+                # The query already has its best hit.
+                continue
+        else:
+            if hit is not None:
+                yield hit
+            block, hit = field, None
+        if not line.strip():
+            continue
+        qid = field.split("|")[0]
+        if qid in seen:
+            continue
+        temp = line.rstrip("\n").split("\t")
+        evalue = parse_evalue(temp[-2])
+        if evaluecutoff is not None and evalue > evaluecutoff:
+            continue
+        seen.add(qid)
+
+        # Skip the first field, which contains the hit ID. We only need the predicted EF classes.
+        efs = {}
+        for h in hit_split.split(temp[1])[1:]:
+            if "EF" in h:
+                efs[h] = 1
+        hit = (qid, evalue, list(efs))
+    if hit is not None:
+        yield hit
+
+
+def truncate_blast(path, block_size=1 << 20):
+    """
+    Truncates the BLAST tabular output of an interrupted search before the hits of its last query,
+    which may be incomplete, and returns that query's ID field, from which the search can be
+    restarted. Returns None when the file holds no complete line. Only the end of the file is
+    read.
+    """
+    size = os.path.getsize(path)
+    fp = open(path, 'rb+')
+    try:
+        while True:
+            start = max(0, size - block_size)
+            fp.seek(start)
+            data = fp.read(size - start)
+            # Drop the last line when it was not written completely.
+            end = data.rfind("\n") + 1
+            lines = data[:end].split("\n")[:-1]
+            offset = start
+            if start > 0 and lines:
+                # The first line may start before the block.
+                offset += len(lines[0]) + 1
+                lines = lines[1:]
+            if lines:
+                query = lines[-1].split("\t", 1)[0]
+                i = len(lines) - 1
+                while i > 0 and lines[i - 1].split("\t", 1)[0] == query:
+                    i -= 1
+                if i > 0 or start == 0:
+                    fp.truncate(offset + sum(len(line) + 1 for line in lines[:i]))
+                    return query
+            elif start == 0:
+                return None
+            block_size *= 4
+    finally:
+        fp.close()
+
+
+def blast_prediction(evalue, efs):
+    """
+    Returns the BLAST prediction of a query from the e-value and EF classes of its best hit.
+    Hits with an e-value above 1.0 do not predict any class.
+    """
+    if evalue <= 1.0:
+        return efs
+    return []
+
+
+def read_priam(fp):
+    """
+    Streams a PRIAM sequenceECs.txt file and yields (query ID, EF classes) for each query, in
+    file order.
+    """
+    qid, hits = None, []
+    for line in fp:
+        if line.startswith(">"):
+            if qid is not None:
+                yield qid, hits
+            qid, hits = hit_split.split(line[1:])[0], []
+        elif qid is not None and line.startswith("EF"):
+            hits.append(line.split("\t")[0].rstrip())
+    if qid is not None:
+        yield qid, hits
+
+
+def tee(fp, copy):
+    """
+    Yields the lines of fp while writing each of them to the file object copy, so that raw
+    classifier output read from a pipe can also be kept on disk.
+    """
+    for line in fp:
+        copy.write(line)
+        yield line
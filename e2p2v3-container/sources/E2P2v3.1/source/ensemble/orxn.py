@@ -0,0 +1,201 @@
+"""
+Name:         orxn
+Description:  The orxn module translates the EC numbers of a Pathologic input file (.pf) into
+              official MetaCyc reaction IDs, writing the .orxn.pf file as tools/pf-EC-to-official-RXN.pl
+              does, and leaves out the entries without a reaction as refinepf.remove_empty_from_pf
+              does. The MetaCyc tables (tools/data) are read once, and the reactions of each EC
+              number are resolved once per run. Where an EC number has several reactions they are
+              written in the order of the tables rather than in Perl hash order.
+
+Usage:        python orxn.py <pf file> [<pf file> ...]
+              Writes <name>.orxn.pf next to each <name>.pf.
+
+"""
+
+import os
+import re
+import sys
+
+import refinepf
+
+# A MetaCyc line that refinepf counts as a reaction.
+reaction_line = re.compile(r"METACYC\t\S+$")
+
+
+def fields(text, separator="\t"):
+    # Splits text as Perl's split does: trailing empty fields are dropped.
+    r = text.split(separator)
+    while r and r[-1] == "":
+        r.pop()
+    return r
+
+
+def field(r, i):
+    if i < len(r):
+        return r[i]
+    return ""
+
+
+def read_table(path):
+    # Yields the split lines of a MetaCyc table, skipping headers and comments.
+    with open(path, 'r') as fp:
+        for line in fp:
+            if line.startswith("ID") or line.startswith("#"):
+                continue
+            yield fields(line.rstrip("\n"))
+
+
+def add(table, key, value):
+    # Adds a value to the list of a key, once, keeping the order of the table.
+    values = table.setdefault(key, [])
+    if value not in values:
+        values.append(value)
+
+
+class Translator(object):
+    """
+    Translates the METACYC and EC lines of Pathologic entries into official MetaCyc reactions.
+    """
+    def __init__(self, data_dir):
+        # General EC number to reaction mapping, used when no official reaction is known.
+        self.unofficial = {}
+        for r in read_table(os.path.join(data_dir, "metacyc-RXN-EC.mapping")):
+            ec = field(r, 2)
+            if not ec or ec == "0":
+                ec = "-"
+            add(self.unofficial, ec.split(" -- ")[0], field(r, 0))
+        # Reactions and EC numbers outside of small molecule metabolism.
+        self.remove = set(field(r, 0) for r in read_table(os.path.join(data_dir, "to-remove-non-small-molecule-metabolism.txt")))
+        # EC numbers replaced by other ones.
+        self.superseded = {}
+        for r in read_table(os.path.join(data_dir, "EC-superseded")):
+            r = [f[3:] if f.startswith("EC-") else f for f in r]
+            add(self.superseded, field(r, 2), field(r, 0))
+        # Official EC number to reaction mapping.
+        self.official = {}
+        for r in read_table(os.path.join(data_dir, "metacyc-RXN-official-EC.mapping")):
+            for rx in fields(field(r, 1), "|"):
+                add(self.official, field(r, 0), rx)
+        self.resolved = {}
+
+    def ec_reactions(self, ec):
+        """
+        Returns the (reaction, unofficial) pairs an EC line is translated into.
+        """
+        reactions = self.resolved.get(ec)
+        if reactions is not None:
+            return reactions
+        reactions = []
+        if ec not in self.remove:
+            for c in self.superseded.get(ec, [ec]):
+                if c in self.remove:
+                    continue
+                official = [rx for rx in self.official.get(c, []) if rx not in self.remove]
+                if official:
+                    reactions.extend((rx, False) for rx in official)
+                else:
+                    reactions.extend((rx, True) for rx in self.unofficial.get(c, []) if rx not in self.remove)
+        self.resolved[ec] = reactions
+        return reactions
+
+    def translate(self, line, seen, output):
+        """
+        Translates one line of an entry. seen is the set of reactions already met in the entry;
+        output is the list the translated lines are appended to.
+        """
+        if line.startswith("METACYC\t"):
+            rx = line[8:]
+            if rx not in self.remove and rx not in seen:
+                output.append("METACYC\t%s\n" % (rx))
+            seen.add(rx)
+        elif line.startswith("EC\t"):
+            for rx, unofficial in self.ec_reactions(line[3:]):
+                if rx not in seen:
+                    if unofficial:
+                        output.append("METACYC\t%s\n#unofficial\n" % (rx))
+                    else:
+                        output.append("METACYC\t%s\n" % (rx))
+                seen.add(rx)
+        else:
+            output.append(line + "\n")
+
+    def translate_entry(self, lines):
+        """
+        Translates the lines of one entry, its ID line first. Returns the translated lines and
+        the set of reactions met in the entry.
+        """
+        seen = set()
+        output = []
+        for line in lines:
+            self.translate(line.rstrip("\n"), seen, output)
+        return output, seen
+
+
+class OrxnWriter(object):
+    """
+    Writes translated entries to an .orxn.pf file, leaving out those without a reaction. When an
+    entry is left out, the file is sorted by entry ID, as refinepf.remove_empty_from_pf does.
+    The file is written under a temporary name and renamed once complete.
+    """
+    def __init__(self, path):
+        self.path = path
+        # Named apart from the temporary file refinepf.sort_pf writes when sorting it.
+        self.temp_path = "%s.%d.part" % (path, os.getpid())
+        self.output = open(self.temp_path, 'w', 1 << 20)
+        self.written = 0
+        self.dropped = 0
+
+    def write(self, lines, seen):
+        # lines are the translated lines of an entry, starting with its ID line.
+        if not seen:
+            return
+        if not [line for line in "".join(lines).split("\n") if reaction_line.match(line.rstrip())]:
+            self.dropped += 1
+            return
+        self.output.write("".join(lines))
+        self.written += 1
+
+    def close(self):
+        self.output.close()
+        if self.dropped:
+            print('Removed Empty IDs:\t' + str(self.dropped))
+            refinepf.sort_pf(self.temp_path, self.path)
+            os.remove(self.temp_path)
+        else:
+            os.rename(self.temp_path, self.path)
+
+
+def translate_pf(pf_path, translator, orxn_path=None):
+    """
+    Writes the .orxn.pf translation of a .pf file.
+    """
+    if orxn_path is None:
+        orxn_path = re.sub(r"\.pf$", "", pf_path) + ".orxn.pf"
+    writer = OrxnWriter(orxn_path)
+    # Reactions are tracked per entry ID, over the whole file.
+    seen_by_id = {}
+    lines, seen = [], seen_by_id.setdefault("", set())
+    with open(pf_path, 'r') as fp:
+        for line in fp:
+            line = line.rstrip("\n")
+            if line.startswith("ID\t"):
+                seen = seen_by_id.setdefault(line[3:], set())
+                lines = [line + "\n"]
+            elif line.startswith("//"):
+                lines.append(line + "\n")
+                writer.write(lines, seen)
+                lines = []
+            else:
+                translator.translate(line, seen, lines)
+    writer.close()
+    return orxn_path
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 2:
+        print("Usage: python orxn.py <pf file> [<pf file> ...]")
+        sys.exit(1)
+    e2p2_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+    translator = Translator(os.path.join(e2p2_path, "tools", "data"))
+    for pf_path in sys.argv[1:]:
+        print("Wrote %s" % translate_pf(pf_path, translator))
@@ -37,20 +37,21 @@ def get_help(name, description, options, usage, notes):
     return message
 
 
-def get_options(args, flags):
+def get_options(args, flags, long_flags=None):
     """
     Checks and collects command line options for the program that calls it.
     Prints an error message if options are inappropriate or missing. Program
     must pass in expected options as a string, for example, 'hab:cdef:'.
+    Long options can be passed as a list, for example, ['name=', 'verbose'].
 
-    Usage: get_options(flags, message)
+    Usage: get_options(args, flags, long_flags)
     """
 
     import sys
     import getopt
 
     try:
-        options, xarguments = getopt.getopt(args, flags)
+        options, xarguments = getopt.getopt(args, flags, long_flags or [])
     except getopt.GetoptError:
         print '''
     Error: You used an unknown option or are missing an argument to an option. 
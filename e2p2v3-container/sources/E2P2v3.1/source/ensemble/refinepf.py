@@ -1,5 +1,14 @@
+import heapq
+import os
 import re
-# from argparse import ArgumentParser
+import tempfile
+from argparse import ArgumentParser
+
+# An attribute block holding at least one MetaCyc reaction.
+metacyc_attr = re.compile(r'METACYC\t[^\s]+\n')
+
+# Bytes of entries sorted in memory before a sorted run is written to a temporary file.
+buffer_size = 64 << 20
 
 
 def read_pf(fp):
@@ -14,33 +23,132 @@ def read_pf(fp):
     if id: yield (id, '\n'.join(attr))
 
 
-def remove_empty_from_pf(pf_path):
-    refined_dict = {}
-    exist_empty = False
+def tagged(i, fp):
+    # The entries of a sorted run, tagged with the run number.
+    return ((e2p2_id, i, e2p2_attr) for e2p2_id, e2p2_attr in read_pf(fp))
+
+
+class PfSorter(object):
+    """
+    Sorts pf entries by their ID line, keeping the first entry of each ID. Entries are sorted in
+    memory up to buffer_size bytes; beyond that, sorted runs are written to temporary files in
+    temp_dir and merged.
+    """
+    def __init__(self, temp_dir, buffer_size=buffer_size):
+        self.temp_dir = temp_dir
+        self.buffer_size = buffer_size
+        self.entries = []
+        self.size = 0
+        self.runs = []
+
+    def add(self, e2p2_id, e2p2_attr):
+        self.entries.append((e2p2_id, len(self.entries), e2p2_attr))
+        self.size += len(e2p2_id) + len(e2p2_attr)
+        if self.size >= self.buffer_size:
+            self.spill()
+
+    def sorted_entries(self):
+        # Yields the buffered entries in order, the first of each ID only.
+        last_id = None
+        for e2p2_id, _, e2p2_attr in sorted(self.entries):
+            if e2p2_id != last_id:
+                yield e2p2_id, e2p2_attr
+            last_id = e2p2_id
+
+    def spill(self):
+        fd, run_path = tempfile.mkstemp(suffix='.pf', dir=self.temp_dir)
+        with os.fdopen(fd, 'w') as fp:
+            for e2p2_id, e2p2_attr in self.sorted_entries():
+                fp.write(e2p2_id + '\n' + e2p2_attr + '\n')
+        self.runs.append(run_path)
+        self.entries = []
+        self.size = 0
+
+    def write(self, output_path):
+        """
+        Writes the sorted entries to a temporary file renamed to output_path once complete.
+        """
+        temp_path = '%s.%d.tmp' % (output_path, os.getpid())
+        runs = [open(run_path, 'r') for run_path in self.runs]
+        try:
+            # Runs are numbered in input order, so that the first entry of an ID comes first.
+            sources = [tagged(i, fp) for i, fp in enumerate(runs)]
+            sources.append((e2p2_id, len(runs), e2p2_attr) for e2p2_id, e2p2_attr in self.sorted_entries())
+            with open(temp_path, 'w') as fp:
+                last_id = None
+                for e2p2_id, _, e2p2_attr in heapq.merge(*sources):
+                    if e2p2_id != last_id:
+                        fp.write(e2p2_id + '\n' + e2p2_attr + '\n')
+                    last_id = e2p2_id
+            os.rename(temp_path, output_path)
+        finally:
+            for fp in runs:
+                fp.close()
+            self.discard()
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+
+    def discard(self):
+        for run_path in self.runs:
+            os.remove(run_path)
+        self.runs = []
+        self.entries = []
+        self.size = 0
+
+
+def sort_pf(pf_path, output_path=None, buffer_size=buffer_size):
+    # Writes the entries of a pf file sorted by ID, to output_path or in place.
+    output_path = output_path or pf_path
+    sorter = PfSorter(os.path.dirname(os.path.abspath(output_path)), buffer_size)
+    with open(pf_path, 'r') as fp:
+        for e2p2_id, e2p2_attr in read_pf(fp):
+            sorter.add(e2p2_id, e2p2_attr)
+    sorter.write(output_path)
+
+
+def remove_empty_from_pf(pf_path, buffer_size=buffer_size):
+    # Removes the entries without a MetaCyc reaction from a pf file, which is then rewritten
+    # sorted by ID. The file is left as it is when no entry is empty, and is replaced only once
+    # the rewritten file is complete.
     empty_count = 0
     with open(pf_path, 'r') as fp:
         print('Opening pf file:\t' + pf_path)
         for e2p2_id, e2p2_attr in read_pf(fp):
-            metacyc_attr = re.findall(r'METACYC\t[^\s]+\n', e2p2_attr)
-            if len(metacyc_attr) > 0:
-                refined_dict.setdefault(e2p2_id, e2p2_attr)
-            else:
+            if not metacyc_attr.search(e2p2_attr):
                 # print("Empty Entry: %s", e2p2_id.replace('ID\t', '').strip())
                 empty_count += 1
-                exist_empty = True
-    if exist_empty:
+    if empty_count:
         print('Removed Empty IDs:\t' + str(empty_count))
-        with open(pf_path, 'w') as fp:
+        sorter = PfSorter(os.path.dirname(os.path.abspath(pf_path)), buffer_size)
+        try:
+            with open(pf_path, 'r') as fp:
+                for e2p2_id, e2p2_attr in read_pf(fp):
+                    if metacyc_attr.search(e2p2_attr):
+                        sorter.add(e2p2_id, e2p2_attr)
             print('Rewriting pf file:\t' + pf_path)
-            for e2p2_id in sorted(refined_dict.keys()):
-                fp.write(e2p2_id + '\n' + refined_dict[e2p2_id] + '\n')
+            sorter.write(pf_path)
+        finally:
+            sorter.discard()
 
 
-if __name__ == '__main__':
-    pass
-    # parser = ArgumentParser()
-    # parser.add_argument('input_path')
+def remove_empty(args):
+    remove_empty_from_pf(*args)
 
-    # args = parser.parse_args()
-    # remove_empty_from_pf(args.input_path)
 
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Removes the entries without a MetaCyc reaction from pf files.')
+    parser.add_argument('input_paths', nargs='+')
+    parser.add_argument('-j', '--jobs', type=int, default=1, help='number of files processed in parallel')
+    parser.add_argument('--buffer-size', type=int, default=buffer_size >> 20,
+                        help='MiB of entries sorted in memory per file before sorted runs are written to disk')
+    args = parser.parse_args()
+    tasks = [(input_path, args.buffer_size << 20) for input_path in args.input_paths]
+    if args.jobs > 1:
+        from multiprocessing import Pool
+        pool = Pool(args.jobs)
+        pool.map(remove_empty, tasks)
+        pool.close()
+        pool.join()
+    else:
+        for task in tasks:
+            remove_empty(task)
@@ -0,0 +1,75 @@
+"""
+Name:         results
+Description:  The results module writes the results files of an ensemble scheme: the short (.out)
+              and long (.long) predictions, the Pathologic input file (.pf) and the same file
+              translated to official MetaCyc reactions (.orxn.pf).
+
+"""
+
+import orxn
+
+# Size of the write buffer of each results file.
+output_buffer = 1 << 20
+
+
+def write_results(filename_output, final_predictions, method, run_date, fc_map, translator):
+    """
+    Writes the short (.out) and long (.long) results of an ensemble scheme, its Pathologic input
+    file (.pf) and the same file translated to official MetaCyc reactions (.orxn.pf), in one pass
+    over the predictions. Records are written as they are built. Returns the number of records
+    written to each file.
+    """
+    # Assemble run information.
+    run_data = "# Run date, time:  %s\n\
+# Ensemble method used:  %s\n" % (run_date, method)
+
+    short_output = open(filename_output, 'w', output_buffer)
+    long_output = open(filename_output + ".long", 'w', output_buffer)
+    pf_output = open(filename_output + ".pf", 'w', output_buffer)
+    orxn_output = orxn.OrxnWriter(filename_output + ".orxn.pf")
+    short_output.write(run_data)
+    long_output.write(run_data)
+    pf_count = 0
+    for seq_id in final_predictions:
+        fpred = final_predictions[seq_id]
+
+        # Short version of results: the predicted classes without their weights.
+        preds = [real_class.split(" ")[0] for real_class in fpred.predictions]
+        short_line = seq_id + "\t" + "|".join(preds).rstrip("|") + "\n"
+        short_output.write(short_line)
+
+        # Long version of results, with each classifier's predictions.
+        long_output.write(">" + seq_id + "\t" + "|".join(fpred.predictions).rstrip("|") + "\n")
+        for cname in fpred.classifiers:
+            final_classifier_preds = "|".join(fpred.classifiers[cname]).rstrip("|")
+            if final_classifier_preds != "":
+                long_output.write(cname + "\t" + final_classifier_preds + "\n")
+        long_output.write("\n")
+
+        # Pathologic input, for sequences with a valid enzyme prediction, translating EF classes
+        # into ECs and reaction IDs. Lines holding a "#" were skipped as comments when the .pf was
+        # read back from the short results, and still are.
+        if '#' in short_line:
+            continue
+        labels = [p for p in preds if "EF" in p]
+        if not labels:
+            continue
+        pf_lines = ["ID\t%s\n" % (seq_id), "NAME\t%s\n" % (seq_id), "PRODUCT-TYPE\tP\n"]
+        for l in labels:
+            translated_reaction = fc_map.get(l)
+            if translated_reaction is None:
+                print("EF class %s assigned to %s not found.\n" % (l, seq_id))
+            elif "RXN" in translated_reaction:
+                pf_lines.append("METACYC\t%s\n" % (translated_reaction))
+            else:
+                pf_lines.append("EC\t%s\n" % (translated_reaction))
+        pf_lines.append("//\n")
+        pf_output.write("".join(pf_lines))
+        pf_count += 1
+        orxn_lines, reactions = translator.translate_entry(pf_lines)
+        orxn_output.write(orxn_lines, reactions)
+    short_output.close()
+    long_output.close()
+    pf_output.close()
+    orxn_output.close()
+    return {"out": len(final_predictions), "pf": pf_count, "orxn_pf": orxn_output.written, "orxn_pf_empty": orxn_output.dropped}
@@ -19,15 +19,15 @@ Usage:       runE2P2.py -i <input file of sequences> -o <output filename> -r <ru
 
 """
 
-from multiprocessing import Process
 from operator import itemgetter
 import sys
 import os
 import shutil
 import subprocess
-import re
+import tempfile
 import time
 import datetime
+import multiprocessing
 
 # Retrieve E2P2 directory path
 script_path = os.path.abspath(__file__)
@@ -37,8 +37,20 @@ e2p2_path = os.path.dirname(script_path)
 # Set up application path during runtime and import modules.
 sys.path.insert(0, os.path.join(e2p2_path, 'source', 'ensemble'))
 import prog
-import ensemble
-import refinepf
+import batch
+import cache
+import checkpoint
+import fasta
+import jobs
+import level0
+import orxn
+import results
+import schedule
+import scratch
+import searches
+import tally
+import telemetry
+import weights
 
 # Define classes and functions.
 class Prediction:
@@ -64,18 +76,113 @@ class Classifier:
         self.predictions = {}
         self.weights = {}
 
+# Size of the write buffer of the decompressed input and appended BLAST outputs.
+output_buffer = 1 << 20
+
 def run_process(cmd):
     # Makes the actual system call.
 
     ret = subprocess.call(cmd, stdout=open('/dev/null', 'w'), stderr=subprocess.STDOUT)
     # ret = subprocess.call(cmd, stderr=subprocess.STDOUT)
 
-def create_process(cmd):
-    # Launches the process by sending the command arguments to the classify subroutine.
-    # Returns a Process object that can then be queried for process status.
-    p = Process(target=run_process, args=(cmd,))
-    p.start()
-    return p
+def run_jobs(runner, stage):
+    # Waits for the jobs started on the runner, exiting with their error if one of them fails.
+    try:
+        runner.wait()
+    except jobs.JobError as e:
+        print "%s failed: %s" % (stage, e)
+        sys.exit(1)
+
+def checkpointed(shard_input, outputs):
+    # Returns a job finisher marking the job as completed on its input, with its output files.
+    def finish(job):
+        run_checkpoint.done(job.name, shard_input, outputs)
+    return finish
+
+def append_file(path, addition_path):
+    # Appends a file to another and removes it.
+    output = open(path, 'ab')
+    addition = open(addition_path, 'rb')
+    shutil.copyfileobj(addition, output, output_buffer)
+    addition.close()
+    output.close()
+    os.remove(addition_path)
+
+def continued_blast(shard_input, output_blast_shard, continuation, query_input):
+    # Returns a job finisher adding the hits of a resumed BLAST search to those kept from the
+    # interrupted one, and marking the search as completed.
+    def finish(job):
+        append_file(output_blast_shard, continuation)
+        os.remove(query_input)
+        run_checkpoint.done(job.name, shard_input, [output_blast_shard])
+    return finish
+
+def run_batch(specs, output_dir, rundir, cpus, memory, child_options):
+    # Runs the driver on each input file named by specs, largest first, the BLAST and PRIAM
+    # searches of all files sharing a budget of cpus CPUs and memory MiB. Writes the throughput
+    # report of the batch and exits, with status 1 when a file failed.
+    try:
+        paths = batch.expand_inputs(specs)
+        outputs = batch.output_names(output_dir, paths)
+    except (batch.InputError, IOError) as e:
+        print "Invalid input: %s." % (e)
+        sys.exit()
+    print "Reading input data."
+    sizes = {}
+    for path in paths:
+        try:
+            sizes[path] = batch.measure(path)
+        except (IOError, fasta.DecompressionError) as e:
+            print "Can't read the input file %s: %s" % (path, e)
+            sys.exit()
+    order = sorted(range(len(paths)), key=lambda i: -sizes[paths[i]][1])
+    batch_folder = os.path.join(rundir, 'run', 'batch.' + str(time.time()))
+    os.makedirs(batch_folder)
+    report = telemetry.Report()
+    budget = jobs.SharedBudget.create(batch_folder, cpus, memory)
+    os.environ[jobs.SharedBudget.env_name] = budget.environ()
+    # The tokens of a file whose driver ended without putting them back, for instance killed, are
+    # put back once its searches are stopped.
+    def reclaim(job):
+        reclaimed = budget.reclaim(job.process.pid)
+        if sum(reclaimed):
+            print "Reclaimed the budget held by %s: %s." % (job.name, ", ".join(
+                "%d %s tokens" % (count, kind) for (kind, path, tokens), count in zip(budget.pools, reclaimed) if count))
+    # A file needs the CPUs of a search to make progress: more files at once would only wait for
+    # the budget.
+    runner = jobs.Runner(max(1, cpus / int(threads)), keep_going=True, on_exit=reclaim)
+    details = {}
+    def finish(job):
+        print "Completed %s (%d of %d)." % (job.name, len(runner.finished), len(paths))
+    print "Running %d input files on %d CPUs%s." % (len(paths), cpus, ", %d MiB" % memory if memory else "")
+    for i in order:
+        name = "%03d.%s" % (i, batch.base_name(paths[i]))
+        cmd = [sys.executable, script_path, "-i", paths[i], "-o", outputs[i], "-r", rundir] + child_options
+        job = jobs.Job(paths[i], cmd, stdout=os.path.join(batch_folder, name + ".log"),
+                       stderr_path=os.path.join(batch_folder, name + ".stderr"), finisher=finish)
+        details[paths[i]] = {"output": outputs[i], "sequences": sizes[paths[i]][0], "residues": sizes[paths[i]][1]}
+        runner.start(job)
+    report.start("batch")
+    try:
+        runner.wait()
+    finally:
+        budget.close()
+    report.end(files=len(runner.finished), failed=len(runner.failed))
+    for job in runner.finished + runner.failed:
+        report.add_job(job, status="failed" if job.failed() else "completed", **details[job.name])
+    for job in runner.failed:
+        print "Failed: %s (log in %s)." % (job.describe_failure(), job.stdout)
+    wall = time.time() - report.started
+    done = [details[job.name] for job in runner.finished]
+    residues = sum(d["residues"] for d in done)
+    sequences = sum(d["sequences"] for d in done)
+    report.info.update({"inputs": len(paths), "cpus": cpus, "memory_mb": memory, "sequences": sequences, "residues": residues,
+                        "residues_per_s": round(residues / wall, 1), "sequences_per_hour": round(sequences * 3600.0 / wall, 1)})
+    report.write(os.path.join(batch_folder, "report.json"))
+    print "Batch complete: %d of %d files, %d sequences, %d residues in %.1f s (%.0f sequences per hour)." % (
+        len(runner.finished), len(paths), sequences, residues, wall, sequences * 3600.0 / wall)
+    print "Run report: %s" % os.path.join(batch_folder, "report.json")
+    sys.exit(1 if runner.failed else 0)
 
 def mkdirp(directory):
     if not os.path.isdir(directory):
@@ -99,46 +206,149 @@ description = '''
     '''
 options = '''
     -h --Displays this help message.
-    -i --Name of the file containing the input protein sequences.
+    -i --Name of the file containing the input protein sequences. Given several times, or naming a
+         directory of FASTA files or a quoted glob pattern, the files are run as a batch: largest
+         first, their searches sharing the --cpus (all CPUs by default) and --mem budget, with
+         -o naming the directory of the results files.
     -o --Name for the output file. [/tmp/E2P2v3.out]
     -r --Run directory [/tmp]
-    -e --evalue cutoff [1e-5]
+    -e --evalue cutoff [1e-5]. Comma-separated cutoffs, e.g. 1e-2,1e-5,1e-10, are all computed
+         from the same searches: the first is written to the output file; each other one to
+         <output file>.e<cutoff>.
     -t --Number of threads (CPUs) to use in the BLAST search [1]
+    --blast-pipe --Parse BLAST results from a pipe while BLAST is running instead of from a file.
+    --blast-tee --With --blast-pipe, also keep the raw BLAST output in the run directory.
+    --blast-slim --Have BLAST write only the columns read by E2P2 (query, subject, e-value and bit
+                   score) and the best HSP of the first few targets of each query. blastp applies
+                   the target limit while it searches, so the best hit, and the predictions, can
+                   differ from those of a full search.
+    --blast-timeout --Seconds after which the BLAST search is stopped and counted as failed.
+    --priam-timeout --Seconds after which the PRIAM search is stopped and counted as failed.
+    --retries --Number of times a failed BLAST or PRIAM search is started again [0]
+    --shards --Number of shards, of similar residue counts, the input is split into for BLAST and PRIAM [1]
+    --cpus --Number of CPUs shared by the BLAST and PRIAM searches of all shards (of all files in a batch) [unlimited]
+    --cache --Prediction cache file. Sequences found in it are not searched again, and new results are added to it.
+    --cache-size --Maximum number of sequences kept in the prediction cache [5000000]
+    --ensemble --Comma-separated ensemble schemes, each with an optional threshold, e.g.
+                max_weight_absolute_threshold:0.5,avg_weight_percent_threshold:20
+                [max_weight_absolute_threshold:0.5]. The first scheme is written to the output
+                file; each other one to <output file>.<scheme>.<threshold>.
+    --resume --Run directory of an interrupted run to complete, with the options of that run unless given
+               again. Level-0 searches that completed on the same input are not run again, and an
+               interrupted BLAST search restarts from its last query.
+    --manifest --File listing input files, directories or glob patterns, one per line, run as a batch.
+    --adaptive --Split the --cpus budget (all CPUs by default) between BLAST and PRIAM in proportion to
+                 their CPU time per residue measured in earlier runs (run/costs.json in the run
+                 directory); the CPUs freed by the search ending first run the other's remaining
+                 shards.
+    --mem --Memory shared by the BLAST and PRIAM searches, e.g. 64G, in MiB without a unit [unlimited].
+                 The input is split so that the searches of each part fit in it, and the PRIAM
+                 JVM heap is sized to its part instead of 3 GB.
+    --scratch --Directory on node-local disk or tmpfs where the intermediate files of the run are
+                written instead of the run directory, and removed when the run ends, whether it
+                succeeds or fails. Only the run report is kept in the run directory. Runs using
+                it cannot be resumed.
+    --scratch-archive --With --scratch, also keep the intermediate files in the run directory as
+                        intermediates.tar.gz.
+    --reensemble --Run directory of a completed run whose BLAST and PRIAM outputs are used instead of
+                   searching again; only the predictions are computed, with the options given. The
+                   input defaults to that of the run.
+    --profile --Profile the Python stages with cprofile (profile files in the run directory) or
+                tracemalloc (Python 3 only; allocation sites in the run report).
     '''
 usage = '''
     runE2P2.py -i <input file of sequences> -o <output filename>
     '''
 notes = '''
-    - Input protein sequences should be in FASTA format.
+    - Input protein sequences should be in FASTA format, plain or compressed with gzip, bzip2 or xz.
     - Headers in the FASTA file should begin with the sequence ID followed by a space.
     - Intermediate results files can be found in the run/ directory in its own subdirectory labeled with a
       date and time stamp.
+    - The run report (report.json in the same subdirectory) gives the wall time, CPU time, peak memory and
+      record counts of each stage, and the resource usage of each BLAST and PRIAM job.
+    - Ensemble schemes: plurality, majority, max_weight, max_weight_percent_threshold,
+      max_weight_absolute_threshold, avg_weight, avg_weight_percent_threshold,
+      avg_weight_absolute_threshold, fixed_avg_weight_percent_threshold,
+      fixed_avg_weight_absolute_threshold, binary_avg_weight_percent_threshold,
+      binary_avg_weight_absolute_threshold.
 '''
 message = prog.get_help(name, description, options, usage, notes)
 
 # Collect command line options using get_options in prog.
 flags = 'hi:o:r:e:t:'
+long_flags = ['blast-pipe', 'blast-tee', 'blast-slim', 'blast-timeout=', 'priam-timeout=', 'retries=', 'shards=', 'cpus=', 'cache=', 'cache-size=', 'ensemble=', 'profile=', 'resume=', 'reensemble=', 'manifest=', 'mem=', 'adaptive', 'scratch=', 'scratch-archive']
 args = sys.argv[1:]
-options = prog.get_options(args, flags)
+options = prog.get_options(args, flags, long_flags)
 
 # Check for help request.
 prog.check_help(options, message)
 
+# A resumed run takes the options of the run it completes, which the command line can override.
+run_state = None
+for a in options[:]:
+    if a[0] == "--resume":
+        run_state = checkpoint.load_state(os.path.abspath(a[1]))
+        if run_state is None:
+            print "No checkpoint found in the run directory: %s" % (a[1])
+            sys.exit()
+if run_state is not None:
+    options = [(str(a[0]), str(a[1])) for a in run_state["options"]] + options
+
+# Predictions computed again from the level-0 outputs of a run are made on the input of that run,
+# and with its prediction cache, which holds the sequences it did not search.
+reensemble_state = None
+for a in options[:]:
+    if a[0] == "--reensemble":
+        if run_state is not None:
+            print "The --resume and --reensemble options cannot be used together."
+            sys.exit()
+        reensemble_state = checkpoint.load_state(os.path.abspath(a[1]))
+if reensemble_state is not None:
+    given = [a[0] for a in options]
+    options = [(str(a[0]), str(a[1])) for a in reensemble_state["options"] if a[0] in ("-i", "--cache") and a[0] not in given] + options
+
 # Store the command line arguments in useful form.
 ## Edit: 9/16/16 Every Input Has a Seperate Folder for intermediate files
 #if "-i" not in [a[0] for a in options[:]] or "-o" not in [a[0] for a in options[:]] or "-r" not in [a[0] for a in options[:]] :
-if "-i" not in [a[0] for a in options[:]] :
+if "-i" not in [a[0] for a in options[:]] and "--manifest" not in [a[0] for a in options[:]]:
     print "Please Specify Input"
     sys.exit()
 
 threads = "1"
 evaluecutoff = 1e-5
+evaluecutoffs = ["1e-5"]
 rundir="/tmp"
 filename_output="/tmp/E2P2v3.out"
+blast_pipe = False
+blast_slim = False
+blast_tee = False
+blast_timeout = None
+priam_timeout = None
+retries = 0
+shards = None
+cpus = None
+cache_path = None
+cache_size = 5000000
+ensemble_schemes = [("max_weight_absolute_threshold", "0.5")]
+profiler = None
+resume_folder = None
+reensemble_folder = None
+input_specs = []
+memory = None
+adaptive = False
+scratch_dir = None
+scratch_archive = False
 
 for a in options[:]:
     if a[0] == "-i":
         filename_input = os.path.abspath(a[1])
+        input_specs.append(a[1])
+    if a[0] == "--manifest":
+        try:
+            input_specs.extend(batch.read_manifest(a[1]))
+        except IOError:
+            print "Can't read the manifest file: %s" % (a[1])
+            sys.exit()
     if a[0] == "-o":
         if len(a[1]) < 1 or not os.path.isdir(os.path.dirname(os.path.abspath(a[1]))):
             print "Output Path Invalid: %s." % (a[1])
@@ -147,32 +357,168 @@ for a in options[:]:
     if a[0] == "-r":
         rundir = os.path.abspath(a[1])
     if a[0] == "-e":
-        evaluecutoff = a[1]
+        evaluecutoffs = [cutoff.strip() for cutoff in a[1].split(",")]
+        for cutoff in evaluecutoffs:
+            try:
+                float(cutoff)
+            except ValueError:
+                print "Invalid evalue cutoff: %s." % (cutoff)
+                sys.exit()
+        evaluecutoff = evaluecutoffs[0]
     if a[0] == "-t":
         threads = a[1]
+    if a[0] == "--blast-pipe":
+        blast_pipe = True
+    if a[0] == "--blast-slim":
+        blast_slim = True
+    if a[0] == "--blast-tee":
+        blast_pipe = True
+        blast_tee = True
+    if a[0] == "--blast-timeout":
+        blast_timeout = float(a[1])
+    if a[0] == "--priam-timeout":
+        priam_timeout = float(a[1])
+    if a[0] == "--retries":
+        retries = int(a[1])
+    if a[0] == "--shards":
+        shards = int(a[1])
+    if a[0] == "--cpus":
+        cpus = int(a[1])
+    if a[0] == "--scratch":
+        scratch_dir = os.path.abspath(a[1])
+    if a[0] == "--scratch-archive":
+        scratch_archive = True
+    if a[0] == "--adaptive":
+        adaptive = True
+    if a[0] == "--mem":
+        try:
+            memory = jobs.parse_memory(a[1])
+        except ValueError:
+            print "Invalid memory size: %s." % (a[1])
+            sys.exit()
+    if a[0] == "--cache":
+        cache_path = os.path.abspath(a[1])
+    if a[0] == "--cache-size":
+        cache_size = int(a[1])
+    if a[0] == "--ensemble":
+        try:
+            ensemble_schemes = tally.parse_schemes(a[1])
+        except ValueError as e:
+            print "%s." % (e)
+            sys.exit()
+    if a[0] == "--profile":
+        profiler = a[1]
+        problem = telemetry.check_profiler(profiler)
+        if problem:
+            print "Invalid profiler: %s." % (problem)
+            sys.exit()
+    if a[0] == "--resume":
+        resume_folder = os.path.abspath(a[1])
+    if a[0] == "--reensemble":
+        reensemble_folder = os.path.abspath(a[1])
     
 
+# Several inputs (more than one -i, a directory, a glob pattern or a manifest) are run as a batch:
+# each file by a child driver, largest first, with the searches of all files sharing one budget
+# of CPUs and memory. The output is then a directory, receiving <input name>.E2P2v3.out for
+# each file.
+if not (resume_folder or reensemble_folder) and (len(input_specs) > 1 or "--manifest" in [a[0] for a in options]
+                                                 or [spec for spec in input_specs if os.path.isdir(spec) or batch.is_pattern(spec)]):
+    output_dir = rundir
+    if "-o" in [a[0] for a in options]:
+        output_dir = filename_output
+    if not os.path.isdir(output_dir):
+        os.makedirs(output_dir)
+    child_options = []
+    for a in options:
+        if a[0] not in ("-i", "-o", "-r", "--manifest", "--cpus", "--mem"):
+            child_options += [a[0], a[1]] if a[1] else [a[0]]
+    run_batch(input_specs, output_dir, rundir, cpus or multiprocessing.cpu_count(), memory, child_options)
+
+# The level-0 outputs of every shard must be complete to compute the predictions again. A run
+# that found all its sequences in the prediction cache has none.
+if reensemble_folder:
+    reensemble_outputs, incomplete = checkpoint.level0_outputs(reensemble_folder)
+    if not reensemble_outputs and not cache_path:
+        print "No level-0 outputs found in the run directory: %s" % (reensemble_folder)
+        sys.exit()
+    if incomplete:
+        print "Level-0 searches did not complete in the run directory %s: %s. Use --resume to complete them." % (reensemble_folder, ", ".join(incomplete))
+        sys.exit()
+
 # Record date and time.
 now = datetime.datetime.now()
 timestamp = time.time()
 time_stamp = str(timestamp)
 
 
+## Edit: 9/16/16 Every Input Has a Seperate Folder for intermediate files
+# A resumed run goes on in its own run directory, with the time stamp its outputs are named after.
+if resume_folder:
+    time_stamp = str(run_state["time_stamp"])
+    input_run_folder = resume_folder
+else:
+    input_run_folder = os.path.join(rundir, 'run', os.path.basename(filename_input) + '.' + time_stamp)
+# With a scratch directory, the intermediate files are written there, and the run directory only
+# receives the run report and, when asked, their archive.
+record_folder = input_run_folder
+scratch_folder = None
+if scratch_dir and not resume_folder:
+    archive_path = os.path.join(record_folder, "intermediates.tar.gz") if scratch_archive else None
+    scratch_folder = scratch.ScratchFolder(scratch_dir, os.path.basename(record_folder), archive_path)
+    input_run_folder = scratch_folder.path
+
+# Time each stage of the run for the run report. Profiles are kept with the report.
+report = telemetry.Report(profiler, record_folder)
+report.info.update({"input": filename_input, "arguments": sys.argv[1:], "run_date": str(now), "resumed": resume_folder is not None,
+                    "reensembled": reensemble_folder})
+
 # Read in the sequence IDs. Note that we do not need to load the actual sequence
-# data into memory.
+# data into memory. The index of the input (ID, offset, length and residue count of each
+# sequence) is cached next to it and reused while the input is unchanged. Compressed input
+# (gzip, bzip2, xz) is decompressed once, and the later stages read the decompressed copy. The
+# copy is kept on node-local disk ($TMPDIR, or the scratch directory) rather than in the run
+# directory, which may be on shared storage, and removed when the run ends.
 print "Reading input data."
-sequences = {}
+report.start("input scan")
+sequence_path = filename_input
+input_scratch = None
 try:
-    input = open(filename_input, 'r')
-    for i in input:
-        if i.startswith(">"):
-            header = i.rstrip().lstrip(">").split("|")[0]
-            id = re.split("\s+", header)[0]
-            sequences[id] = 1
+    input = fasta.InputFile(filename_input)
+    input_signature = fasta.signature(filename_input)
+    index = fasta.read_index(filename_input, input_signature)
+    index_reused = index is not None
+    if input.compression is not None:
+        if scratch_folder is not None:
+            sequence_path = os.path.join(input_run_folder, fasta.plain_name(filename_input))
+        else:
+            input_scratch = scratch.ScratchFolder(tempfile.gettempdir(), "e2p2-input")
+            sequence_path = os.path.join(input_scratch.path, fasta.plain_name(filename_input))
+        sequence_copy = open(sequence_path, 'w', output_buffer)
+        if index_reused:
+            input.copy(sequence_copy)
+        else:
+            index = list(fasta.index_records(level0.tee(input, sequence_copy)))
+        sequence_copy.close()
+    elif not index_reused:
+        index = list(fasta.index_records(input))
     input.close()
 except IOError:
     print "Can't find the input file: %s" % (filename_input)
     sys.exit()
+except fasta.DecompressionError as e:
+    print "Can't decompress the input file %s: %s." % (filename_input, e)
+    sys.exit(1)
+if not index_reused:
+    fasta.write_index(filename_input, input_signature, index)
+sequences = {}
+lengths = []
+for id, offset, length, residues in index:
+    sequences[id] = 1
+    lengths.append((id, residues))
+input_report = input.report()
+report.end(sequences=len(index), distinct_ids=len(sequences), bytes_read=input.bytes_read, text_bytes=input.text_bytes,
+           compression=input.compression, index_reused=index_reused)
 
 # Create the classifier objects.
 classifiers = {}
@@ -183,332 +529,355 @@ for cn in cnames:
     c.weights = {}
     classifiers[cn] = c
 
-# Populate the weight data for each classifier.
-data = ""
+# Populate the weight data for each classifier, and read in the mapping data that relates Enzyme
+# Functional class numbers to EC classes and reaction IDs. Both are read from the compiled index
+# in source/ensemble/data when it is up to date.
+report.start("weights load")
 try:
-    input = open(os.path.join(e2p2_path, "source", "ensemble", "data", "weights"), 'r')
-    for i in input:
-        data += i
-    input.close()
-
-    # Populate temporary data structures to process weight data for each method.
-    temp = data.split(">")
-    for t in temp:
-        if t:
-            entries = t.split("\n")
-
-            # Record weights.
-            cname, parameter = entries[0].split("|")[0], entries[0].split("|")[1]
-            c = classifiers[cname]
-            for e in entries[1:]:
-                try:
-                    cid, wval = e.split("\t")[0], e.split("\t")[1]
-                    if wval == "NA" or wval == "0" or wval == "-1.000":
-                        wval = "0.000"
-                    c.weights[cid] = wval
-                except:
-                    continue
-except IOError:
-    print "Can't find the following weight file: source/ensemble/data/weights."
+    classifier_weights, fc_map = weights.load(os.path.join(e2p2_path, "source", "ensemble", "data"))
+except (IOError, OSError) as e:
+    print "Can't find the following weight or functional class mapping file: %s." % (e.filename)
     sys.exit()
+for cname in classifier_weights:
+    if cname in classifiers:
+        classifiers[cname].weights = classifier_weights[cname]
 
 del classifiers["CatFam"]
-
-# Read in the mapping data that relates Enzyme Functional class numbers to EC classes and reaction IDs.
-fc_map = {}
-try:
-    input = open(os.path.join(e2p2_path, "source", "ensemble", "data", "fcmap"), 'r')
-    # create a dictionary mapping FC IDs to EC and reaction IDs.
-    for i in input:
-        if "#" not in i:
-            try:
-                ef, id = i.split("\t")[0], i.rstrip().split("\t")[1]
-                fc_map[ef] = id
-            except:
-                continue
-    input.close()
-except IOError:
-    print "Can't find the following functional class mapping file: source/ensemble/data/fcmap."
-    sys.exit()
+report.end(classifiers=len(classifier_weights))
 
 ## Process the input file with each level-0 classifier. Run the classifiers concurrently as
 ## separate processes to save time.
 print "Running level-0 classification processes."
 
-## Edit: 9/16/16 Every Input Has a Seperate Folder for intermediate files
-input_run_folder = os.path.join(rundir, 'run', os.path.basename(filename_input) + '.' + time_stamp)
 if not os.path.exists(input_run_folder):
     os.makedirs(input_run_folder)
+# Completed level-0 jobs are marked in the run directory, so that the run can be resumed.
+run_checkpoint = checkpoint.Checkpoint(input_run_folder)
+# Paths in the options are kept absolute, so that the run can be resumed from any directory.
+path_options = ["-i", "-o", "-r", "--cache", "--scratch"]
+if not reensemble_folder:
+    run_checkpoint.save_state({"input": filename_input, "time_stamp": time_stamp,
+                               "options": [(a[0], os.path.abspath(a[1]) if a[0] in path_options else a[1]) for a in options if a[0] != "--resume"]})
 output_blast = os.path.join(input_run_folder, "blast." + time_stamp)
 
-touch_cmd = handle_spaces_in_paths(['touch', output_blast])
-touch_ret = run_process(touch_cmd)
-
-blast_cmd = handle_spaces_in_paths([os.path.join(e2p2_path, 'source', 'blast', 'ncbi-blast-2.2.30+', 'bin', 'blastp'), '-db', os.path.join(e2p2_path, 'source', 'blast', 'db', 'rpsd-3.1.fa'), '-query', filename_input, '-out', output_blast, '-outfmt', '6', '-num_threads', threads])
-#print(blast_cmd)
-blast = create_process(blast_cmd)
-
-output_priam = os.path.join(input_run_folder, "PRIAM_%s" % (time_stamp), "ANNOTATION", "sequenceECs.txt")
-## Edit: 9/16/16 Add Memory Settings for Java
-priam_cmd = handle_spaces_in_paths([os.path.join(e2p2_path, 'source', 'java', 'jre1.6.0_30', 'bin', 'java'), '-Xms3072m', '-Xmx3072m', '-jar', os.path.join(e2p2_path, 'source', 'priam', 'PRIAM_search.jar'), '--bd', os.path.join(e2p2_path, 'source', 'blast', 'blast-2.2.26', 'bin'), '-n', time_stamp, '-i', filename_input, '-p', os.path.join(e2p2_path, 'source', 'priam', 'profiles'), '--bh', '-o', input_run_folder, '--np', threads])
-priam = create_process(priam_cmd)
-
-# Hold until the last classifier finishes.
-blast.is_alive()
-priam.is_alive()
-while blast.is_alive() or priam.is_alive():
-    time.sleep(5)
-
-## Process the output files from each classifer.
-predictions = {}
+# Look up the input sequences in the prediction cache. Only the sequences it does not hold are
+# searched, and BLAST results are kept before the e-value cutoff so that they can be reused
+# with any cutoff, as they are when several cutoffs are computed.
+level0_input = sequence_path
+level0_lengths = lengths
+blast_hits = {}
+blast_cutoff = evaluecutoff
+if len(evaluecutoffs) > 1:
+    blast_cutoff = None
+if cache_path:
+    print "Looking up sequences in the prediction cache."
+    report.start("cache lookup")
+    blast_cutoff = None
+    prediction_cache = cache.Cache(cache_path, cache_size)
+    # Slim BLAST output may have another best hit than a full search: its results are kept apart.
+    blast_mode = ":slim%d" % (searches.slim_max_targets) if blast_slim else ""
+    cache_version = cache.data_version("rpsd-3.1" + blast_mode, [os.path.join(e2p2_path, "source", "ensemble", "data", "weights")])
+    sequence_keys = {}
+    input = open(sequence_path, 'r')
+    for id, sequence in fasta.read_records(input):
+        if id not in sequence_keys:
+            sequence_keys[id] = cache.sequence_key(sequence, cache_version)
+    input.close()
+    cached = prediction_cache.lookup(sequence_keys.values())
+    uncached = {}
+    for id in sequence_keys:
+        if sequence_keys[id] in cached:
+            blast_hit, priam_hits = cached[sequence_keys[id]]
+            if blast_hit is not None:
+                blast_hits[id] = blast_hit
+            if priam_hits is not None:
+                classifiers["Priam"].predictions[id] = priam_hits
+        else:
+            uncached[id] = 0
+    level0_lengths = [(id, residues) for id, residues in lengths if id in uncached]
+    # When no sequence is cached, as in a first run, the input is searched as it is.
+    if len(uncached) == len(sequence_keys):
+        level0_input = sequence_path
+    elif uncached:
+        level0_input = os.path.join(input_run_folder, os.path.basename(filename_input) + "_uncached")
+    else:
+        level0_input = None
+    report.end(sequences=len(sequence_keys), hits=len(sequence_keys) - len(uncached), misses=len(uncached))
+
+# Split the input into shards of similar residue counts. Without a shard count, a CPU budget
+# gives one shard per BLAST or PRIAM search it can run at once. In adaptive mode, the budget is
+# split between BLAST and PRIAM by their measured costs, and small inputs get fewer shards.
+costs_path = os.path.join(rundir, 'run', 'costs.json')
+level0_residues = sum(residues for id, residues in level0_lengths)
+if adaptive and not cpus:
+    cpus = multiprocessing.cpu_count()
+slots = max(1, (cpus or 1) / int(threads))
+if shards is None:
+    if adaptive:
+        shards = schedule.shard_count(slots, level0_residues)
+    elif cpus:
+        shards = slots
+    else:
+        shards = 1
+
+# The searches of a batch share the budget of the batch; --mem gives a single run its own. Under
+# a memory budget, the input is split so that the searches of each shard fit in it, and PRIAM
+# gets the heap of its shard.
+budget = jobs.SharedBudget.from_env()
+if budget is None and memory:
+    budget = jobs.SharedBudget.create(input_run_folder, cpus or multiprocessing.cpu_count(), memory)
+memory_limit = budget.memory() if budget is not None else None
+max_residues = None
+if memory_limit and level0_input is not None and not reensemble_folder:
+    max_residues = searches.max_shard_residues(memory_limit)
+    if not max_residues:
+        print "The memory budget of %d MiB is below the %d MiB of a PRIAM search." % (memory_limit, searches.priam_memory(0))
+        budget.close()
+        sys.exit(1)
+    shards = max(shards, -(-level0_residues // max_residues))
+
+shard_inputs = []
+shard_residues = []
+report.start("shard split")
+if level0_input is not None and not reensemble_folder:
+    # Shards are added until the largest fits the memory budget.
+    while shards > 1:
+        assignment, shards = fasta.plan_shards(level0_lengths, shards)
+        shard_residues = [0] * shards
+        for id, residues in level0_lengths:
+            shard_residues[assignment[id]] += residues
+        if max_residues is None or max(shard_residues) <= max_residues or shards >= len(level0_lengths):
+            break
+        shards += 1
+    if shards > 1:
+        shard_paths = [os.path.join(input_run_folder, "%s_%02d" % (os.path.basename(filename_input), i)) for i in range(shards)]
+        fasta.copy_records(sequence_path, index, assignment, shard_paths)
+        for i in range(shards):
+            shard_inputs.append(("_%02d" % i, shard_paths[i]))
+    else:
+        # Only the sequences missing from the prediction cache are searched.
+        if level0_input != sequence_path:
+            fasta.copy_records(sequence_path, index, uncached, [level0_input])
+        shard_inputs.append(("", level0_input))
+        shard_residues = [level0_residues]
+report.end(shards=len(shard_inputs), sequences=len(level0_lengths))
+
+# Start the PRIAM searches first as they run the longest, or in adaptive mode in the order planned
+# from the measured costs. Searches completed on the same input by an earlier attempt of the run
+# are skipped.
+report.start("level-0")
+runner = jobs.Runner(cpus, budget)
+for folder in [scratch_folder, input_scratch]:
+    if folder is not None:
+        folder.watch(runner)
+outputs_blast = []
+outputs_priam = []
+skipped_jobs = []
+continued_jobs = []
+level0_jobs = {}
+for i, (suffix, shard_input) in enumerate(shard_inputs):
+    output_priam = searches.priam_output(input_run_folder, time_stamp + suffix)
+    outputs_priam.append(output_priam)
+    if run_checkpoint.is_done("PRIAM" + suffix, shard_input):
+        skipped_jobs.append("PRIAM" + suffix)
+        continue
+    if memory_limit:
+        priam_heap = searches.priam_heap(shard_residues[i])
+    else:
+        priam_heap = searches.default_priam_heap
+    priam_cmd = handle_spaces_in_paths(searches.priam_command(e2p2_path, time_stamp + suffix, shard_input, input_run_folder, threads, priam_heap))
+    run_checkpoint.started("PRIAM" + suffix, shard_input)
+    level0_jobs[("PRIAM", i)] = jobs.Job("PRIAM" + suffix, priam_cmd, stderr_path=os.path.join(input_run_folder, "priam%s.stderr" % suffix), timeout=priam_timeout, retries=retries, cpus=int(threads), finisher=checkpointed(shard_input, [output_priam]), memory=searches.priam_memory(shard_residues[i], priam_heap))
+
+blast_pipe_hits = {}
+for i, (suffix, shard_input) in enumerate(shard_inputs):
+    output_blast_shard = output_blast + suffix
+    outputs_blast.append((suffix, output_blast_shard))
+    if run_checkpoint.is_done("BLAST" + suffix, shard_input):
+        skipped_jobs.append("BLAST" + suffix)
+        continue
+    # A search interrupted on the same input is restarted from its last query, which may not be
+    # complete, unless its output was only read from a pipe.
+    query_input = shard_input
+    continuation = output_blast_shard + ".resume"
+    if not blast_pipe and os.path.isfile(output_blast_shard) and run_checkpoint.was_started("BLAST" + suffix, shard_input):
+        # Hits of a continued search that was interrupted in turn are kept too.
+        if os.path.exists(continuation):
+            append_file(output_blast_shard, continuation)
+        query = level0.truncate_blast(output_blast_shard)
+        if query is not None and fasta.copy_tail(shard_input, fasta.sequence_id(query), output_blast_shard + ".query"):
+            query_input = output_blast_shard + ".query"
+            continued_jobs.append("BLAST" + suffix)
+    blast_cmd = handle_spaces_in_paths(searches.blast_command(e2p2_path, query_input, threads))
+    if blast_slim:
+        # The column list is a single argument holding spaces.
+        blast_cmd = searches.slim_blast_command(blast_cmd)
+    #print(blast_cmd)
+    run_checkpoint.started("BLAST" + suffix, shard_input)
+    blast = jobs.Job("BLAST" + suffix, blast_cmd, stderr_path=os.path.join(input_run_folder, "blast%s.stderr" % suffix), timeout=blast_timeout, retries=retries, cpus=int(threads), memory=searches.blast_memory(shard_residues[i]))
+    if blast_pipe:
+        # BLAST writes to stdout, which is parsed while PRIAM and BLAST are still running.
+        def read_blast_pipe(pipe, suffix=suffix, output_blast_shard=output_blast_shard):
+            # Stream the BLAST output, keeping the top hit of each query. A retried search starts over.
+            hits = blast_pipe_hits[suffix] = {}
+            input = pipe
+            if blast_tee:
+                blast_copy = open(output_blast_shard, 'w')
+                input = level0.tee(input, blast_copy)
+            for qid, evalue, efs in level0.read_blast(input, blast_cutoff):
+                hits[qid] = (evalue, efs)
+            if blast_tee:
+                blast_copy.close()
+        blast.stdout = subprocess.PIPE
+        blast.consumer = read_blast_pipe
+        # Without a copy on disk, the search cannot be skipped when the run is resumed.
+        if blast_tee:
+            blast.finisher = checkpointed(shard_input, [output_blast_shard])
+    elif query_input != shard_input:
+        blast.cmd = blast_cmd + handle_spaces_in_paths(['-out', continuation])
+        blast.finisher = continued_blast(shard_input, output_blast_shard, continuation, query_input)
+    else:
+        touch_cmd = handle_spaces_in_paths(['touch', output_blast_shard])
+        touch_ret = run_process(touch_cmd)
+        blast.cmd = blast_cmd + handle_spaces_in_paths(['-out', output_blast_shard])
+        blast.finisher = checkpointed(shard_input, [output_blast_shard])
+    level0_jobs[("BLAST", i)] = blast
+if adaptive:
+    level0_costs, measured = schedule.read_costs(costs_path)
+    blast_slots, priam_slots = schedule.split_slots(slots, level0_costs)
+    level0_order = schedule.plan_order(shard_residues, blast_slots, priam_slots, level0_costs)
+    if shard_inputs:
+        print "CPU split: BLAST %d, PRIAM %d of %d job slots of %s threads (PRIAM/BLAST cost ratio %.2f, %s)." % (
+            blast_slots, priam_slots, slots, threads, level0_costs["PRIAM"] / level0_costs["BLAST"], "measured" if measured else "default")
+else:
+    level0_order = [(search, i) for search in schedule.searches for i in range(len(shard_inputs))]
+for key in level0_order:
+    if key in level0_jobs:
+        runner.start(level0_jobs[key])
+if reensemble_folder:
+    print "Computing the predictions again from the level-0 outputs of %s: %d shards." % (reensemble_folder, len(reensemble_outputs))
+    outputs_blast = [(suffix, output_blast_shard) for suffix, output_blast_shard, output_priam in reensemble_outputs]
+    outputs_priam = [output_priam for suffix, output_blast_shard, output_priam in reensemble_outputs]
+if resume_folder:
+    print "Resuming the run in %s: %d level-0 searches already completed%s, %d restarted from their last query." % (
+        input_run_folder, len(skipped_jobs), (" (%s)" % ", ".join(skipped_jobs)) if skipped_jobs else "", len(continued_jobs))
+
+# Hold until the last classifier finishes. A failing classifier stops the others.
+run_jobs(runner, "Level-0 classification")
+if budget is not None:
+    budget.close()
+# The CPU time of the searches run on whole shards is kept to plan later runs.
+level0_usage = {}
+for job in runner.finished:
+    search, _, shard = job.name.partition("_")
+    residues = shard_residues[int(shard) if shard else 0]
+    report.add_job(job, residues=residues)
+    if job.rusage is not None and job.name not in continued_jobs:
+        cpu_s, total = level0_usage.get(search, (0.0, 0))
+        level0_usage[search] = (cpu_s + job.rusage.ru_utime + job.rusage.ru_stime, total + residues)
+if level0_usage:
+    schedule.record_costs(costs_path, level0_usage)
+report.end(jobs=len(runner.finished), skipped=len(skipped_jobs), continued=len(continued_jobs))
+
+## Process the output files from each classifer, merging the shards in order.
 print "Compiling predictions."
 
 # Blast
-temp_preds = {}
-temp_hits = {}
-preds_blast = {}
-input = open(output_blast, 'r')
-temp = ""
-for i in input:
-    temp += i
-input.close()
-data = temp.split("\n")
-
-# Iterate over all queries.
-for d in data:
-    if d:
-        # Get the ID.
-        temp = d.split("\t")
-        ##  Edit: 9/16/16 Make Sure Python Can Read the Format of e-value
-        if temp[-2].startswith('e'):
-            temp_float = "1" + temp[-2]
-        else:
-            temp_float = temp[-2]
-        qid, temp_hit, eval = temp[0].split("\s+")[0].split("|")[0], temp[1], float(temp[-2])
-
-        if eval > float(evaluecutoff):
-            continue
-
-        # Retrieve or create prediction object for a given query.
-        if qid in temp_hits:
-            continue
-        else:
-            temp_hits[qid] = eval
-
-        if qid in temp_preds:
-            tp = temp_preds[qid]
-        else:
-            tp = Prediction(qid)
-
-        # Get the EFs from the hit line.
-        hits = []
-        ## Edit: 9/16/16 Split Query ID by "|" and whitespace
-        #hits_temp = temp_hit.split("|")
-        hits_temp = re.split("[|\s]+", temp_hit)
-        for h in hits_temp[1:]:
-            if "EF" in h:
-                hits.append(h)
-        for h in hits: # Skip the first field, which contains the hit ID. We only need the predicted EF class.
-            if h in tp.predictions: # Record the lowest evalue for that EF class.
-                best_eval = tp.predictions[h]
-                if eval < best_eval:
-                    tp.predictions[h] = eval
-            else:
-                tp.predictions[h] = eval
-        temp_preds[qid] = tp
-
-# Iterate over queries to find and record their top hits.
-c = classifiers["BLAST"]
-for qid in temp_preds:
-    c.predictions[qid] = []
-    p = Prediction(qid)
-    tp = temp_preds[qid]
-
-    # Find the lowest evalue.
-    best_eval = 1.0
-    for hit in tp.predictions:
-        if tp.predictions[hit] < best_eval:
-            best_eval = tp.predictions[hit]
-
-    # Iterate over predictions to find the top hits.
-    for hit in tp.predictions:
-        if tp.predictions[hit] == best_eval:
-            c.predictions[qid].append(hit)
-            if hit in p.predictions:
-                p.predictions[hit] = tp.predictions[hit]
-            else:
-                p.predictions[hit] = tp.predictions[hit]
-    
-    preds_blast[qid] = p            
-predictions["BLAST"] = preds_blast
+# Stream the BLAST output, keeping the top hit of each query.
+report.start("BLAST parse")
+for suffix, output_blast_shard in outputs_blast:
+    if suffix in blast_pipe_hits:
+        blast_hits.update(blast_pipe_hits[suffix])
+    else:
+        input = open(output_blast_shard, 'r')
+        for qid, evalue, efs in level0.read_blast(input, blast_cutoff):
+            blast_hits[qid] = (evalue, efs)
+        input.close()
+report.end(hits=len(blast_hits))
 
 # Priam
-#preds_priam = {}
+report.start("PRIAM parse")
 c = classifiers["Priam"]
-input = open(output_priam, 'r')
-temp = ""
-for i in input:
-    temp += i
-input.close()
-data = temp.split(">")
-
-# Iterate over all queries.
-for d in data[1:]:
-
-    # Process the hit info for the query.
-    temp = d.split("\n")
-    hits = []
-    
-    # Get the query ID.
-    #qid = temp[0].split("\s+")[0].split("|")[0]
-    
-    ## Edit: 9/16/16 Split Query ID by "|" and whitespace
-    qid = re.split("[|\s]+", temp[0])[0]
-    
-    c.predictions[qid] = []
-    p = Prediction(qid)
-    for t in temp[1:]:
-        # Get the hits.
-        if t.startswith('EF'):
-            hits.append(t.split("\t")[0].rstrip())
-
-    c.predictions[qid] = []
-    #p = Prediction(qid)
-    for h in hits:
-        c.predictions[qid].append(h)
-        #p.predictions[h] = 1.0
-    #preds_priam[qid] = p
-input.close()
-
-# Calculate the ensemble prediction for each query sequence.
-print "Computing ensemble predictions."
-threshold = float(0.5)
-final_predictions = {}
-for qid in sequences:
-
-    # Call the ensemble subroutine from the ensemble module.
-    fpred = ensemble.perform_max_weight_absolute_threshold(qid, classifiers, threshold)
-    final_predictions[qid] = fpred
-
-## Output results files.
-print "Preparing results files."
-# Assemble run information.
-run_data = "# Run date, time:  %s\n\
-# Ensemble method used:  %s\n" % (now, "Maximum weight with absolute threshold (0.5)")
-
-# Prepare short version of results.
-short_output = "%s" % (run_data)
-for seq_id in final_predictions:
-    fpred = final_predictions[seq_id]
-    pred_output = ""
-    for real_class in fpred.predictions:
-        real_class_edited = real_class.split(" ")[0]
-        pred_output += real_class_edited + "|"
-    final_preds = pred_output.rstrip("|")
-    short_output += seq_id + "\t" + final_preds + "\n"
-
-# Print short output.
-#filename_output = filename_output + "." + voting_scheme
-output = open(filename_output, 'w')
-output.write(short_output)
-output.close()
-
-# Prepare long version of results.
-long_output = "%s" % (run_data)
-for seq_id in final_predictions:
-    fpred = final_predictions[seq_id]
-    pred_output = ""
-    for real_class in fpred.predictions:
-        pred_output += real_class + "|"
-    final_preds = pred_output.rstrip("|")
-    long_output += ">" + seq_id + "\t" + final_preds + "\n"
-    for cname in fpred.classifiers:
-        classifier_pred_output = ""
-        for real_class in fpred.classifiers[cname]:
-            classifier_pred_output += real_class + "|"
-        final_classifier_preds = classifier_pred_output.rstrip("|")
-        if final_classifier_preds != "":
-            long_output += cname + "\t" + final_classifier_preds + "\n"
-    long_output += "\n"
-
-# Print long output.
-filename_output_full = filename_output + ".long"
-output = open(filename_output_full, 'w')
-output.write(long_output)
-output.close()
-
-# Prepare Pathologic input file.
-# Read in input data and store sequence ID and predictions if it's a valid enzyme prediction.
-entries = {}
-
-input = open(filename_output, 'r')
-for line in input:
-    labels = []
-    
-    # Skip the commented information.
-    if '#' in line or line.startswith('\n'):
-        continue
-    else:
-        id = ""
-        preds = []
-        check = 0
-        l = line.rstrip()
-        if '\t' in l:
-            data = l.split('\t')
-            id = data[0].split('|')[0]
-            if "EF" in data[1]:
-                preds = data[1].split('|')
-                check = 1
-            if check == 1:
-                e = Prediction(id)
-                e.labels = []
-                for p in preds:
-                    if "EF" in p:
-                        e.labels.append(p)
-                entries[id] = e
-                check = 0
-
-# Create the output file, translating EF classes into ECs and reaction IDs.
-results = ''
-for id in entries:
-    e = entries[id]
-    results += "ID\t%s\nNAME\t%s\nPRODUCT-TYPE\tP\n" % (id, id)
-    for l in e.labels:
-        if "EF" in l:
-            try:
-                translated_reaction = fc_map[l]
-                if "RXN" in translated_reaction:
-                    results += "METACYC\t%s\n" % (translated_reaction)
-                else:
-                    results += "EC\t%s\n" % (translated_reaction)
-            except:
-                print "EF class %s assigned to %s not found.\n" % (translated_reaction, id)
-    results += "//\n"
-
-# Print pathologic input file.
-filename_pathologic = filename_output + ".pf"
-output = open(filename_pathologic, 'w')
-output.write(results)
-output.close()
-
-# Print pathologic input file translated to reaction ids only.
-filename_pathologic_orxn = filename_output + ".orxn.pf"
-pf_cmd = ['perl', os.path.join(e2p2_path, 'tools', 'pf-EC-to-official-RXN.pl'), filename_pathologic]
-pf = create_process(pf_cmd)
-
-# Hold until the last classifier finishes.
-pf.is_alive()
-while pf.is_alive():
-    time.sleep(1)
-refinepf.remove_empty_from_pf(filename_pathologic_orxn)
+for output_priam in outputs_priam:
+    input = open(output_priam, 'r')
+    for qid, hits in level0.read_priam(input):
+        c.predictions[qid] = hits
+    input.close()
+report.end(predictions=len(c.predictions))
+
+# Add the results of the searched sequences to the prediction cache.
+if cache_path and not reensemble_folder:
+    report.start("cache store")
+    prediction_cache.store((sequence_keys[id], blast_hits.get(id), c.predictions.get(id)) for id in uncached)
+    prediction_cache.close()
+    print "Prediction cache: %s." % prediction_cache.report()
+    report.end(stored=prediction_cache.stored, evicted=prediction_cache.evicted)
+
+print "Input file: %s, index %s." % (input_report, "reused" if index_reused else "built")
+
+# The ensemble predictions and results files of each e-value cutoff are computed in turn, from
+# the same BLAST hits. The first cutoff is written to the output file, the others next to it.
+results_files = []
+scheme_thresholds = [(scheme, float(threshold_text or "0.5")) for scheme, threshold_text in ensemble_schemes]
+c = classifiers["BLAST"]
+translator = None
+for cutoff in evaluecutoffs:
+    c.predictions = {}
+    for qid in blast_hits:
+        evalue, efs = blast_hits[qid]
+        if evalue <= float(cutoff):
+            c.predictions[qid] = level0.blast_prediction(evalue, efs)
+    cutoff_output = filename_output
+    stage_suffix = ""
+    if results_files:
+        cutoff_output = "%s.e%s" % (filename_output, cutoff)
+    if len(evaluecutoffs) > 1:
+        stage_suffix = ", e-value %s" % (cutoff)
+
+    # Calculate the ensemble predictions of each requested scheme for each query sequence.
+    print "Computing ensemble predictions."
+    # All sequences are evaluated at once and every scheme uses the same votes, with NumPy when it is
+    # installed; the results are the same as those of the ensemble module's per-sequence functions.
+    report.start("ensemble" + stage_suffix)
+    scheme_predictions = tally.perform_schemes(scheme_thresholds, sequences, classifiers)
+    report.end(schemes=len(scheme_thresholds), sequences=len(sequences), blast_predictions=len(c.predictions))
+
+    ## Output results files.
+    print "Preparing results files."
+    # The MetaCyc tables used to translate EC numbers into official reactions are read once for all
+    # results files.
+    if translator is None:
+        report.start("MetaCyc tables load")
+        translator = orxn.Translator(os.path.join(e2p2_path, "tools", "data"))
+        report.end()
+    # The first scheme is written to the output file of the cutoff, the others next to it.
+    for i, ((scheme, threshold_text), final_predictions) in enumerate(zip(ensemble_schemes, scheme_predictions)):
+        method = tally.scheme_names[scheme]
+        if threshold_text:
+            method += " (%s)" % (threshold_text)
+        if i == 0:
+            filename = cutoff_output
+        elif threshold_text:
+            filename = "%s.%s.%s" % (cutoff_output, scheme, threshold_text)
+        else:
+            filename = "%s.%s" % (cutoff_output, scheme)
+        # The .out, .long, .pf and .orxn.pf files of a scheme are written in a single pass.
+        report.start("results files (%s%s)" % (method, stage_suffix))
+        report.end(**results.write_results(filename, final_predictions, method, now, fc_map, translator))
+        results_files.append(filename)
+
 # Notify user of completion and exit.
 print "Operation complete."
-print "Main results are in the file: %s" % filename_output
-print "Detailed results are in the file: %s" % filename_output_full
-print "To build PGDB, use .pf file: %s" % filename_pathologic_orxn
-print "Intermediate files are in the directory: %s" % input_run_folder
+for filename in results_files:
+    print "Main results are in the file: %s" % filename
+    print "Detailed results are in the file: %s" % (filename + ".long")
+    print "To build PGDB, use .pf file: %s" % (filename + ".orxn.pf")
+if scratch_folder is None:
+    print "Intermediate files are in the directory: %s" % input_run_folder
+elif scratch_archive:
+    print "Intermediate files are archived in the file: %s" % os.path.join(record_folder, "intermediates.tar.gz")
+if not os.path.exists(record_folder):
+    os.makedirs(record_folder)
+report.write(os.path.join(record_folder, "report.json"))
+print "Run report: %s" % os.path.join(record_folder, "report.json")
 sys.exit()
-
-
-
-
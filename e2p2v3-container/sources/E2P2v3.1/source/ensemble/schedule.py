@@ -0,0 +1,102 @@
+"""
+Name:         schedule
+Description:  The schedule module splits a CPU budget between the BLAST and PRIAM searches of a
+              run. The CPU time each search takes per residue is measured in every run and kept,
+              averaged over the recent runs, in a costs file. A run given a budget gives each
+              search a share of the CPUs in proportion to its expected cost, and orders its jobs by
+              their planned start, so that the CPUs freed by the search that ends first are taken
+              by the shards the other one still has to run.
+
+"""
+
+import json
+import os
+
+# Relative CPU seconds per residue of each search, used until a run has measured them. PRIAM
+# usually runs several times longer than BLAST.
+default_costs = {"BLAST": 1.0, "PRIAM": 3.0}
+
+# Weight of the earlier measurements when a run adds its own.
+history_weight = 0.5
+
+# Residues below which a shard is not worth its search start-up.
+min_shard_residues = 100000
+
+searches = ["PRIAM", "BLAST"]
+
+
+def read_costs(path):
+    """
+    Returns the CPU seconds per residue of each search, as measured in earlier runs, and whether
+    they were measured.
+    """
+    try:
+        with open(path) as fp:
+            measured = json.load(fp)
+        return dict((search, measured[search]["cpu_s"] / measured[search]["residues"]) for search in searches), True
+    except (IOError, ValueError, KeyError, ZeroDivisionError):
+        return dict(default_costs), False
+
+
+def record_costs(path, usage):
+    """
+    Adds the CPU seconds and residues of the searches of a run, usage[search] = (cpu_s, residues),
+    to the costs file, the earlier measurements weighing history_weight.
+    """
+    try:
+        with open(path) as fp:
+            measured = json.load(fp)
+    except (IOError, ValueError):
+        measured = {}
+        # The run directory of a run staged in scratch may not exist yet.
+        if not os.path.isdir(os.path.dirname(path)):
+            os.makedirs(os.path.dirname(path))
+    for search in usage:
+        cpu_s, residues = usage[search]
+        if residues <= 0:
+            continue
+        earlier = measured.get(search, {"cpu_s": 0.0, "residues": 0})
+        measured[search] = {"cpu_s": earlier["cpu_s"] * history_weight + cpu_s,
+                            "residues": int(earlier["residues"] * history_weight) + residues}
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    with open(temp_path, 'w') as fp:
+        json.dump(measured, fp, indent=1, separators=(',', ': '), sort_keys=True)
+        fp.write("\n")
+    os.rename(temp_path, path)
+
+
+def shard_count(slots, residues):
+    """
+    Returns the number of shards of an input of the given residues for a budget of slots jobs
+    at once: one per slot, unless the shards would be too small.
+    """
+    return max(1, min(slots, residues // min_shard_residues))
+
+
+def split_slots(slots, costs):
+    """
+    Returns the job slots given to BLAST and to PRIAM, in proportion to their costs, each search
+    having at least one.
+    """
+    if slots < 2:
+        return 1, 1
+    blast_slots = int(round(slots * costs["BLAST"] / (costs["BLAST"] + costs["PRIAM"])))
+    blast_slots = min(slots - 1, max(1, blast_slots))
+    return blast_slots, slots - blast_slots
+
+
+def plan_order(shard_residues, blast_slots, priam_slots, costs):
+    """
+    Returns the (search, shard) jobs in the order of their planned start, each search running
+    its shards largest first on its own slots. Jobs planned to start together are listed PRIAM
+    first.
+    """
+    planned = []
+    order = sorted(range(len(shard_residues)), key=lambda shard: -shard_residues[shard])
+    for rank, search in enumerate(searches):
+        slots = [0.0] * (priam_slots if search == "PRIAM" else blast_slots)
+        for shard in order:
+            i = slots.index(min(slots))
+            planned.append((slots[i], rank, search, shard))
+            slots[i] += shard_residues[shard] * costs[search]
+    return [(search, shard) for start, rank, search, shard in sorted(planned)]
@@ -0,0 +1,81 @@
+"""
+Name:         scratch
+Description:  The scratch module keeps the intermediate files of a run on node-local disk or tmpfs
+              instead of the run directory, which may be on a shared filesystem. The run folder
+              is made in the scratch directory and removed when the driver exits, whether the run
+              succeeds or fails, once its files are optionally archived, compressed, to the run
+              directory. The searches still running are killed first.
+
+"""
+
+import atexit
+import os
+import shutil
+import signal
+import sys
+import tarfile
+import tempfile
+
+# Signals ending the driver, as sent by batch schedulers, after which the scratch folder is still
+# removed.
+exit_signals = [signal.SIGTERM, signal.SIGHUP]
+
+
+def archive(folder, path, name):
+    """
+    Writes the files of folder to the gzip-compressed tar file path, under the directory name.
+    """
+    temp_path = "%s.%d.tmp" % (path, os.getpid())
+    output = tarfile.open(temp_path, 'w:gz')
+    try:
+        for entry in sorted(os.listdir(folder)):
+            output.add(os.path.join(folder, entry), os.path.join(name, entry))
+    finally:
+        output.close()
+    os.rename(temp_path, path)
+
+
+class ScratchFolder(object):
+    """
+    A run folder made in scratch_dir, named after name, removed when the driver exits. With an
+    archive_path, its files are archived there first, under the directory name.
+    """
+    def __init__(self, scratch_dir, name, archive_path=None):
+        if not os.path.isdir(scratch_dir):
+            os.makedirs(scratch_dir)
+        self.path = tempfile.mkdtemp(prefix=name + ".", dir=scratch_dir)
+        self.name = name
+        self.archive_path = archive_path
+        self.runners = []
+        atexit.register(self.close)
+        for signum in exit_signals:
+            signal.signal(signum, self.exit)
+
+    def exit(self, signum, frame):
+        # Ends the driver as an error, which runs the exit functions.
+        sys.exit(128 + signum)
+
+    def watch(self, runner):
+        """
+        Kills the jobs of runner still running when the folder is removed.
+        """
+        self.runners.append(runner)
+
+    def close(self):
+        """
+        Kills the jobs still running, archives the folder when asked and removes it.
+        """
+        if self.path is None:
+            return
+        for runner in self.runners:
+            for job in runner.running:
+                job.kill()
+        try:
+            if self.archive_path:
+                directory = os.path.dirname(self.archive_path)
+                if not os.path.isdir(directory):
+                    os.makedirs(directory)
+                archive(self.path, self.archive_path, self.name)
+        finally:
+            shutil.rmtree(self.path, ignore_errors=True)
+            self.path = None
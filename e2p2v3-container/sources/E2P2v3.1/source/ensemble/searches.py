@@ -0,0 +1,110 @@
+"""
+Name:         searches
+Description:  The searches module builds the command lines of the level-0 searches run by E2P2:
+              blastp against the RPSD database and PRIAM_search against its profiles, with the
+              programs shipped in the E2P2 tree.
+
+"""
+
+import os
+
+# Memory reached by each search, in MiB, for the memory budget: a base reached on any input and
+# a part growing with the residues searched, per million residues. The PRIAM JVM gets the heap of
+# its input, within priam_heap_limits, and reaches it plus priam_overhead with the blastall
+# processes it starts; blastp grows little beyond the RPSD database. tools/bench/memory.py fits
+# these to the peak RSS of the jobs recorded in the report.json of runs.
+priam_heap_base = 768
+priam_heap_per_mresidue = 200
+priam_heap_limits = (1024, 16384)
+priam_overhead = 512
+blast_memory_base = 768
+blast_memory_per_mresidue = 16
+
+# Heap of PRIAM runs made without a memory budget.
+default_priam_heap = 3072
+
+
+def priam_heap(residues):
+    """
+    Returns the JVM heap, in MiB, of a PRIAM search of the given residues.
+    """
+    heap = priam_heap_base + residues * priam_heap_per_mresidue // 1000000
+    return min(max(heap, priam_heap_limits[0]), priam_heap_limits[1])
+
+
+def priam_memory(residues, heap=None):
+    """
+    Returns the memory, in MiB, reached by a PRIAM search of the given residues, run with the
+    given heap or with the heap of its input.
+    """
+    return (heap or priam_heap(residues)) + priam_overhead
+
+
+def blast_memory(residues):
+    """
+    Returns the memory, in MiB, reached by a blastp search of the given residues.
+    """
+    return blast_memory_base + residues * blast_memory_per_mresidue // 1000000
+
+
+def max_shard_residues(memory):
+    """
+    Returns the most residues a shard may hold for both of its searches to fit in memory MiB, or
+    0 when even the smallest PRIAM search does not fit.
+    """
+    if priam_memory(0) > memory:
+        return 0
+    if priam_heap_limits[1] + priam_overhead <= memory:
+        residues = (priam_heap_limits[1] - priam_heap_base) * 1000000 // priam_heap_per_mresidue
+    else:
+        residues = (memory - priam_overhead - priam_heap_base) * 1000000 // priam_heap_per_mresidue
+    if blast_memory_per_mresidue:
+        residues = min(residues, (memory - blast_memory_base) * 1000000 // blast_memory_per_mresidue)
+    return max(0, residues)
+
+
+def blast_command(e2p2_path, query, threads):
+    """
+    Returns the blastp command searching the FASTA file query, writing tabular hits to stdout.
+    """
+    return [os.path.join(e2p2_path, 'source', 'blast', 'ncbi-blast-2.2.30+', 'bin', 'blastp'),
+            '-db', os.path.join(e2p2_path, 'source', 'blast', 'db', 'rpsd-3.1.fa'),
+            '-query', query, '-outfmt', '6', '-num_threads', str(threads)]
+
+
+# Columns and hits of the slim BLAST output: E2P2 reads the query, the subject carrying the EF
+# classes and the e-value (the next to last column) of the first hit of each query. blastp
+# applies the target limit while it searches, so a few targets are kept for the first one to be
+# that of a full search.
+slim_columns = "6 qseqid sseqid evalue bitscore"
+slim_max_targets = 5
+
+
+def slim_blast_command(cmd):
+    """
+    Returns a blastp command of blast_command writing only the columns and hits read by E2P2: the
+    best HSP of the first slim_max_targets targets of each query.
+    """
+    cmd = list(cmd)
+    cmd[cmd.index('-outfmt') + 1] = slim_columns
+    return cmd + ['-max_target_seqs', str(slim_max_targets), '-max_hsps', '1']
+
+
+def priam_output(output_dir, name):
+    """
+    Returns the path of the predictions written by the PRIAM search of the given name.
+    """
+    return os.path.join(output_dir, "PRIAM_%s" % (name), "ANNOTATION", "sequenceECs.txt")
+
+
+def priam_command(e2p2_path, name, query, output_dir, threads, heap=default_priam_heap):
+    """
+    Returns the PRIAM_search command searching the FASTA file query, writing its results to
+    PRIAM_<name> in output_dir, with a JVM heap of heap MiB.
+    """
+    ## Edit: 9/16/16 Add Memory Settings for Java
+    return [os.path.join(e2p2_path, 'source', 'java', 'jre1.6.0_30', 'bin', 'java'), '-Xms%dm' % (heap), '-Xmx%dm' % (heap),
+            '-jar', os.path.join(e2p2_path, 'source', 'priam', 'PRIAM_search.jar'),
+            '--bd', os.path.join(e2p2_path, 'source', 'blast', 'blast-2.2.26', 'bin'),
+            '-n', name, '-i', query, '-p', os.path.join(e2p2_path, 'source', 'priam', 'profiles'),
+            '--bh', '-o', output_dir, '--np', str(threads)]
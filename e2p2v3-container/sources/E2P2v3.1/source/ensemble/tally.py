@@ -0,0 +1,360 @@
+"""
+Name:         tally
+Description:  The tally module computes the ensemble predictions of all query sequences at once.
+              The votes of every classifier are collected in a single pass into a sparse
+              (sequence x EF class) table and the classifier weights into a dense (classifier x EF
+              class) matrix. Any number of voting schemes are then evaluated on that table for
+              every sequence with NumPy reductions. The results are identical to those of the
+              per-sequence functions of the ensemble module, which are used instead when NumPy is
+              not installed and for the binary average weight schemes.
+
+"""
+
+import gc
+
+import ensemble
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# Schemes evaluated on the vote table: (reduction, threshold type, whether a negative cutoff is
+# raised to 0) for each ensemble function.
+batch_schemes = {
+    "plurality": ("plurality", None, False),
+    "majority": ("majority", None, False),
+    "max_weight": ("max", None, False),
+    "max_weight_percent_threshold": ("max", "percent", False),
+    "max_weight_absolute_threshold": ("max", "absolute", True),
+    "avg_weight": ("avg", None, False),
+    "avg_weight_percent_threshold": ("avg", "percent", False),
+    "avg_weight_absolute_threshold": ("avg", "absolute", True),
+    "fixed_avg_weight_percent_threshold": ("fixed_avg", "percent", True),
+    "fixed_avg_weight_absolute_threshold": ("fixed_avg", "absolute", True),
+}
+
+# Names of the schemes written in the results files.
+scheme_names = {
+    "plurality": "Plurality",
+    "majority": "Majority",
+    "max_weight": "Maximum weight",
+    "max_weight_percent_threshold": "Maximum weight with percent threshold",
+    "max_weight_absolute_threshold": "Maximum weight with absolute threshold",
+    "avg_weight": "Average weight",
+    "avg_weight_percent_threshold": "Average weight with percent threshold",
+    "avg_weight_absolute_threshold": "Average weight with absolute threshold",
+    "fixed_avg_weight_percent_threshold": "Fixed average weight with percent threshold",
+    "fixed_avg_weight_absolute_threshold": "Fixed average weight with absolute threshold",
+    "binary_avg_weight_percent_threshold": "Binary average weight with percent threshold",
+    "binary_avg_weight_absolute_threshold": "Binary average weight with absolute threshold",
+}
+
+
+def parse_schemes(text):
+    """
+    Parses comma-separated ensemble schemes, each with an optional threshold, such as
+    "max_weight_absolute_threshold:0.5,plurality", into a list of (scheme, threshold text). The
+    counting schemes take no threshold; the weighted ones default to 0.5. Raises ValueError on an
+    unknown scheme or an invalid threshold.
+    """
+    schemes = []
+    for requested in text.split(","):
+        scheme, _, threshold_text = requested.strip().partition(":")
+        if scheme not in scheme_names:
+            raise ValueError("Unknown ensemble scheme: %s" % (scheme))
+        try:
+            float(threshold_text or "0.5")
+        except ValueError:
+            raise ValueError("Invalid threshold for ensemble scheme %s: %s" % (scheme, threshold_text))
+        if not threshold_text and scheme not in ("plurality", "majority"):
+            threshold_text = "0.5"
+        schemes.append((scheme, threshold_text))
+    return schemes
+
+
+def perform_schemes(schemes, sequence_ids, classifiers):
+    """
+    Evaluates a list of (scheme, threshold) on the same votes, each scheme being the name of an
+    ensemble function without its "perform_" prefix. Returns, for each of them, a dictionary
+    mapping each sequence ID to its FinalPredictions.
+    """
+    # The predictions are millions of small acyclic objects: collecting garbage while they are
+    # created only rescans them.
+    collecting = gc.isenabled()
+    gc.disable()
+    try:
+        votes = None
+        if numpy is not None and [scheme for scheme, threshold in schemes if scheme in batch_schemes]:
+            votes = Tally(sequence_ids, classifiers)
+        results = []
+        for scheme, threshold in schemes:
+            if votes is not None and scheme in batch_schemes:
+                results.append(votes.perform(scheme, threshold))
+            else:
+                function = getattr(ensemble, "perform_" + scheme)
+                results.append(dict((qid, function(qid, classifiers, threshold)) for qid in sequence_ids))
+        return results
+    finally:
+        if collecting:
+            gc.enable()
+
+
+def cutoffs(high, kind, threshold, clamp):
+    """
+    Returns the weight each other vote must reach to be kept beside the winning weights high,
+    computed as the ensemble functions do.
+    """
+    if kind == "percent":
+        t = high * float(1 - (float(threshold) / float(100)))
+    elif kind == "absolute":
+        t = high - threshold
+    else:
+        t = high - (float(threshold) / float(100))
+    if clamp:
+        t = numpy.where(t < 0.0, 0.0, t)
+    return t
+
+
+class Slots(dict):
+    """
+    Numbers EF classes in the order they are first seen.
+    """
+    def __init__(self):
+        dict.__init__(self)
+        self.efs = []
+
+    def __missing__(self, ef_class):
+        slot = self[ef_class] = len(self.efs)
+        self.efs.append(ef_class)
+        return slot
+
+
+class Tally(object):
+    """
+    Votes of the classifiers for a set of sequences. Votes are ordered as the ensemble functions
+    cast them: by sequence, then classifier, then position in the classifier's predictions.
+    """
+    def __init__(self, sequence_ids, classifiers):
+        self.ids = list(sequence_ids)
+        self.names = list(classifiers)
+        rows = dict((qid, row) for row, qid in enumerate(self.ids))
+        slots = Slots()
+        self.efs = slots.efs
+        # For each classifier, the EF slots it predicted for each row it has an entry for.
+        self.listed = []
+        entry_rows, entry_cls, entry_sizes, vote_cols = [], [], [], []
+        for k, cname in enumerate(self.names):
+            listed = {}
+            for qid, preds in classifiers[cname].predictions.items():
+                row = rows.get(qid)
+                if row is None:
+                    continue
+                cols = [slots[ef_class] for ef_class in preds]
+                listed[row] = cols
+                entry_rows.append(row)
+                entry_cls.append(k)
+                entry_sizes.append(len(cols))
+                vote_cols.extend(cols)
+            self.listed.append(listed)
+
+        # Dense weights, and the labels written for each classifier vote.
+        self.weights = numpy.zeros((len(self.names), len(self.efs)))
+        self.labels = []
+        for k, cname in enumerate(self.names):
+            c = classifiers[cname]
+            ef_weights = [c.weights.get(ef_class, 0.0) for ef_class in self.efs]
+            self.weights[k, :] = ef_weights
+            self.labels.append(["%s (%.3f)" % (ef_class, ef_weight) for ef_class, ef_weight in zip(self.efs, ef_weights)])
+        ef_order = sorted(range(len(self.efs)), key=self.efs.__getitem__)
+        self.ef_rank = numpy.zeros(len(self.efs), dtype=numpy.int64)
+        self.ef_rank[ef_order] = numpy.arange(len(self.efs))
+
+        # Votes were gathered per classifier entry: expand the classifier of each entry, and the
+        # position of each vote within its entry.
+        sizes = numpy.array(entry_sizes, dtype=numpy.int64)
+        vote_rows = numpy.repeat(numpy.array(entry_rows, dtype=numpy.int64), sizes)
+        vote_cls = numpy.repeat(numpy.array(entry_cls, dtype=numpy.int64), sizes)
+        vote_cols = numpy.array(vote_cols, dtype=numpy.int64)
+        entry_starts = numpy.repeat(numpy.cumsum(sizes) - sizes, sizes)
+        vote_pos = numpy.arange(len(vote_cols)) - entry_starts
+        order = numpy.lexsort((vote_pos, vote_cls, vote_rows))
+        self.row = vote_rows[order]
+        self.col = vote_cols[order]
+        self.weight = self.weights[vote_cls[order], self.col]
+
+        # Segments of consecutive votes of the same sequence.
+        n = len(self.row)
+        if n:
+            self.starts = numpy.flatnonzero(numpy.r_[True, self.row[1:] != self.row[:-1]])
+        else:
+            self.starts = numpy.zeros(0, dtype=numpy.int64)
+        self.ends = numpy.r_[self.starts[1:], n]
+        self.segment = numpy.repeat(numpy.arange(len(self.starts)), self.ends - self.starts)
+        self.grouped = None
+        self.totals = None
+
+    def groups(self):
+        """
+        Groups the votes by sequence and EF class. Returns the order sorting the votes into
+        groups (stable, so that votes keep their order within a group), the start of each group in
+        that order, and the group of each sorted vote. Computed once and shared by the schemes.
+        """
+        if self.grouped is None:
+            key = self.segment * max(1, len(self.efs)) + self.col
+            order = numpy.argsort(key, kind='mergesort')
+            sorted_key = key[order]
+            flags = numpy.r_[True, sorted_key[1:] != sorted_key[:-1]]
+            group_starts = numpy.flatnonzero(flags)
+            self.grouped = (order, group_starts, numpy.cumsum(flags) - 1)
+        return self.grouped
+
+    def group_totals(self):
+        """
+        Returns the sequence, EF slot, number of votes and summed weight of each group.
+        """
+        if self.totals is None:
+            order, group_starts, group = self.groups()
+            sorted_weight = self.weight[order]
+            # Sum the weights of each group in vote order, one vote of every group at a time, so
+            # that the sums round as the ensemble function's running totals do.
+            rank = numpy.arange(len(order)) - group_starts[group]
+            totals = sorted_weight[group_starts].copy()
+            for r in range(1, int(rank.max()) + 1):
+                at_rank = rank == r
+                totals[group[at_rank]] += sorted_weight[at_rank]
+            counts = numpy.diff(numpy.r_[group_starts, len(order)])
+            self.totals = (self.segment[order][group_starts], self.col[order][group_starts], counts, totals)
+        return self.totals
+
+    def perform(self, scheme, threshold):
+        reduction, kind, clamp = batch_schemes[scheme]
+        if not len(self.row):
+            predictions = {}
+        elif reduction == "max":
+            predictions = self.max_weight(kind, threshold, clamp)
+        elif reduction in ("plurality", "majority"):
+            predictions = self.count_votes(reduction == "majority")
+        else:
+            predictions = self.avg_weight(kind, threshold, clamp, reduction == "fixed_avg")
+        # The counting schemes list the classifiers' EF classes without their weights.
+        return self.final_predictions(predictions, reduction in ("plurality", "majority"))
+
+    def max_weight(self, kind, threshold, clamp):
+        """
+        Returns the predictions of the voted rows under the maximum weight scheme.
+        """
+        n = len(self.row)
+        # The winning vote is the first vote holding the highest weight of its sequence.
+        high = numpy.maximum.reduceat(self.weight, self.starts)
+        positions = numpy.where(self.weight == high[self.segment], numpy.arange(n), n)
+        first = numpy.minimum.reduceat(positions, self.starts)
+        high_col = self.col[first]
+        t = cutoffs(high, kind, threshold, clamp)
+
+        # Condense the votes so that each EF class appears once per sequence, with its highest weight.
+        order, group_starts, _ = self.groups()
+        condensed = numpy.maximum.reduceat(self.weight[order], group_starts)
+        group_segment = self.segment[order][group_starts]
+        group_col = self.col[order][group_starts]
+        passing = (condensed >= t[group_segment]) & (group_col != high_col[group_segment])
+        counts = numpy.bincount(group_segment[passing], minlength=len(self.starts))
+
+        efs = self.efs
+        segment_rows = self.row[self.starts].tolist()
+        predictions = dict((row, ["%s (%s)" % (efs[col], str(weight))])
+                           for row, col, weight in zip(segment_rows, high_col.tolist(), high.tolist()))
+        single = passing & (counts[group_segment] == 1)
+        for s, col, weight in zip(group_segment[single].tolist(), group_col[single].tolist(), condensed[single].tolist()):
+            predictions[segment_rows[s]].append("%s (%s)" % (efs[col], weight))
+        # Several votes pass: they are listed in the iteration order of the ensemble function's
+        # dictionary, which is rebuilt from the votes in the same order.
+        for s in numpy.flatnonzero(counts > 1).tolist():
+            condensed_votes = {}
+            cols = self.col[self.starts[s]:self.ends[s]].tolist()
+            weights = self.weight[self.starts[s]:self.ends[s]].tolist()
+            for col, weight in zip(cols, weights):
+                ef_class = efs[col]
+                if ef_class not in condensed_votes or weight > condensed_votes[ef_class]:
+                    condensed_votes[ef_class] = weight
+            high_class = efs[high_col[s]]
+            entries = predictions[segment_rows[s]]
+            for ef_class in condensed_votes:
+                if ef_class != high_class and condensed_votes[ef_class] >= t[s]:
+                    entries.append("%s (%s)" % (ef_class, condensed_votes[ef_class]))
+        return predictions
+
+    def count_votes(self, majority):
+        """
+        Returns the predictions of the voted rows under the plurality or majority scheme: the EF
+        class with the most votes, unless another one ties with it or, for the majority scheme,
+        it does not hold more than half of the votes.
+        """
+        group_segment, group_col, counts, _ = self.group_totals()
+        ranked = numpy.lexsort((-self.ef_rank[group_col], -counts, group_segment))
+        ranked_segment = group_segment[ranked]
+        heads = numpy.flatnonzero(numpy.r_[True, ranked_segment[1:] != ranked_segment[:-1]])
+        high = counts[ranked][heads]
+        # The runner-up of each sequence, if it has one.
+        second = numpy.zeros(len(heads), dtype=counts.dtype)
+        has_second = numpy.r_[heads[1:], len(ranked)] - heads > 1
+        second[has_second] = counts[ranked][heads[has_second] + 1]
+        wins = ~has_second | (high != second)
+        if majority:
+            total_votes = self.ends - self.starts
+            wins &= ~has_second | (high > total_votes // 2)
+
+        efs = self.efs
+        segment_rows = self.row[self.starts].tolist()
+        cols = group_col[ranked][heads].tolist()
+        return dict((row, [efs[col] if win else "NA"])
+                    for row, col, win in zip(segment_rows, cols, wins.tolist()))
+
+    def avg_weight(self, kind, threshold, clamp, fixed):
+        """
+        Returns the predictions of the voted rows under the average weight scheme. Weights are
+        averaged over all the votes of the sequence, or over the votes for the EF class with the
+        fixed average weight scheme.
+        """
+        group_segment, group_col, counts, totals = self.group_totals()
+        if fixed:
+            averages = totals / counts
+        else:
+            averages = totals / (self.ends - self.starts)[group_segment]
+
+        # Rank the EF classes of each sequence by average weight, then EF class, both descending.
+        ranked = numpy.lexsort((-self.ef_rank[group_col], -averages, group_segment))
+        ranked_segment = group_segment[ranked]
+        heads = numpy.r_[True, ranked_segment[1:] != ranked_segment[:-1]]
+        high = averages[ranked][heads]
+        t = cutoffs(high, kind, threshold, clamp)
+        keep = heads | (averages[ranked] >= t[ranked_segment])
+
+        predictions = {}
+        segment_rows = self.row[self.starts].tolist()
+        values = averages[ranked][keep].tolist()
+        for s, col, average in zip(ranked_segment[keep].tolist(), group_col[ranked][keep].tolist(), values):
+            row = segment_rows[s]
+            if row not in predictions:
+                predictions[row] = []
+            predictions[row].append("%s (%s)" % (self.efs[col], str(average)))
+        return predictions
+
+    def final_predictions(self, predictions, unweighted=False):
+        """
+        Builds the FinalPredictions of every sequence from the predictions of the voted rows.
+        """
+        # Classifier outputs of each row, inserted in classifier order.
+        outputs = [{} for qid in self.ids]
+        for k, cname in enumerate(self.names):
+            labels = self.efs if unweighted else self.labels[k]
+            for row, cols in self.listed[k].items():
+                outputs[row][cname] = [labels[col] for col in cols]
+        final_predictions = {}
+        FinalPredictions = ensemble.FinalPredictions
+        for row, qid in enumerate(self.ids):
+            fpred = FinalPredictions(qid)
+            fpred.predictions = predictions.get(row, ["NA"])
+            fpred.classifiers = outputs[row]
+            final_predictions[qid] = fpred
+        return final_predictions
@@ -0,0 +1,147 @@
+"""
+Name:         telemetry
+Description:  The telemetry module times the stages of an E2P2 run and writes them to a JSON run
+              report: for each stage its wall time, the CPU time and peak resident memory of the
+              driver, the resource usage of the child processes that ended during the stage and
+              the number of records it handled, and for each BLAST or PRIAM job its own wall
+              time and resource usage. Python stages can also be profiled with cProfile or, under
+              Python 3, tracemalloc.
+
+"""
+
+import json
+import os
+import resource
+import sys
+import time
+
+profilers = ["cprofile", "tracemalloc"]
+
+# Allocation sites kept per stage when profiling with tracemalloc.
+tracemalloc_top = 20
+
+
+def seconds(value):
+    return round(value, 3)
+
+
+def megabytes(kilobytes):
+    # ru_maxrss is in kilobytes on Linux.
+    return round(kilobytes / 1024.0, 1)
+
+
+def usage_summary(usage):
+    """
+    Returns the CPU times and peak resident memory of a resource usage.
+    """
+    return {"user_s": seconds(usage.ru_utime), "system_s": seconds(usage.ru_stime), "max_rss_mb": megabytes(usage.ru_maxrss)}
+
+
+def check_profiler(profiler):
+    """
+    Returns None when the profiler can be used, or the reason it cannot.
+    """
+    if profiler not in profilers:
+        return "unknown profiler %s, use one of %s" % (profiler, ", ".join(profilers))
+    if profiler == "tracemalloc":
+        try:
+            import tracemalloc
+        except ImportError:
+            return "tracemalloc requires Python 3.4 or later"
+    return None
+
+
+class Report(object):
+    """
+    Collects the stages and jobs of a run. A stage starts with start() and ends with end(), which
+    takes its record counts as keyword arguments. When profiler is given, each stage is profiled
+    and its profile written to profile_dir.
+    """
+    def __init__(self, profiler=None, profile_dir=None):
+        self.started = time.time()
+        self.stages = []
+        self.jobs = []
+        self.info = {}
+        self.profiler = profiler
+        self.profile_dir = profile_dir
+        self.current = None
+
+    def start(self, name):
+        if self.current is not None:
+            self.end()
+        self.current = {"name": name, "start": time.time(),
+                        "self": resource.getrusage(resource.RUSAGE_SELF),
+                        "children": resource.getrusage(resource.RUSAGE_CHILDREN)}
+        if self.profiler == "cprofile":
+            import cProfile
+            self.current["profile"] = cProfile.Profile()
+            self.current["profile"].enable()
+        elif self.profiler == "tracemalloc":
+            import tracemalloc
+            tracemalloc.start()
+
+    def end(self, **records):
+        stage = self.current
+        self.current = None
+        now = time.time()
+        usage = resource.getrusage(resource.RUSAGE_SELF)
+        children = resource.getrusage(resource.RUSAGE_CHILDREN)
+        summary = {"name": stage["name"],
+                   "wall_s": seconds(now - stage["start"]),
+                   "cpu_s": seconds(usage.ru_utime + usage.ru_stime - stage["self"].ru_utime - stage["self"].ru_stime),
+                   # High-water mark of the driver at the end of the stage.
+                   "peak_rss_mb": megabytes(usage.ru_maxrss),
+                   "rss_growth_mb": megabytes(usage.ru_maxrss - stage["self"].ru_maxrss),
+                   "children": {"user_s": seconds(children.ru_utime - stage["children"].ru_utime),
+                                "system_s": seconds(children.ru_stime - stage["children"].ru_stime),
+                                # Largest child ended so far.
+                                "max_rss_mb": megabytes(children.ru_maxrss)},
+                   "records": records}
+        if self.profiler == "cprofile":
+            stage["profile"].disable()
+            summary["profile"] = self.profile_path(stage["name"], "prof")
+            stage["profile"].dump_stats(summary["profile"])
+        elif self.profiler == "tracemalloc":
+            import tracemalloc
+            current, peak = tracemalloc.get_traced_memory()
+            snapshot = tracemalloc.take_snapshot()
+            tracemalloc.stop()
+            summary["traced_peak_mb"] = megabytes(peak / 1024.0)
+            summary["allocations"] = [{"site": str(stat.traceback), "size_mb": megabytes(stat.size / 1024.0), "count": stat.count}
+                                      for stat in snapshot.statistics("lineno")[:tracemalloc_top]]
+        self.stages.append(summary)
+
+    def profile_path(self, name, extension):
+        if not os.path.isdir(self.profile_dir):
+            os.makedirs(self.profile_dir)
+        filename = "profile.%02d.%s.%s" % (len(self.stages), name.replace(" ", "_").replace("/", "_"), extension)
+        return os.path.join(self.profile_dir, filename)
+
+    def add_job(self, job, **details):
+        """
+        Records a finished jobs.Job, with the given details.
+        """
+        entry = {"name": job.name, "attempts": job.attempts, "cpus": job.cpus, "returncode": job.returncode}
+        entry.update(details)
+        if job.started is not None and job.ended is not None:
+            entry["wall_s"] = seconds(job.ended - job.started)
+        if job.rusage is not None:
+            entry.update(usage_summary(job.rusage))
+        self.jobs.append(entry)
+
+    def write(self, path):
+        """
+        Writes the report as JSON, with the totals of the run.
+        """
+        if self.current is not None:
+            self.end()
+        report = dict(self.info)
+        report["python"] = sys.version.split()[0]
+        report["wall_s"] = seconds(time.time() - self.started)
+        report["self"] = usage_summary(resource.getrusage(resource.RUSAGE_SELF))
+        report["children"] = usage_summary(resource.getrusage(resource.RUSAGE_CHILDREN))
+        report["stages"] = self.stages
+        report["jobs"] = self.jobs
+        with open(path, 'w') as fp:
+            json.dump(report, fp, indent=1, separators=(',', ': '), sort_keys=True)
+            fp.write("\n")
@@ -0,0 +1,269 @@
+"""
+Name:         weights
+Description:  The weights module loads the classifier weights (data/weights) and the mapping of
+              EF classes to EC numbers and reaction IDs (data/fcmap) used by E2P2. Both files can be
+              compiled into a binary index (data/weights.idx) that is memory-mapped at startup, so
+              that the text files are not parsed again and E2P2 processes running on the same node
+              share its pages.
+
+              Index layout (little-endian):
+                header     magic, EF count, classifier count, EF ID width, classifier name width,
+                           size and modification time of both source files, SHA-1 of the payload
+                payload    sorted EF IDs (fixed width), classifier names (fixed width),
+                           one float64 weight per classifier and EF (NaN when absent),
+                           one (offset, length) pair per EF into the fcmap text block,
+                           the fcmap text block
+
+Usage:        python weights.py [data directory]
+              Compiles the index of the given data directory (default: data/ next to this module).
+
+"""
+
+import hashlib
+import mmap
+import os
+import struct
+import sys
+
+magic = b"E2P2WID1"
+header_format = "<8sIIIIqqqq20s"
+header_size = struct.calcsize(header_format)
+name_width = 16
+no_mapping = 0xFFFFFFFF
+
+weights_file = "weights"
+fcmap_file = "fcmap"
+index_file = "weights.idx"
+
+
+def to_str(value):
+    # Index strings are bytes, which are already str objects on Python 2.
+    if isinstance(value, str):
+        return value
+    return value.decode('ascii')
+
+
+def read_weights(fp):
+    """
+    Parses a weights file. Returns a dictionary mapping each classifier name to a dictionary of
+    EF class weights.
+    """
+    classifiers = {}
+    c = None
+    for line in fp:
+        if line.startswith(">"):
+            # Header lines look like ">BLAST|NA".
+            c = classifiers.setdefault(line[1:].split("|")[0].strip(), {})
+            continue
+        if c is None:
+            continue
+        entries = line.rstrip("\n").split("\t")
+        if len(entries) < 2:
+            continue
+        cid, wval = entries[0], entries[1]
+        if wval == "NA" or wval == "0" or wval == "-1.000":
+            wval = "0.000"
+        try:
+            c[cid] = float(wval)
+        except ValueError:
+            continue
+    return classifiers
+
+
+def read_fcmap(fp):
+    """
+    Parses an fcmap file. Returns a dictionary mapping EF classes to EC numbers or reaction IDs.
+    """
+    fc_map = {}
+    for line in fp:
+        if "#" not in line:
+            entries = line.rstrip().split("\t")
+            if len(entries) > 1:
+                fc_map[line.split("\t")[0]] = entries[1]
+    return fc_map
+
+
+def source_signature(data_dir):
+    signature = []
+    for name in (weights_file, fcmap_file):
+        st = os.stat(os.path.join(data_dir, name))
+        signature.extend([st.st_size, int(st.st_mtime)])
+    return signature
+
+
+def compile_index(data_dir, index_path=None):
+    """
+    Compiles the weights and fcmap files of data_dir into a binary index, written atomically.
+    """
+    if index_path is None:
+        index_path = os.path.join(data_dir, index_file)
+    signature = source_signature(data_dir)
+    with open(os.path.join(data_dir, weights_file), 'r') as fp:
+        classifier_weights = read_weights(fp)
+    with open(os.path.join(data_dir, fcmap_file), 'r') as fp:
+        fc_map = read_fcmap(fp)
+
+    ids = set(fc_map)
+    for c in classifier_weights.values():
+        ids.update(c)
+    ids = sorted(ids)
+    names = sorted(classifier_weights)
+    id_width = max([len(id) for id in ids] + [1])
+
+    blocks = [b"".join(struct.pack("%ds" % id_width, id.encode('ascii')) for id in ids),
+              b"".join(struct.pack("%ds" % name_width, name.encode('ascii')) for name in names)]
+    for name in names:
+        c = classifier_weights[name]
+        blocks.append(struct.pack("<%dd" % len(ids), *[c.get(id, float('nan')) for id in ids]))
+    text, spans = [], []
+    offset = 0
+    for id in ids:
+        if id in fc_map:
+            target = fc_map[id].encode('ascii')
+            spans.append(struct.pack("<II", offset, len(target)))
+            text.append(target)
+            offset += len(target)
+        else:
+            spans.append(struct.pack("<II", no_mapping, 0))
+    blocks.append(b"".join(spans))
+    blocks.append(b"".join(text))
+    payload = b"".join(blocks)
+
+    header = struct.pack(header_format, magic, len(ids), len(names), id_width, name_width,
+                         signature[0], signature[1], signature[2], signature[3],
+                         hashlib.sha1(payload).digest())
+    temp_path = "%s.%d.tmp" % (index_path, os.getpid())
+    with open(temp_path, 'wb') as fp:
+        fp.write(header)
+        fp.write(payload)
+    os.rename(temp_path, index_path)
+
+
+class WeightTable(object):
+    """
+    Read-only mapping of EF classes to the weights of one classifier, read from the index.
+    """
+    def __init__(self, index, column):
+        self.index = index
+        self.base = index.weights_offset + column * 8 * len(index.ids)
+
+    def get(self, ef_class, default=None):
+        slot = self.index.slots.get(ef_class)
+        if slot is None:
+            return default
+        weight = struct.unpack_from("<d", self.index.data, self.base + slot * 8)[0]
+        if weight != weight:
+            return default
+        return weight
+
+    def __getitem__(self, ef_class):
+        weight = self.get(ef_class)
+        if weight is None:
+            raise KeyError(ef_class)
+        return weight
+
+    def __contains__(self, ef_class):
+        return self.get(ef_class) is not None
+
+
+class FcMap(object):
+    """
+    Read-only mapping of EF classes to EC numbers or reaction IDs, read from the index.
+    """
+    def __init__(self, index):
+        self.index = index
+
+    def get(self, ef_class, default=None):
+        slot = self.index.slots.get(ef_class)
+        if slot is None:
+            return default
+        offset, length = struct.unpack_from("<II", self.index.data, self.index.spans_offset + slot * 8)
+        if offset == no_mapping:
+            return default
+        start = self.index.text_offset + offset
+        return to_str(self.index.data[start:start + length])
+
+    def __getitem__(self, ef_class):
+        target = self.get(ef_class)
+        if target is None:
+            raise KeyError(ef_class)
+        return target
+
+    def __contains__(self, ef_class):
+        return self.get(ef_class) is not None
+
+
+class Index(object):
+    """
+    Memory-mapped weights index. Raises ValueError when the index is corrupt or does not match
+    the current source files.
+    """
+    def __init__(self, index_path, signature=None):
+        with open(index_path, 'rb') as fp:
+            self.data = mmap.mmap(fp.fileno(), 0, access=mmap.ACCESS_READ)
+        if len(self.data) < header_size:
+            raise ValueError("truncated weights index: %s" % index_path)
+        fields = struct.unpack_from(header_format, self.data, 0)
+        if fields[0] != magic:
+            raise ValueError("not a weights index: %s" % index_path)
+        n_ids, n_names, id_width, name_width = fields[1:5]
+        if signature is not None and list(fields[5:9]) != list(signature):
+            raise ValueError("weights index is out of date: %s" % index_path)
+        if hashlib.sha1(self.data[header_size:]).digest() != fields[9]:
+            raise ValueError("weights index checksum mismatch: %s" % index_path)
+
+        offset = header_size
+        ids = self.data[offset:offset + n_ids * id_width]
+        offset += n_ids * id_width
+        self.ids = [to_str(ids[i:i + id_width].rstrip(b"\0")) for i in range(0, len(ids), id_width)]
+        self.slots = dict((id, slot) for slot, id in enumerate(self.ids))
+        names = self.data[offset:offset + n_names * name_width]
+        offset += n_names * name_width
+        self.names = [to_str(names[i:i + name_width].rstrip(b"\0")) for i in range(0, len(names), name_width)]
+        self.weights_offset = offset
+        offset += n_names * n_ids * 8
+        self.spans_offset = offset
+        self.text_offset = offset + n_ids * 8
+
+    def weights(self):
+        """
+        Returns a dictionary mapping each classifier name to its WeightTable.
+        """
+        return dict((name, WeightTable(self, column)) for column, name in enumerate(self.names))
+
+    def fcmap(self):
+        return FcMap(self)
+
+
+def load(data_dir):
+    """
+    Returns the classifier weights (a mapping of EF class weights per classifier name) and the
+    fcmap of data_dir. The index is used when it is up to date; otherwise the text files are
+    parsed and the index is rebuilt if the data directory is writable.
+    """
+    signature = source_signature(data_dir)
+    index_path = os.path.join(data_dir, index_file)
+    try:
+        index = Index(index_path, signature)
+        return index.weights(), index.fcmap()
+    except (IOError, OSError, ValueError):
+        pass
+    try:
+        compile_index(data_dir, index_path)
+        index = Index(index_path, signature)
+        return index.weights(), index.fcmap()
+    except (IOError, OSError, ValueError):
+        with open(os.path.join(data_dir, weights_file), 'r') as fp:
+            classifier_weights = read_weights(fp)
+        with open(os.path.join(data_dir, fcmap_file), 'r') as fp:
+            fc_map = read_fcmap(fp)
+        return classifier_weights, fc_map
+
+
+if __name__ == '__main__':
+    if len(sys.argv) > 1:
+        data_dir = sys.argv[1]
+    else:
+        data_dir = os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+    compile_index(data_dir)
+    print("Compiled weights index: %s" % os.path.join(data_dir, index_file))
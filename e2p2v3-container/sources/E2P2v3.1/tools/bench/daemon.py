@@ -0,0 +1,181 @@
+#!/usr/bin/python
+
+"""
+Name:        daemon.py
+Description: Checks and times the E2P2 service (source/ensemble/e2p2d.py) against the driver, with
+             the blastp and PRIAM_search stand-ins of tools/bench/stubs. A synthetic proteome is
+             split into small jobs that are submitted to the service at once, over its Unix socket.
+             The predictions of every job must be those of the driver run on the whole proteome.
+             The wall time of the service is reported beside that of the driver run on a few of
+             the jobs, one file at a time.
+
+Usage:       python daemon.py [--sequences 2000] [--max-job 300] [--driver-jobs 5] [--work <directory>]
+                              [--daemon-args "<options>"]
+
+"""
+
+import httplib
+import json
+import os
+import random
+import shutil
+import signal
+import socket
+import subprocess
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+
+import pipeline
+import proteome
+import fasta
+
+
+class UnixHTTPConnection(httplib.HTTPConnection):
+    # HTTP over the Unix socket of the service.
+    def __init__(self, path, timeout=None):
+        httplib.HTTPConnection.__init__(self, "e2p2", timeout=timeout)
+        self.path = path
+
+    def connect(self):
+        self.sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        self.sock.connect(self.path)
+
+
+def request(socket_path, method, path, body=None):
+    connection = UnixHTTPConnection(socket_path, timeout=3600)
+    connection.request(method, path, body)
+    response = connection.getresponse()
+    data = response.read()
+    connection.close()
+    return response.status, data
+
+
+def read_out(lines):
+    # Returns the predictions of a .out file by sequence ID, without its run information.
+    return dict(line.split("\t", 1) for line in lines if not line.startswith("#"))
+
+
+def split_jobs(path, max_job, seed=0):
+    """
+    Splits a FASTA file into jobs of 1 to max_job sequences. Returns the FASTA text of each job.
+    """
+    r = random.Random(seed)
+    records = list(fasta.read_records(open(path)))
+    jobs = []
+    while records:
+        size = r.randint(1, max_job)
+        jobs.append("".join(">%s\n%s\n" % (id, sequence) for id, sequence in records[:size]))
+        records = records[size:]
+    return jobs
+
+
+def run_driver(driver, input_path, output, run_dir):
+    start = time.time()
+    status = subprocess.call([sys.executable, driver, "-i", input_path, "-o", output, "-r", run_dir],
+                             stdout=open(os.devnull, 'w'), stderr=subprocess.STDOUT, cwd=os.path.dirname(driver))
+    if status != 0:
+        raise RuntimeError("the driver failed with status %d on %s" % (status, input_path))
+    return time.time() - start
+
+
+def submit(socket_path, text, outcome):
+    # Submits a job and waits for its predictions.
+    start = time.time()
+    status, data = request(socket_path, "POST", "/jobs", text)
+    if status != 202:
+        outcome["error"] = "submission refused (%d): %s" % (status, data)
+        return
+    job = json.loads(data)["job"]
+    state = "queued"
+    while state in ("queued", "running"):
+        status, data = request(socket_path, "GET", "/jobs/%s?wait=60" % (job))
+        state = json.loads(data)["state"]
+    if state != "done":
+        outcome["error"] = "job %s %s: %s" % (job, state, json.loads(data)["error"])
+        return
+    status, data = request(socket_path, "GET", "/jobs/%s/out" % (job))
+    outcome["out"] = read_out(data.splitlines(True))
+    outcome["wall_s"] = time.time() - start
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Checks and times the E2P2 service against the driver, with stand-in searches.')
+    parser.add_argument('--sequences', type=int, default=2000, help='size of the proteome split into jobs [2000]')
+    parser.add_argument('--max-job', type=int, default=300, help='largest job, in sequences [300]')
+    parser.add_argument('--driver-jobs', type=int, default=5, help='jobs also run with the driver, for timing [5]')
+    parser.add_argument('--work', default='/tmp/e2p2-bench', help='directory of the benchmark tree, proteomes and runs')
+    parser.add_argument('--daemon-args', default='', help='options added to the service command line')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.work):
+        os.makedirs(args.work)
+    driver = pipeline.build_tree(args.work)
+    tree = os.path.dirname(driver)
+    input_path = os.path.join(args.work, "proteome_%d.fa" % args.sequences)
+    if not os.path.exists(input_path):
+        proteome.write_proteome(input_path, args.sequences)
+    job_texts = split_jobs(input_path, args.max_job)
+    run_dir = os.path.join(args.work, "run")
+    if os.path.exists(run_dir):
+        shutil.rmtree(run_dir)
+    os.makedirs(run_dir)
+
+    # Reference predictions, and the time of the driver on single jobs.
+    run_driver(driver, input_path, os.path.join(args.work, "reference.out"), run_dir)
+    reference = read_out(open(os.path.join(args.work, "reference.out")))
+    driver_times = []
+    for i, text in enumerate(job_texts[:args.driver_jobs]):
+        job_path = os.path.join(args.work, "job_%d.fa" % i)
+        open(job_path, 'w').write(text)
+        driver_times.append(run_driver(driver, job_path, os.path.join(args.work, "job_%d.out" % i), run_dir))
+
+    socket_path = os.path.join(args.work, "e2p2d.sock")
+    daemon_work = os.path.join(args.work, "daemon")
+    if os.path.exists(daemon_work):
+        shutil.rmtree(daemon_work)
+    start = time.time()
+    daemon = subprocess.Popen([sys.executable, os.path.join(tree, "source", "ensemble", "e2p2d.py"), "--socket", socket_path,
+                               "--work", daemon_work] + args.daemon_args.split(), stdout=subprocess.PIPE, cwd=tree)
+    # The service listens once its tables are loaded.
+    line = daemon.stdout.readline()
+    if not line.startswith("E2P2 service listening"):
+        daemon.wait()
+        raise RuntimeError("the service did not start: %s" % (line))
+    startup = time.time() - start
+    try:
+        start = time.time()
+        outcomes = [{} for text in job_texts]
+        threads = [threading.Thread(target=submit, args=(socket_path, text, outcome)) for text, outcome in zip(job_texts, outcomes)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        wall = time.time() - start
+        status, data = request(socket_path, "GET", "/status")
+        batches = json.loads(data)["batches"]
+    finally:
+        daemon.send_signal(signal.SIGTERM)
+        daemon.wait()
+
+    mismatches = []
+    for i, outcome in enumerate(outcomes):
+        if "error" in outcome:
+            mismatches.append("job %d: %s" % (i, outcome["error"]))
+            continue
+        for id in outcome["out"]:
+            if reference.get(id) != outcome["out"][id]:
+                mismatches.append("job %d, %s: %r (driver %r)" % (i, id, outcome["out"][id], reference.get(id)))
+    latencies = sorted(outcome["wall_s"] for outcome in outcomes if "wall_s" in outcome)
+    print "%d jobs of 1 to %d sequences (%d sequences), %d batches" % (len(job_texts), args.max_job, args.sequences, batches)
+    print "    service start:     %8.2f s" % (startup)
+    print "    service, all jobs: %8.2f s (median job %.2f s)" % (wall, latencies[len(latencies) / 2] if latencies else 0.0)
+    if driver_times:
+        print "    driver, per job:   %8.2f s (%d jobs), %.2f s estimated for all jobs" % (
+            sum(driver_times) / len(driver_times), len(driver_times), sum(driver_times) / len(driver_times) * len(job_texts))
+    for mismatch in mismatches[:20]:
+        print "Mismatch: %s" % (mismatch)
+    if mismatches:
+        sys.exit(1)
+    print "Predictions identical to the driver's."
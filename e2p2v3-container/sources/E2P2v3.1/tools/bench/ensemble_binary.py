@@ -0,0 +1,81 @@
+#!/usr/bin/python
+
+"""
+Name:        ensemble_binary.py
+Description: Microbenchmark of the binary average weight ensemble schemes on sequences with many
+             candidate EF classes. Times the ensemble module of this tree and, when given, another
+             copy of ensemble.py (for instance an earlier revision) on the same votes, and checks
+             that both predict the same EF classes.
+
+Usage:       python ensemble_binary.py [EF classes per sequence] [sequences] [other ensemble.py]
+
+"""
+
+import imp
+import os
+import random
+import sys
+import time
+
+e2p2_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(e2p2_path, 'source', 'ensemble'))
+import ensemble
+
+schemes = ["perform_binary_avg_weight_absolute_threshold", "perform_binary_avg_weight_percent_threshold"]
+
+
+class Classifier:
+    def __init__(self, id):
+        self.id = id
+        self.predictions = {}
+        self.weights = {}
+
+
+def make_classifiers(ef_count, sequence_count):
+    # Three classifiers, each predicting about half of the candidate EF classes of every sequence.
+    r = random.Random(0)
+    efs = ["EF%05d" % i for i in range(ef_count * 4)]
+    classifiers = {}
+    for cname in ["BLAST", "Priam", "CatFam"]:
+        c = Classifier(cname)
+        for ef_class in efs:
+            c.weights[ef_class] = round(r.random(), 3)
+        for i in range(sequence_count):
+            candidates = efs[(i % 4) * ef_count:(i % 4 + 1) * ef_count]
+            c.predictions["seq%d" % i] = [ef_class for ef_class in candidates if r.random() < 0.5]
+        classifiers[cname] = c
+    return classifiers
+
+
+def run(module, scheme, classifiers, sequence_count):
+    function = getattr(module, scheme)
+    start = time.time()
+    results = [function("seq%d" % i, classifiers, 0.5) for i in range(sequence_count)]
+    return time.time() - start, [predicted(fpred) for fpred in results]
+
+
+def predicted(fpred):
+    # The EF classes predicted, without their weights: earlier revisions, which loaded the weights as
+    # strings, label them with str(), e.g. "0.54" where this tree prints "0.540".
+    return sorted(entry.partition(" (")[0] for entry in fpred.predictions)
+
+
+ef_count = 200
+sequence_count = 200
+other = None
+if len(sys.argv) > 1:
+    ef_count = int(sys.argv[1])
+if len(sys.argv) > 2:
+    sequence_count = int(sys.argv[2])
+if len(sys.argv) > 3:
+    other = imp.load_source('ensemble_other', sys.argv[3])
+
+classifiers = make_classifiers(ef_count, sequence_count)
+print "%d sequences, %d candidate EF classes each" % (sequence_count, ef_count)
+for scheme in schemes:
+    seconds, results = run(ensemble, scheme, classifiers, sequence_count)
+    print "%s: %.3f s (%.1f ms per sequence)" % (scheme, seconds, 1000.0 * seconds / sequence_count)
+    if other is not None:
+        other_seconds, other_results = run(other, scheme, classifiers, sequence_count)
+        print "    %s: %.3f s, %.1fx, %s" % (sys.argv[3], other_seconds, other_seconds / max(seconds, 1e-9),
+                                          "same predictions" if other_results == results else "DIFFERENT PREDICTIONS")
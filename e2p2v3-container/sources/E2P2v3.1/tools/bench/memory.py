@@ -0,0 +1,97 @@
+#!/usr/bin/python
+
+"""
+Name:        memory.py
+Description: Calibrates the memory model of the searches (source/ensemble/searches.py) from the
+             peak RSS of the blastp and PRIAM jobs recorded in the report.json of runs. The peak
+             RSS of each search is fitted as a base plus a part per million residues of its shard,
+             and the settings of searches.py covering the measurements with the given margin are
+             printed. Runs of the real searches on inputs of different sizes, e.g. with --shards,
+             give the model of a node; the stand-ins of tools/bench/stubs only check the tool.
+
+Usage:       python memory.py [--margin 1.25] <run directory or report.json> [...]
+
+"""
+
+import json
+import os
+import sys
+from argparse import ArgumentParser
+
+bench_path = os.path.dirname(os.path.abspath(__file__))
+e2p2_path = os.path.dirname(os.path.dirname(bench_path))
+sys.path.insert(0, os.path.join(e2p2_path, 'source', 'ensemble'))
+import searches
+
+
+def find_reports(paths):
+    reports = []
+    for path in paths:
+        if os.path.isdir(path):
+            for folder, names, files in os.walk(path):
+                if "report.json" in files:
+                    reports.append(os.path.join(folder, "report.json"))
+        else:
+            reports.append(path)
+    return sorted(reports)
+
+
+def read_jobs(reports):
+    """
+    Returns the (residues, peak RSS in MiB) of the completed jobs of each search in the reports.
+    """
+    measured = dict((search, []) for search in ("PRIAM", "BLAST"))
+    for path in reports:
+        with open(path) as fp:
+            report = json.load(fp)
+        for job in report.get("jobs", []):
+            search = job["name"].partition("_")[0]
+            if search in measured and job.get("returncode") == 0 and "residues" in job and "max_rss_mb" in job:
+                measured[search].append((job["residues"], job["max_rss_mb"]))
+    return measured
+
+
+def fit(points):
+    """
+    Returns the base and the MiB per million residues of the least-squares line through points,
+    raised so that the line covers every point.
+    """
+    xs = [residues / 1e6 for residues, rss in points]
+    ys = [rss for residues, rss in points]
+    mean_x, mean_y = sum(xs) / len(xs), sum(ys) / len(ys)
+    spread = sum((x - mean_x) ** 2 for x in xs)
+    slope = max(0.0, sum((x - mean_x) * (y - mean_y) for x, y in zip(xs, ys)) / spread) if spread else 0.0
+    base = max(y - slope * x for x, y in zip(xs, ys))
+    return base, slope
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='Fits the memory model of the searches to the peak RSS of the jobs of runs.')
+    parser.add_argument('--margin', type=float, default=1.25, help='factor applied to the fitted memory [1.25]')
+    parser.add_argument('runs', nargs='+', help='run directories or report.json files')
+    args = parser.parse_args()
+
+    reports = find_reports(args.runs)
+    measured = read_jobs(reports)
+    print "%d reports" % (len(reports))
+    settings = []
+    for search in ("PRIAM", "BLAST"):
+        points = measured[search]
+        if not points:
+            print "    %-6s no completed jobs with residues and peak RSS" % (search)
+            continue
+        base, slope = fit(points)
+        print "    %-6s %4d jobs, %d to %d residues: %.0f MiB + %.1f MiB per million residues (largest %.0f MiB)" % (
+            search, len(points), min(x for x, y in points), max(x for x, y in points), base, slope, max(y for x, y in points))
+        base, slope = base * args.margin, slope * args.margin
+        if search == "PRIAM":
+            # The JVM and blastall processes take priam_overhead beside the heap.
+            settings.append("priam_heap_base = %d" % (max(0, int(base) - searches.priam_overhead)))
+            settings.append("priam_heap_per_mresidue = %d" % (int(slope + 0.5)))
+        else:
+            settings.append("blast_memory_base = %d" % (int(base)))
+            settings.append("blast_memory_per_mresidue = %d" % (int(slope + 0.5)))
+    if settings:
+        print "Settings of source/ensemble/searches.py, with a margin of %.2f:" % (args.margin)
+        for setting in settings:
+            print "    " + setting
@@ -0,0 +1,243 @@
+#!/usr/bin/python
+
+"""
+Name:        pipeline.py
+Description: End-to-end benchmark of runE2P2.v3.1.py on synthetic proteomes, with the blastp and
+             PRIAM_search stand-ins of tools/bench/stubs in place of the real searches, so that
+             the time spent by the driver itself (parsing, ensemble, results files and .pf
+             translation) is measured without databases or network access.
+
+             The driver runs in a benchmark tree linked to this one. Its stages are delimited by
+             the progress lines it prints; for each stage the wall time, the CPU time of the
+             driver and of the searches it waited for, and the peak resident memory of the
+             driver are reported. Measurements can be stored as baselines and later runs checked
+             against them.
+
+Usage:       python pipeline.py [--sequences 10000,100000] [--work <directory>] [--driver-args "<options>"]
+                                [--save | --check] [--baselines <file>] [--tolerance 1.5]
+
+"""
+
+import json
+import os
+import shutil
+import subprocess
+import sys
+import threading
+import time
+from argparse import ArgumentParser
+
+import proteome
+
+bench_path = os.path.dirname(os.path.abspath(__file__))
+e2p2_path = os.path.dirname(os.path.dirname(bench_path))
+sys.path.insert(0, os.path.join(e2p2_path, 'source', 'ensemble'))
+import fasta
+
+# Progress lines of the driver, and the stage each of them starts. A stage lasts until the next
+# of these lines; "Operation complete." ends the last one.
+stage_lines = [("Reading input data.", "read input"),
+               ("Looking up sequences in the prediction cache.", "cache lookup"),
+               ("Running level-0 classification processes.", "level-0"),
+               ("Compiling predictions.", "parse level-0"),
+               ("Computing ensemble predictions.", "ensemble"),
+               ("Preparing results files.", "results files"),
+               ("Operation complete.", None)]
+stage_names = dict(stage_lines)
+
+clock_ticks = float(os.sysconf('SC_CLK_TCK'))
+sample_interval = 0.02
+
+# Slack added to the tolerance when checking against baselines, so that short stages do not
+# fail on noise: seconds for times, MiB for memory.
+time_slack = 0.5
+memory_slack = 16
+
+
+def build_tree(work_dir):
+    """
+    Links a benchmark copy of the E2P2 tree in work_dir, with the search stand-ins installed as
+    blastp and java. Returns the path of its driver.
+    """
+    tree = os.path.join(work_dir, "E2P2")
+    if os.path.exists(tree):
+        shutil.rmtree(tree)
+    source = os.path.join(tree, "source")
+    os.makedirs(source)
+    os.symlink(os.path.join(e2p2_path, "source", "ensemble", "runE2P2.v3.1.py"), os.path.join(tree, "runE2P2.v3.1.py"))
+    os.symlink(os.path.join(e2p2_path, "tools"), os.path.join(tree, "tools"))
+    for name in os.listdir(os.path.join(e2p2_path, "source")):
+        if name not in ("blast", "java", "priam"):
+            os.symlink(os.path.join(e2p2_path, "source", name), os.path.join(source, name))
+    for directory in [["blast", "ncbi-blast-2.2.30+", "bin"], ["blast", "blast-2.2.26", "bin"], ["blast", "db"],
+                      ["java", "jre1.6.0_30", "bin"], ["priam", "profiles"]]:
+        os.makedirs(os.path.join(source, *directory))
+    os.symlink(os.path.join(bench_path, "stubs", "blastp"), os.path.join(source, "blast", "ncbi-blast-2.2.30+", "bin", "blastp"))
+    os.symlink(os.path.join(bench_path, "stubs", "priam_search"), os.path.join(source, "java", "jre1.6.0_30", "bin", "java"))
+    open(os.path.join(source, "priam", "PRIAM_search.jar"), 'w').close()
+    return os.path.join(tree, "runE2P2.v3.1.py")
+
+
+def cpu_times(pid):
+    # Returns the CPU seconds of a process and of the children it has waited for.
+    stat = open("/proc/%d/stat" % pid).read()
+    fields = stat[stat.rindex(")") + 2:].split()
+    return (int(fields[11]) + int(fields[12])) / clock_ticks, (int(fields[13]) + int(fields[14])) / clock_ticks
+
+
+def memory(pid):
+    # Returns the resident and peak resident memory of a process, in MiB.
+    rss, hwm = 0, 0
+    for line in open("/proc/%d/status" % pid):
+        if line.startswith("VmRSS:"):
+            rss = int(line.split()[1]) / 1024.0
+        elif line.startswith("VmHWM:"):
+            hwm = int(line.split()[1]) / 1024.0
+    return rss, hwm
+
+
+class StageMonitor(object):
+    """
+    Samples the resident memory of the driver while it runs, and collects the measurements of
+    each stage as its progress lines arrive.
+    """
+    def __init__(self, pid):
+        self.pid = pid
+        self.lock = threading.Lock()
+        self.stages = []
+        self.stage = "startup"
+        self.start = time.time()
+        self.cpu, self.child_cpu = 0.0, 0.0
+        self.hwm = 0.0
+        self.peak = 0.0
+        self.running = True
+        self.sampler = threading.Thread(target=self.sample)
+        self.sampler.daemon = True
+        self.sampler.start()
+
+    def sample(self):
+        while self.running:
+            try:
+                rss, hwm = memory(self.pid)
+            except (IOError, OSError):
+                return
+            with self.lock:
+                self.peak = max(self.peak, rss)
+            time.sleep(sample_interval)
+
+    def next_stage(self, stage):
+        """
+        Ends the current stage and starts the given one (None for the end of the run).
+        """
+        now = time.time()
+        cpu, child_cpu = cpu_times(self.pid)
+        rss, hwm = memory(self.pid)
+        with self.lock:
+            peak = max(self.peak, rss)
+            # A stage that raised the high-water mark peaked at it, even between two samples.
+            if hwm > self.hwm:
+                peak = max(peak, hwm)
+            self.stages.append((self.stage, {"wall_s": round(now - self.start, 3),
+                                             "cpu_s": round(cpu - self.cpu, 3),
+                                             "child_cpu_s": round(child_cpu - self.child_cpu, 3),
+                                             "peak_rss_mb": round(peak, 1)}))
+            self.stage, self.start = stage, now
+            self.cpu, self.child_cpu, self.hwm = cpu, child_cpu, hwm
+            self.peak = rss
+
+    def stop(self):
+        self.running = False
+
+
+def run_driver(driver, input_path, work_dir, driver_args):
+    """
+    Runs the driver on a FASTA file and returns its stages with their measurements, in order,
+    and the total wall time.
+    """
+    run_dir = os.path.join(work_dir, "run")
+    if os.path.exists(run_dir):
+        shutil.rmtree(run_dir)
+    os.makedirs(run_dir)
+    # Every run indexes its input, rather than reusing the index of the previous run.
+    if os.path.exists(input_path + fasta.index_suffix):
+        os.remove(input_path + fasta.index_suffix)
+    env = dict(os.environ)
+    env["PYTHONUNBUFFERED"] = "1"
+    cmd = [sys.executable, driver, "-i", input_path, "-o", os.path.join(work_dir, "bench.out"), "-r", run_dir] + driver_args
+    start = time.time()
+    process = subprocess.Popen(cmd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, cwd=os.path.dirname(driver), env=env)
+    monitor = StageMonitor(process.pid)
+    output = []
+    for line in iter(process.stdout.readline, ""):
+        output.append(line)
+        text = line.strip()
+        if text in stage_names and monitor.stage is not None:
+            monitor.next_stage(stage_names[text])
+    monitor.stop()
+    status = process.wait()
+    wall = time.time() - start
+    if status != 0 or monitor.stage is not None:
+        sys.stdout.write("".join(output[-20:]))
+        raise RuntimeError("the driver failed with status %d on %s" % (status, input_path))
+    return monitor.stages, wall
+
+
+def report(count, stages, wall):
+    print "%d sequences: %.2f s" % (count, wall)
+    print "    %-16s %10s %10s %12s %12s" % ("stage", "wall s", "cpu s", "child cpu s", "peak RSS MiB")
+    for stage, m in stages:
+        print "    %-16s %10.2f %10.2f %12.2f %12.1f" % (stage, m["wall_s"], m["cpu_s"], m["child_cpu_s"], m["peak_rss_mb"])
+
+
+def check(count, stages, baseline, tolerance):
+    """
+    Returns the measurements of a run that exceed their baseline beyond the tolerance.
+    """
+    regressions = []
+    for stage, m in stages:
+        if stage not in baseline:
+            continue
+        for key, slack in [("wall_s", time_slack), ("cpu_s", time_slack), ("peak_rss_mb", memory_slack)]:
+            if m[key] > baseline[stage][key] * tolerance + slack:
+                regressions.append("%d sequences, %s, %s: %s (baseline %s)" % (count, stage, key, m[key], baseline[stage][key]))
+    return regressions
+
+
+if __name__ == '__main__':
+    parser = ArgumentParser(description='End-to-end benchmark of runE2P2.v3.1.py with stand-in searches.')
+    parser.add_argument('--sequences', default='10000,100000', help='comma-separated proteome sizes [10000,100000]')
+    parser.add_argument('--work', default='/tmp/e2p2-bench', help='directory of the benchmark tree, proteomes and runs')
+    parser.add_argument('--driver-args', default='', help='options added to the driver command line')
+    parser.add_argument('--baselines', default=os.path.join(bench_path, 'baselines.json'))
+    parser.add_argument('--save', action='store_true', help='store the measurements as baselines')
+    parser.add_argument('--check', action='store_true', help='exit with status 1 when a stage regressed against its baseline')
+    parser.add_argument('--tolerance', type=float, default=1.5, help='allowed ratio to the baselines [1.5]')
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.work):
+        os.makedirs(args.work)
+    driver = build_tree(args.work)
+    baselines = {}
+    if os.path.exists(args.baselines):
+        baselines = json.load(open(args.baselines))
+    regressions = []
+    for count in [int(c) for c in args.sequences.split(",")]:
+        # Proteomes are generated once per size and kept in the work directory.
+        input_path = os.path.join(args.work, "proteome_%d.fa" % count)
+        if not os.path.exists(input_path):
+            proteome.write_proteome(input_path, count)
+        stages, wall = run_driver(driver, input_path, args.work, args.driver_args.split())
+        report(count, stages, wall)
+        if args.check and str(count) in baselines:
+            regressions.extend(check(count, stages, baselines[str(count)], args.tolerance))
+        if args.save:
+            baselines[str(count)] = dict(stages)
+    if args.save:
+        with open(args.baselines, 'w') as fp:
+            json.dump(baselines, fp, indent=1, separators=(',', ': '), sort_keys=True)
+            fp.write("\n")
+        print "Baselines saved to %s" % (args.baselines)
+    for regression in regressions:
+        print "Regression: %s" % (regression)
+    if regressions:
+        sys.exit(1)
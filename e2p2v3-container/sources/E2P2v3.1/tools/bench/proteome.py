@@ -0,0 +1,59 @@
+#!/usr/bin/python
+
+"""
+Name:        proteome.py
+Description: Writes a synthetic proteome for benchmarks: sequences with log-normal lengths
+             (median 350 residues, 30 to 5000) drawn from a pool of random residues in natural
+             amino acid frequencies, 60 residues per line. The same count and seed always give
+             the same file.
+
+Usage:       python proteome.py <sequences> <output FASTA file> [seed]
+
+"""
+
+import math
+import random
+import sys
+
+# Amino acids and their approximate frequencies in UniProt, in percent.
+amino_acids = [("A", 8.3), ("R", 5.5), ("N", 4.1), ("D", 5.5), ("C", 1.4), ("Q", 3.9), ("E", 6.7),
+               ("G", 7.1), ("H", 2.3), ("I", 5.9), ("L", 9.7), ("K", 5.8), ("M", 2.4), ("F", 3.9),
+               ("P", 4.7), ("S", 6.6), ("T", 5.3), ("W", 1.1), ("Y", 2.9), ("V", 6.9)]
+pool_size = 1 << 20
+
+
+def residue_pool(r):
+    # Sequences are slices of a single pool, as drawing every residue would be far too slow for
+    # millions of sequences.
+    residues = "".join(aa * int(frequency * 10) for aa, frequency in amino_acids)
+    return "".join(r.choice(residues) for i in range(pool_size))
+
+
+def write_proteome(path, count, seed=0):
+    """
+    Writes count synthetic protein sequences to path. Returns the number of residues written.
+    """
+    r = random.Random(seed)
+    pool = residue_pool(r)
+    total = 0
+    output = open(path, 'w', 1 << 20)
+    for i in range(count):
+        length = int(min(5000, max(30, r.lognormvariate(math.log(350), 0.6))))
+        start = r.randint(0, pool_size - length)
+        sequence = pool[start:start + length]
+        lines = [sequence[j:j + 60] for j in range(0, length, 60)]
+        output.write(">BENCH%07d synthetic protein %d\n%s\n" % (i, i, "\n".join(lines)))
+        total += length
+    output.close()
+    return total
+
+
+if __name__ == '__main__':
+    if len(sys.argv) < 3:
+        print "Usage: python proteome.py <sequences> <output FASTA file> [seed]"
+        sys.exit(1)
+    seed = 0
+    if len(sys.argv) > 3:
+        seed = int(sys.argv[3])
+    residues = write_proteome(sys.argv[2], int(sys.argv[1]), seed)
+    print "Wrote %s sequences (%d residues) to %s" % (sys.argv[1], residues, sys.argv[2])
@@ -0,0 +1,317 @@
+#!/usr/bin/python
+
+"""
+Name:        check_ensemble_binary.py
+Description: Regression check of the binary average weight ensemble schemes of
+             source/ensemble/ensemble.py against the implementation they replaced, kept below.
+             Random sequences are scored by both with 1 to 4 classifiers, entries missing or
+             empty, repeated EF classes and EF classes without a weight, and with several
+             thresholds, the previous implementation reading the weights as strings as it was
+             given them; a few cases pin the EF class charged for a missing vote, which is the
+             last one predicted by the classifier or the closest earlier one. Predictions and
+             classifier entries must be identical.
+
+Usage:       python check_ensemble_binary.py [sequences]
+
+"""
+
+import os
+import random
+import sys
+
+e2p2_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(e2p2_path, 'source', 'ensemble'))
+import ensemble
+
+thresholds = {"absolute": [0.0, 0.1, 0.5], "percent": [0.0, 0.25, 0.75]}
+
+
+class Classifier:
+    def __init__(self, id):
+        self.id = id
+        self.predictions = {}
+        self.weights = {}
+
+
+class FinalPredictions():
+    def __init__(self, n):
+        self.name = n
+
+
+# The implementation of the schemes before the subtraction pass.
+def perform_binary_avg_weight_absolute_threshold(sequence_id, classifiers, threshold):
+    """
+    This function reads in a sequence ID and a set of classifier objects. For each sequence ID,
+    it will produce a final enzyme function class prediction via an binary average weight voting scheme, 
+    in which the chosen prediction is the one that has the greatest average weight associated with 
+    it. Weights are performance measures obtained from training data. Note that a numerical threshold 
+    can be invoked that would allow other votes within a certain range of the winning weight to also 
+    be included in the final prediction. This threshold allows for the presence of multi-function
+    enzymes.
+    """
+    # Instantiate a final prediction object.
+    fpred = FinalPredictions(sequence_id)
+    fpred.predictions = []
+    fpred.classifiers = {}
+        
+    # Get all predicted classes for that sequence from all classifiers.
+    votes = {}
+    total_votes = 0
+    all_ef = {}
+    for cname in classifiers:
+        c = classifiers[cname]
+        if sequence_id in c.predictions:
+            temp = []
+            # Record classifier's predictions and weights for that ID for voting and for output.
+            for ef_class in c.predictions[sequence_id]:
+                try:
+                    ef_weight = c.weights[ef_class]
+                except:
+                    ef_weight = "0.000"
+                # For each vote, add its weight. Keep track of all votes cast.
+                total_votes += 1
+                all_ef[ef_class] = 1
+                if votes.has_key(ef_class):
+                    votes[ef_class] += float(ef_weight)
+                else:
+                    votes[ef_class] = float(ef_weight)
+                # The classifiers attribute will be used in outputting the full results. 
+                entry = "%s (%s)" % (ef_class, ef_weight)
+                temp.append(entry)
+            fpred.classifiers[cname] = temp
+    
+    for ef in all_ef:
+        for cname in classifiers:
+            c = classifiers[cname]
+            if sequence_id in c.predictions:
+                seqpred = {}
+                for ef_class in c.predictions[sequence_id]:
+                    seqpred[ef_class] = 1
+                if not seqpred.has_key(ef):
+                    try:
+                        ef_weight = c.weights[ef_class]
+                    except:
+                        ef_weight = "0.000"
+                    if votes.has_key(ef_class):
+                        votes[ef_class] -= float(ef_weight)
+                    else:
+                        votes[ef_class] = -float(ef_weight)
+            else:
+                try:
+                    ef_weight = c.weights[ef_class]
+                except:
+                    ef_weight = "0.000"
+                if votes.has_key(ef_class):
+                    votes[ef_class] -= float(ef_weight)
+                else:
+                    votes[ef_class] = 0-float(ef_weight)
+    
+
+    # Add routines to find no-vote and single-vote events.
+    # Check to see if any votes were recorded.
+    x = len(votes)
+    if x < 1:
+        fpred.predictions.append("NA")
+    else:
+        # For each vote, find its average weight.
+        avg_weights = {}
+        for ef_class in votes:
+            total_weight = votes[ef_class]
+            avg_weights[ef_class] = float(total_weight/2)
+         
+        # Sort the votes from highest average weight to lowest.
+        sorted_avg_weights = sorted(avg_weights.iteritems(), key=lambda (k,v): (v, k), reverse=True)   
+        high_class = sorted_avg_weights[0][0]
+        high_weight = sorted_avg_weights[0][1]
+        entry = "%s (%s)" % (high_class, str(high_weight))
+        fpred.predictions.append(entry)
+     
+        # Iterate through the votes to find all votes with average weights within the threshold
+        # of the top weight.
+        t = float(high_weight - threshold)
+        if t < 0.0:
+            t = 0.0
+        for class_weight_pair in sorted_avg_weights[1:]: #The top class has already been recorded.
+            ef_class = class_weight_pair[0]
+            weight = class_weight_pair[1]
+            if float(weight) >= t:
+                entry = "%s (%s)" % (ef_class, weight)
+                fpred.predictions.append(entry)
+    return(fpred)
+
+
+def perform_binary_avg_weight_percent_threshold(sequence_id, classifiers, threshold):
+    """
+    This function reads in a sequence ID and a set of classifier objects. For each sequence ID,
+    it will produce a final enzyme function class prediction via an binary average weight voting scheme, 
+    in which the chosen prediction is the one that has the greatest average weight associated with 
+    it. Weights are performance measures obtained from training data. Note that a numerical threshold 
+    can be invoked that would allow other votes within a certain range of the winning weight to also 
+    be included in the final prediction. This threshold allows for the presence of multi-function
+    enzymes.
+    """
+    # Instantiate a final prediction object.
+    fpred = FinalPredictions(sequence_id)
+    fpred.predictions = []
+    fpred.classifiers = {}
+        
+    # Get all predicted classes for that sequence from all classifiers.
+    votes = {}
+    total_votes = 0
+    all_ef = {}
+    for cname in classifiers:
+        c = classifiers[cname]
+        if sequence_id in c.predictions:
+            temp = []
+            # Record classifier's predictions and weights for that ID for voting and for output.
+            for ef_class in c.predictions[sequence_id]:
+                try:
+                    ef_weight = c.weights[ef_class]
+                except:
+                    ef_weight = "0.000"
+                # For each vote, add its weight. Keep track of all votes cast.
+                total_votes += 1
+                all_ef[ef_class] = 1
+                if votes.has_key(ef_class):
+                    votes[ef_class] += float(ef_weight)
+                else:
+                    votes[ef_class] = float(ef_weight)
+                # The classifiers attribute will be used in outputting the full results. 
+                entry = "%s (%s)" % (ef_class, ef_weight)
+                temp.append(entry)
+            fpred.classifiers[cname] = temp
+    
+    for ef in all_ef:
+        for cname in classifiers:
+            c = classifiers[cname]
+            if sequence_id in c.predictions:
+                seqpred = {}
+                for ef_class in c.predictions[sequence_id]:
+                    seqpred[ef_class] = 1
+                if not seqpred.has_key(ef):
+                    try:
+                        ef_weight = c.weights[ef_class]
+                    except:
+                        ef_weight = "0.000"
+                    if votes.has_key(ef_class):
+                        votes[ef_class] -= float(ef_weight)
+                    else:
+                        votes[ef_class] = -float(ef_weight)
+            else:
+                try:
+                    ef_weight = c.weights[ef_class]
+                except:
+                    ef_weight = "0.000"
+                if votes.has_key(ef_class):
+                    votes[ef_class] -= float(ef_weight)
+                else:
+                    votes[ef_class] = -float(ef_weight)
+    
+
+    # Add routines to find no-vote and single-vote events.
+    # Check to see if any votes were recorded.
+    x = len(votes)
+    if x < 1:
+        fpred.predictions.append("NA")
+    else:
+        # For each vote, find its average weight.
+        avg_weights = {}
+        for ef_class in votes:
+            total_weight = votes[ef_class]
+            avg_weights[ef_class] = float(total_weight/2)
+         
+        # Sort the votes from highest average weight to lowest.
+        sorted_avg_weights = sorted(avg_weights.iteritems(), key=lambda (k,v): (v, k), reverse=True)   
+        high_class = sorted_avg_weights[0][0]
+        high_weight = sorted_avg_weights[0][1]
+        entry = "%s (%s)" % (high_class, str(high_weight))
+        fpred.predictions.append(entry)
+     
+        # Iterate through the votes to find all votes with average weights within the threshold
+        # of the top weight.
+        t = high_weight * ( float(1 - (float(threshold)/float(100)) ) ) 
+        if t < 0.0:
+            t = 0.0
+        for class_weight_pair in sorted_avg_weights[1:]: #The top class has already been recorded.
+            ef_class = class_weight_pair[0]
+            weight = class_weight_pair[1]
+            if float(weight) >= t:
+                entry = "%s (%s)" % (ef_class, weight)
+                fpred.predictions.append(entry)
+    return(fpred)
+
+reference = {"absolute": perform_binary_avg_weight_absolute_threshold,
+             "percent": perform_binary_avg_weight_percent_threshold}
+current = {"absolute": ensemble.perform_binary_avg_weight_absolute_threshold,
+           "percent": ensemble.perform_binary_avg_weight_percent_threshold}
+
+
+def score_before(scheme, classifiers, threshold):
+    # Scores with the previous implementation, given the weights as it was: the strings of the
+    # weights file, with three decimals, rather than floats. The same classifiers dictionary is
+    # used, as the schemes depend on its order.
+    weights = dict((cname, classifiers[cname].weights) for cname in classifiers)
+    try:
+        for cname in classifiers:
+            classifiers[cname].weights = dict((ef_class, "%.3f" % weight) for ef_class, weight in weights[cname].items())
+        return reference[scheme]("Q", classifiers, threshold)
+    finally:
+        for cname in classifiers:
+            classifiers[cname].weights = weights[cname]
+
+
+def random_classifiers(r, sequence_id):
+    # Classifiers predicting EF classes of a small pool, so that they often agree and repeat.
+    pool = ["EF%05d" % i for i in range(r.randint(1, 8))]
+    classifiers = {}
+    for cname in ["BLAST", "Priam", "CatFam", "PsiBlast"][:r.randint(1, 4)]:
+        c = Classifier(cname)
+        for ef_class in pool:
+            if r.random() < 0.7:
+                c.weights[ef_class] = round(r.random(), 3)
+        entry = r.random()
+        if entry < 0.15:
+            pass
+        elif entry < 0.25:
+            c.predictions[sequence_id] = []
+        else:
+            c.predictions[sequence_id] = [r.choice(pool) for i in range(r.randint(1, 4))]
+        classifiers[cname] = c
+    return classifiers
+
+
+def fixed_cases():
+    # The EF class charged for a missing vote is the last one of the classifier, or of the closest
+    # earlier classifier predicting any, whatever EF class is missing.
+    cases = []
+    for first, second in [(["EF1", "EF2"], ["EF3"]), (["EF1"], []), (["EF2", "EF1", "EF2"], None), ([], ["EF1", "EF3"])]:
+        a, b = Classifier("BLAST"), Classifier("Priam")
+        a.weights = {"EF1": 0.9, "EF2": 0.4, "EF3": 0.7}
+        b.weights = {"EF1": 0.2, "EF3": 0.6}
+        a.predictions["Q"] = first
+        if second is not None:
+            b.predictions["Q"] = second
+        cases.append({"BLAST": a, "Priam": b})
+    return cases
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 9000
+    r = random.Random(0)
+    cases = fixed_cases() + [random_classifiers(r, "Q") for i in range(count)]
+    checked, mismatches = 0, []
+    for i, classifiers in enumerate(cases):
+        for scheme in ["absolute", "percent"]:
+            for threshold in thresholds[scheme]:
+                expected = score_before(scheme, classifiers, threshold)
+                actual = current[scheme]("Q", classifiers, threshold)
+                checked += 1
+                if (expected.predictions, expected.classifiers) != (actual.predictions, actual.classifiers):
+                    mismatches.append("case %d, %s threshold %s: %r (expected %r)" % (
+                        i, scheme, threshold, actual.predictions, expected.predictions))
+    print "%d sequence and threshold cases checked" % (checked)
+    for mismatch in mismatches[:20]:
+        print "Mismatch: %s" % (mismatch)
+    if mismatches:
+        sys.exit(1)
+    print "Predictions identical to the previous implementation."
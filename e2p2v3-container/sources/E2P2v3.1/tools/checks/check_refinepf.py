@@ -0,0 +1,83 @@
+#!/usr/bin/python
+
+"""
+Name:        check_refinepf.py
+Description: Regression check of remove_empty_from_pf (source/ensemble/refinepf.py) against the
+             in-memory implementation it replaced, kept below. Random pf files with empty entries
+             and IDs repeated with different attributes are refined by both, with buffer sizes
+             small enough for the external sort to spill several runs, and the files written
+             must be identical: the first entry of each ID kept, sorted by ID.
+
+Usage:       python check_refinepf.py [files per buffer size]
+
+"""
+
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+
+e2p2_path = os.path.dirname(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.join(e2p2_path, 'source', 'ensemble'))
+import refinepf
+
+# Buffer sizes, in bytes, from in-memory only to a run per entry.
+buffer_sizes = [refinepf.buffer_size, 200, 1]
+
+
+def reference_remove_empty_from_pf(pf_path):
+    # The implementation of remove_empty_from_pf before the external sort.
+    refined_dict = {}
+    exist_empty = False
+    for e2p2_id, e2p2_attr in refinepf.read_pf(open(pf_path, 'r')):
+        if re.findall(r'METACYC\t[^\s]+\n', e2p2_attr):
+            refined_dict.setdefault(e2p2_id, e2p2_attr)
+        else:
+            exist_empty = True
+    if exist_empty:
+        with open(pf_path, 'w') as fp:
+            for e2p2_id in sorted(refined_dict.keys()):
+                fp.write(e2p2_id + '\n' + refined_dict[e2p2_id] + '\n')
+
+
+def write_pf(path, r):
+    # Entries of a few IDs, so that most are repeated, with 0 to 3 reactions each.
+    with open(path, 'w') as fp:
+        for i in range(r.randint(1, 60)):
+            fp.write("ID\tP%d\nNAME\tP%d\n" % (r.randint(0, 15), i))
+            fp.write("EC\t1.%d\n" % (r.randint(0, 9)))
+            for j in range(r.randint(0, 3)):
+                fp.write("METACYC\tRXN-%d\n" % (r.randint(0, 99)))
+            fp.write("//\n")
+
+
+if __name__ == '__main__':
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 200
+    work = tempfile.mkdtemp()
+    mismatches = 0
+    try:
+        for size in buffer_sizes:
+            r = random.Random(size)
+            for i in range(count):
+                expected, actual = os.path.join(work, "expected.pf"), os.path.join(work, "actual.pf")
+                write_pf(expected, r)
+                shutil.copy(expected, actual)
+                reference_remove_empty_from_pf(expected)
+                sys.stdout = open(os.devnull, 'w')
+                try:
+                    refinepf.remove_empty_from_pf(actual, size)
+                finally:
+                    sys.stdout = sys.__stdout__
+                if open(expected).read() != open(actual).read():
+                    mismatches += 1
+                if sorted(os.listdir(work)) != ["actual.pf", "expected.pf"]:
+                    raise RuntimeError("temporary files left in %s" % (work))
+            print("buffer size %d: %d files checked" % (size, count))
+    finally:
+        shutil.rmtree(work)
+    if mismatches:
+        print("%d files differ from the previous implementation" % (mismatches))
+        sys.exit(1)
+    print("Refined pf files identical to the previous implementation.")
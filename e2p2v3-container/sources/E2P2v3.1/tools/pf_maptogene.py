@@ -1,4 +1,5 @@
 from argparse import ArgumentParser
+import multiprocessing
 import os
 
 
@@ -18,28 +19,36 @@ def read_map_file(file_path):
 
 
 def reade2p2(e2p2_output):
-    e2p2_id, e2p2_attr = "", ""
+    # Attribute lines are collected in a list and joined once per record.
+    e2p2_id, e2p2_attr = "", []
     for line in e2p2_output:
         if line.startswith("ID\t"):
             if len(e2p2_id) > 0:
-                yield e2p2_id, e2p2_attr
-            e2p2_id, e2p2_attr = line, ""
+                yield e2p2_id, "".join(e2p2_attr)
+            e2p2_id, e2p2_attr = line, []
         else:
-            e2p2_attr += line
+            e2p2_attr.append(line)
     if len(e2p2_id) > 0:
-        yield e2p2_id, e2p2_attr
+        yield e2p2_id, "".join(e2p2_attr)
+
+
+def missing_report_path(file_input):
+    return os.path.splitext(file_input)[0] + '.missing.txt'
 
 
 def mapprotein_to_gene(file_input, prot_gene_map):
+    # Writes <name>.revised.pf, and the IDs and NAMEs missing from the map to <name>.missing.txt.
+    # Returns the number of records written and of missing IDs and NAMEs.
     output_path = os.path.splitext(file_input)[0] + '.revised.pf'
-    with open(file_input, 'r') as fp, open(output_path, 'w') as op:
+    written, missing = 0, []
+    with open(file_input, 'r') as fp, open(output_path, 'w', 1 << 20) as op:
         for e2p2_id, e2p2_attr in reade2p2(fp):
             id_to_write = 0
             unique_id = e2p2_id.replace('ID', '').replace('\\', '').strip()
             try:
                 mapped_id = prot_gene_map[unique_id]
             except KeyError:
-                print(unique_id, 'ID not found in map.')
+                missing.append('ID\t' + unique_id)
                 continue
             info = e2p2_attr.strip().replace('\n//', '').split('\n')
             for attr_line in info:
@@ -52,22 +61,65 @@ def mapprotein_to_gene(file_input, prot_gene_map):
                         id_to_write = 1
                         continue
                     except KeyError:
-                        print(attr[1], "NAME not found in map")
+                        missing.append('NAME\t' + attr[1])
                         id_to_write = 0
                         break
                 if id_to_write == 1:
                     op.write(attr_line + '\n')
             if id_to_write == 1:
                 op.write('//\n')
+                written += 1
+
+    report_path = missing_report_path(file_input)
+    if missing:
+        with open(report_path, 'w') as rp:
+            rp.write(''.join(m + '\n' for m in missing))
+    elif os.path.exists(report_path):
+        os.remove(report_path)
+    missing_ids = len([m for m in missing if m.startswith('ID\t')])
+    return written, missing_ids, len(missing) - missing_ids
+
+
+# Map shared with the worker processes, which are forked once it is loaded.
+shared_map = None
+
+
+def remap(file_input):
+    return file_input, mapprotein_to_gene(file_input, shared_map)
 
 
 def main():
-    parser = ArgumentParser()
-    parser.add_argument("file_input")
-    parser.add_argument("prot_gene_map_path")
+    global shared_map
+    parser = ArgumentParser(description='Replaces protein IDs by gene IDs in pf files. Either one pf file '
+                                        'followed by the map file, or any number of pf files with --map.')
+    parser.add_argument("paths", nargs='+', metavar="file_input")
+    parser.add_argument("-m", "--map", dest="prot_gene_map_path", help="protein to gene map")
+    parser.add_argument("-j", "--jobs", type=int, default=1, help="number of pf files remapped in parallel")
 
     args = parser.parse_args()
-    mapprotein_to_gene(args.file_input, read_map_file(args.prot_gene_map_path))
+    file_inputs = args.paths
+    prot_gene_map_path = args.prot_gene_map_path
+    if prot_gene_map_path is None:
+        if len(file_inputs) < 2:
+            parser.error("the map file is required")
+        prot_gene_map_path = file_inputs.pop()
+
+    shared_map = read_map_file(prot_gene_map_path)
+    if args.jobs > 1 and len(file_inputs) > 1:
+        pool = multiprocessing.Pool(min(args.jobs, len(file_inputs)))
+        results = pool.imap_unordered(remap, file_inputs)
+    else:
+        pool = None
+        results = (remap(file_input) for file_input in file_inputs)
+    for file_input, (written, missing_ids, missing_names) in results:
+        line = '%s: %d records written' % (file_input, written)
+        if missing_ids or missing_names:
+            line += ', %d IDs and %d NAMEs not found in map (see %s)' % (
+                missing_ids, missing_names, missing_report_path(file_input))
+        print(line)
+    if pool is not None:
+        pool.close()
+        pool.join()
 
 
 if __name__ == '__main__':